@@ -149,6 +149,10 @@ class ChatApp {
                     } else if (chunk.type === 'status') {
                         // AI 状态更新
                         this.updateStatusPanel(chunk.data?.status || '');
+                    } else if (chunk.type === 'plan_step') {
+                        // 规划步骤边生成边展示，完整计划仍以 waiting_for_approval 为准
+                        const index = Number(chunk.data?.index ?? 0) + 1;
+                        this.updateStatusPanel(`规划步骤${index}：${this.escapeHtml(chunk.data?.step || '')}`);
                     } else if (chunk.type === 'chunk') {
                         // 兼容旧版 chunk 事件
                         if (chunk.data.response) {
@@ -1,7 +1,12 @@
+import asyncio
 import json
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, Optional
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
 from pojo.request.chat_request import ChatRequest
 from pojo.request.conversation_add_request import ConversationAddRequest
@@ -11,38 +16,86 @@ from pojo.request.conversation_select_request import ConversationSelectRequest
 from pojo.request.approve_request import ApproveRequest
 
 from service.assistant_service import AssistantService
+from service.event_pump import HEARTBEAT
+from service.job_runner import Job, JobQueueFullError
+from service.sse_encoder import sse_encoder
+from service.stream_session import StreamSession, Subscriber
 from utils.api_response_uti import build_response
+from utils.logger_util import logger
+from utils.metrics_util import metrics
 
 router = APIRouter()
 assistant_service = AssistantService()
 
+# 每个 WebSocket 连接待发送的帧数上限（客户端读取过慢时订阅落后，超过 SSE_SUBSCRIBER_BUFFER 后该订阅被断开，不影响运行）
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "64"))
+# 每个 WebSocket 连接同时订阅的运行数上限
+WS_MAX_RUNS = int(os.getenv("WS_MAX_RUNS", "16"))
 
-async def event_generator(request: ChatRequest, http_request: Request):
-    """生成 SSE 事件"""
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+async def watch_disconnect(http_request: Request, subscriber: Subscriber):
+    """等待 http.disconnect，客户端断开时立即通知服务，而不是等到下一次写入失败才发现"""
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            assistant_service.client_disconnected(subscriber)
+            return
+
+
+async def stream_events(session: StreamSession, last_event_id: Optional[int], http_request: Request,
+                        open_events: Callable[[Subscriber], AsyncIterator]):
+    """订阅会话并把 (事件 id, 事件) 编码为 SSE 帧（bytes）
+
+    订阅在响应开始发送时才创建；客户端断开时结束订阅（见 AssistantService.client_disconnected），
+    同一运行的其他订阅者不受影响
+    """
+    subscriber = session.attach(last_event_id)
+    events = open_events(subscriber)
+    watcher = asyncio.create_task(watch_disconnect(http_request, subscriber))
     try:
-        async for chunk in assistant_service.chat(request):
-            # 检查客户端是否断开
-            if await http_request.is_disconnected():
-                break
-            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        async with aclosing(events):
+            async for event_id, chunk in events:
+                if watcher.done():
+                    break
+                yield sse_encoder.encode(event_id, chunk)
+    except (asyncio.CancelledError, GeneratorExit):
+        # 写入失败或被 Starlette 取消，同样说明客户端已断开
+        assistant_service.client_disconnected(subscriber)
+        raise
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'data': {'message': str(e)}}, ensure_ascii=False)}\n\n"
+        yield sse_encoder.error(str(e))
+    finally:
+        watcher.cancel()
+        subscriber.close()
+
+
+def run_stream_response(job: Job, http_request: Request, last_event_id: Optional[int] = None) -> StreamingResponse:
+    """运行的 SSE 响应，响应头 X-Run-Id 带上运行 id"""
+    return StreamingResponse(
+        stream_events(job.session, last_event_id, http_request,
+                      lambda subscriber: assistant_service.subscribe_run(job, last_event_id, subscriber)),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Run-Id": job.run_id}
+    )
 
 
 @router.post("/chat", summary='聊天助手')
 async def chat(request: ChatRequest, http_request: Request):
-    """SSE实现流式输出"""
+    """提交聊天运行并以 SSE 流式输出；排队已满时返回 503"""
     if assistant_service is None:
         raise RuntimeError("AssistantService 未初始化")
-    return StreamingResponse(
-        event_generator(request, http_request),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
-    )
+    try:
+        job = await assistant_service.submit_chat(request)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return run_stream_response(job, http_request)
 
 
 @router.post("/conversation/add", summary="新增对话")
@@ -69,29 +122,201 @@ async def delete_conversation(request: ConversationDeleteRequest):
     return build_response(await assistant_service.delete_conversation(request))
 
 
-async def approve_event_generator(request: ApproveRequest, http_request: Request):
-    """审批 SSE 事件生成器"""
+@router.post("/approve", summary="审批规划")
+async def approve(request: ApproveRequest, http_request: Request):
+    """用户审批规划（批准/修改/取消），提交继续执行的运行；排队已满时返回 503"""
     try:
-        async for chunk in assistant_service.approve(request):
-            if await http_request.is_disconnected():
-                break
-            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
-    except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'data': {'message': str(e)}}, ensure_ascii=False)}\n\n"
+        job = await assistant_service.submit_approve(request)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return run_stream_response(job, http_request)
 
 
-@router.post("/approve", summary="审批规划")
-async def approve(request: ApproveRequest, http_request: Request):
-    """用户审批规划（批准/修改/取消）"""
+@router.get("/chat/resume", summary="续传聊天流")
+async def resume_chat(http_request: Request, thread_id: str, last_event_id: Optional[int] = None,
+                      last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """断线重连：补发 Last-Event-ID（请求头或 last_event_id 参数）之后的事件，再接上实时流"""
+    last_event_id = parse_last_event_id(last_event_id, last_event_id_header)
+    session = assistant_service.get_stream(thread_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"线程 {thread_id} 没有可续传的流")
     return StreamingResponse(
-        approve_event_generator(request, http_request),
+        stream_events(session, last_event_id, http_request,
+                      lambda subscriber: assistant_service.resume(thread_id, last_event_id, subscriber)),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
+        headers=SSE_HEADERS
     )
 
 
+def parse_last_event_id(last_event_id: Optional[int], last_event_id_header: Optional[str]) -> Optional[int]:
+    """last_event_id 参数优先，其次 Last-Event-ID 请求头"""
+    if last_event_id is None and last_event_id_header:
+        try:
+            return int(last_event_id_header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的 Last-Event-ID：{last_event_id_header}")
+    return last_event_id
+
+
+def get_job(run_id: str) -> Job:
+    job = assistant_service.get_run(run_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"运行 {run_id} 不存在")
+    return job
+
+
+@router.get("/runs/{run_id}", summary="查询运行状态")
+async def get_run(run_id: str):
+    """查询运行状态（queued/running/succeeded/failed/cancelled）"""
+    return build_response(get_job(run_id).to_dict())
+
+
+@router.get("/runs/{run_id}/events", summary="订阅运行事件")
+async def run_events(run_id: str, http_request: Request, last_event_id: Optional[int] = None,
+                     last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """按运行 id 订阅事件；带 Last-Event-ID 时补发之后的事件再接上实时流"""
+    last_event_id = parse_last_event_id(last_event_id, last_event_id_header)
+    return run_stream_response(get_job(run_id), http_request, last_event_id)
+
+
+@router.post("/runs/{run_id}/cancel", summary="取消运行")
+async def cancel_run(run_id: str):
+    """取消排队中或执行中的运行"""
+    get_job(run_id)
+    return build_response(assistant_service.cancel_run(run_id).to_dict())
+
+
+class WebSocketConnection:
+    """一个 WebSocket 连接上多路复用的运行
+
+    客户端消息（JSON 文本帧，ref 由客户端指定，用于对应回复）：
+    - {"op": "chat", "ref": 1, "data": ChatRequest}
+    - {"op": "approve", "ref": 2, "data": ApproveRequest}
+    - {"op": "subscribe", "ref": 3, "run_id": "...", "last_event_id": 12}（断线重连后续传）
+    - {"op": "cancel", "ref": 4, "run_id": "..."}
+
+    服务端帧：
+    - 回复：{"ref": 1, "run": "..."} 或 {"ref": 1, "error": "...", "code": 503}
+    - 事件：{"run": "...", "id": 事件 id, "event": 与 SSE 相同的事件}；心跳由 WebSocket ping 代替，不发送
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # 所有运行的帧经同一个有界队列由一个任务发送
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+        self.runs: Dict[str, asyncio.Task] = {}
+        self.subscribers: Dict[str, Subscriber] = {}
+
+    async def serve(self):
+        await self.websocket.accept()
+        metrics.inc("ws_connections")
+        sender = asyncio.create_task(self._send_loop())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None:
+                    # 二进制帧：回复错误，连接保持
+                    await self._reply(None, error="只支持 JSON 文本帧", code=400)
+                    continue
+                await self._dispatch(text)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
+            for subscriber in list(self.subscribers.values()):
+                assistant_service.client_disconnected(subscriber)
+            for task in self.runs.values():
+                task.cancel()
+            await asyncio.gather(sender, *self.runs.values(), return_exceptions=True)
+
+    async def _send_loop(self):
+        while True:
+            await self.websocket.send_text(await self.outbox.get())
+
+    async def _reply(self, ref, **fields):
+        await self.outbox.put(json.dumps({"ref": ref, **fields}, ensure_ascii=False, separators=(",", ":")))
+
+    async def _dispatch(self, text: str):
+        try:
+            message = json.loads(text)
+            op = message.get("op")
+            ref = message.get("ref")
+        except (ValueError, AttributeError):
+            await self._reply(None, error="无效的消息", code=400)
+            return
+
+        try:
+            if op in ("chat", "approve"):
+                data = message.get("data", {})
+                if not isinstance(data, dict):
+                    await self._reply(ref, error="data 必须是对象", code=400)
+                    return
+                if len(self.runs) >= WS_MAX_RUNS:
+                    await self._reply(ref, error=f"同时订阅的运行已达上限（{WS_MAX_RUNS}）", code=429)
+                    return
+                if op == "chat":
+                    job = await assistant_service.submit_chat(ChatRequest(**data))
+                else:
+                    job = await assistant_service.submit_approve(ApproveRequest(**data))
+                await self._reply(ref, run=job.run_id)
+                self._subscribe(job)
+            elif op == "subscribe":
+                job = assistant_service.get_run(str(message.get("run_id")))
+                if job is None:
+                    await self._reply(ref, error="运行不存在", code=404)
+                    return
+                await self._reply(ref, run=job.run_id)
+                self._subscribe(job, message.get("last_event_id"))
+            elif op == "cancel":
+                job = assistant_service.cancel_run(str(message.get("run_id")))
+                if job is None:
+                    await self._reply(ref, error="运行不存在", code=404)
+                    return
+                await self._reply(ref, run=job.run_id, status=job.status)
+            else:
+                await self._reply(ref, error=f"未知的操作：{op}", code=400)
+        except ValidationError as e:
+            await self._reply(ref, error=str(e), code=400)
+        except JobQueueFullError as e:
+            await self._reply(ref, error=str(e), code=503)
+        except Exception as e:
+            logger.error(f"WebSocket 处理 {op} 失败: {e}")
+            await self._reply(ref, error=str(e), code=500)
+
+    def _subscribe(self, job: Job, last_event_id: Optional[int] = None):
+        # 先挂上新的订阅者再结束旧的，运行不会因为短暂没有订阅者而被取消
+        subscriber = job.session.attach(last_event_id)
+        previous = self.runs.pop(job.run_id, None)
+        if previous is not None:
+            self.subscribers.pop(job.run_id).close()
+            previous.cancel()
+        self.subscribers[job.run_id] = subscriber
+        self.runs[job.run_id] = asyncio.create_task(self._forward(job, last_event_id, subscriber))
+
+    async def _forward(self, job: Job, last_event_id: Optional[int], subscriber: Subscriber):
+        """把运行的事件写入发送队列；队列满时该订阅等待并落后，落后过多时收到 lagged 错误后结束"""
+        try:
+            async with aclosing(assistant_service.subscribe_run(job, last_event_id, subscriber)) as events:
+                async for event_id, event in events:
+                    if event is HEARTBEAT:
+                        continue
+                    await self.outbox.put(sse_encoder.encode_ws(job.run_id, event_id, event))
+        finally:
+            if self.runs.get(job.run_id) is asyncio.current_task():
+                del self.runs[job.run_id]
+                del self.subscribers[job.run_id]
+
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """一个长连接上多路复用多个线程的聊天、审批、续传和取消（协议见 WebSocketConnection）"""
+    await WebSocketConnection(websocket).serve()
+
 
+@router.get("/metrics", summary="运行指标")
+async def get_metrics():
+    """查询进程内运行指标（缓存命中、耗时等）"""
+    return build_response(metrics.snapshot())
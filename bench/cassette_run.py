@@ -0,0 +1,155 @@
+"""
+录制一次完整的对话，然后离线回放，用于确定性的全图性能回归
+
+录制（访问真实的 LLM、MCP 服务和记忆库）：
+    python -m bench.cassette_run record --question "帮我规划杭州三日游" --cassette bench/cassettes/hangzhou.json.gz
+
+回放（不访问任何上游，按最快速度重放，输出耗时分位数）：
+    python -m bench.cassette_run replay --cassette bench/cassettes/hangzhou.json.gz --repeat 20
+
+每次运行依次调用 AssistantService.chat 和 approve（自动批准计划），使用内存 checkpointer；
+回放时 token、计划步骤和工具结果与录制时一致，可用 --check 校验。
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from contextlib import aclosing
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from graph.cassette import Cassette, RECORD, use_cassette
+from graph.hedging import percentile
+from graph.plan_cache import plan_cache
+from graph.speculative import speculative_executor
+from pojo.request.approve_request import ApproveRequest
+from pojo.request.chat_request import ChatRequest
+from service.assistant_service import AssistantService
+
+# 回放结果比对时忽略的事件
+_IGNORED_EVENTS = ("heartbeat",)
+
+
+async def run_once(service: AssistantService, question: str, user_id: int) -> list:
+    """跑完一次对话（遇到审批时自动批准），返回事件列表"""
+    thread_id = uuid.uuid4().hex
+    events = []
+    waiting = False
+    request = ChatRequest(question=question, thread_id=thread_id, user_id=user_id)
+    async with aclosing(service.chat(request)) as stream:
+        async for _, event in stream:
+            if event["type"] in _IGNORED_EVENTS:
+                continue
+            events.append(event)
+            if event["type"] in ("waiting_for_approval", "workflow_end"):
+                waiting = event["type"] == "waiting_for_approval"
+                break
+
+    if waiting:
+        request = ApproveRequest(thread_id=thread_id, approved=True, plan=[], cancelled=False)
+        async for _, event in service.approve(request):
+            if event["type"] in _IGNORED_EVENTS:
+                continue
+            events.append(event)
+    return events
+
+
+def _normalize(events: list) -> list:
+    """合并同一节点的连续 token（token 合并与时序有关，帧的切分每次可能不同），去掉带运行 id 的 run 事件"""
+    merged = []
+    for event in events:
+        if event["type"] == "run":
+            continue
+        last = merged[-1] if merged else None
+        if event["type"] == "token" and last and last["type"] == "token" and last.get("node") == event.get("node"):
+            merged[-1] = {**last, "data": {"content": last["data"]["content"] + event["data"]["content"]}}
+        else:
+            merged.append(event)
+    return merged
+
+
+def _reset():
+    """清除跨运行的进程内状态，保证每次运行走相同的路径"""
+    plan_cache.clear()
+    speculative_executor.max_steps = 0
+
+
+async def record(args):
+    _reset()
+    cassette = Cassette(args.cassette, RECORD)
+    use_cassette(cassette)
+    service = AssistantService(checkpointer=InMemorySaver())
+    start = time.perf_counter()
+    events = await run_once(service, args.question, args.user_id)
+    elapsed = time.perf_counter() - start
+    cassette.save()
+    print(json.dumps({
+        "elapsed": round(elapsed, 3),
+        "events": len(events),
+        "cassette": cassette.stats(),
+    }, ensure_ascii=False, indent=2))
+
+
+async def replay(args):
+    cassette = Cassette.load(args.cassette, strict=args.strict)
+    use_cassette(cassette)
+    service = AssistantService(checkpointer=InMemorySaver())
+    question = args.question or _recorded_question(cassette)
+
+    timings = []
+    baseline = None
+    for i in range(args.repeat):
+        _reset()
+        cassette.rewind()
+        start = time.perf_counter()
+        events = _normalize(await run_once(service, question, args.user_id))
+        timings.append(time.perf_counter() - start)
+        if args.check:
+            if baseline is None:
+                baseline = events
+            elif events != baseline:
+                raise SystemExit(f"第 {i + 1} 次回放的事件与第一次不一致")
+
+    print(json.dumps({
+        "runs": len(timings),
+        "events": len(baseline) if baseline is not None else None,
+        "p50": round(percentile(timings, 0.5), 4),
+        "p95": round(percentile(timings, 0.95), 4),
+        "max": round(max(timings), 4),
+        "cassette": cassette.stats(),
+    }, ensure_ascii=False, indent=2))
+
+
+def _recorded_question(cassette: Cassette) -> str:
+    """从记忆检索记录中取出录制时的问题"""
+    for item in cassette.interactions:
+        if item["kind"] == "memory_search" and item.get("summary"):
+            return item["summary"]
+    raise SystemExit("cassette 中没有记录问题，请通过 --question 指定")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="录制 / 回放一次完整对话")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="访问真实上游并录制")
+    rec.add_argument("--question", required=True)
+
+    rep = sub.add_parser("replay", help="离线回放")
+    rep.add_argument("--question", default=None, help="默认使用录制时的问题")
+    rep.add_argument("--repeat", type=int, default=10)
+    rep.add_argument("--strict", action="store_true", help="请求与录制不完全一致时报错")
+    rep.add_argument("--check", action="store_true", help="校验每次回放的事件与第一次一致")
+
+    for p in (rec, rep):
+        p.add_argument("--cassette", required=True)
+        p.add_argument("--user-id", type=int, default=1)
+
+    args = parser.parse_args()
+    asyncio.run(record(args) if args.command == "record" else replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+本地 OpenAI 兼容的模拟 LLM 服务
+
+用于压测和离线复现延迟问题，不消耗 DeepSeek 额度：
+- 兼容 /chat/completions 与 /v1/chat/completions，支持流式和非流式、工具调用
+- 可配置首 token 延迟（对数正态分布，可复现长尾）、输出速度和错误率
+- 按提示词模板返回固定回答：路由、规划、摘要、对话起名、总结，以及 executor 的工具调用
+
+启动：
+    python -m bench.mock_llm_server --port 9100 --ttft 0.3 --tps 60 --error-rate 0.01
+
+然后将 DEEPSEEK_BASE_URL 指向 http://127.0.0.1:9100/v1 再启动 main.py。
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockConfig:
+    """模拟参数"""
+    # 首 token 延迟中位数（秒）和对数正态分布的 sigma（0 表示固定延迟）
+    ttft: float = 0.3
+    ttft_sigma: float = 0.5
+    # 每秒输出 token 数（0 表示不限速）
+    tokens_per_second: float = 60.0
+    # 每次请求返回错误的概率和状态码
+    error_rate: float = 0.0
+    error_status: int = 429
+    # 每个流式 chunk 的字符数
+    chunk_chars: int = 2
+    seed: Optional[int] = None
+
+
+_PLANNER_REQUEST = re.compile(r"规划|计划|行程|安排|路线|几天|攻略")
+
+PLAN = {
+    "steps": [
+        "查询目的地未来三天天气",
+        "查询出发地到目的地的高铁车次",
+        "搜索目的地热门景点",
+        "根据天气和车次安排每日行程",
+    ],
+    "dependencies": [[], [], [], [0, 1, 2]],
+}
+
+SUMMARY = {"summary": "目的地未来三天以晴为主，气温 12-22 度；每日有多趟高铁直达，约 4.5 小时；热门景点门票需提前预约。"}
+
+FINAL_ANSWER = """## 行程安排
+
+**第一天**：乘坐上午的高铁抵达，入住酒店后游览市中心景点。
+
+**第二天**：参观热门景区，天气晴朗适合户外活动。
+
+**第三天**：自由活动后返程。
+
+> 以上信息来自模拟服务，仅用于压测。"""
+
+
+def _last_user_text(messages: List[dict]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return content or ""
+    return ""
+
+
+def _user_request(prompt: str) -> str:
+    """提取路由提示词中“用户输入”之后的内容"""
+    _, _, tail = prompt.partition("## 用户输入")
+    return tail.strip() or prompt
+
+
+def _tool_arguments(tool: dict, text: str) -> dict:
+    """按工具参数 schema 构造参数：必填的字符串参数填入任务文本"""
+    schema = tool.get("function", {}).get("parameters", {}) or {}
+    properties = schema.get("properties", {}) or {}
+    arguments = {}
+    for name in schema.get("required", []) or []:
+        kind = (properties.get(name) or {}).get("type", "string")
+        if kind in ("integer", "number"):
+            arguments[name] = 1
+        elif kind == "boolean":
+            arguments[name] = False
+        else:
+            arguments[name] = text[:50]
+    return arguments
+
+
+def build_reply(body: dict) -> dict:
+    """根据请求选择固定回答，返回 {"content": str} 或 {"tool_call": {...}}"""
+    messages = body.get("messages", [])
+    tools = body.get("tools") or []
+    prompt = _last_user_text(messages)
+
+    # executor：首轮调用第一个工具，拿到工具结果后给出最终回答
+    if tools:
+        if any(m.get("role") == "tool" for m in messages):
+            return {"content": "已根据工具结果完成任务：" + prompt[-60:].strip()}
+        tool = tools[0]
+        return {"tool_call": {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "name": tool.get("function", {}).get("name", "unknown"),
+            "arguments": json.dumps(_tool_arguments(tool, prompt), ensure_ascii=False),
+        }}
+
+    if "意图分类器" in prompt:
+        route = "planner" if _PLANNER_REQUEST.search(_user_request(prompt)) else "direct_answer"
+        return {"content": json.dumps({"route": route})}
+    if "旅游规划专家" in prompt:
+        return {"content": "```json\n" + json.dumps(PLAN, ensure_ascii=False) + "\n```"}
+    if "摘要生成器" in prompt:
+        return {"content": json.dumps(SUMMARY, ensure_ascii=False)}
+    if "对话命名器" in prompt:
+        return {"content": json.dumps({"res": "旅行行程规划"}, ensure_ascii=False)}
+    if "任务总结系统" in prompt:
+        return {"content": FINAL_ANSWER}
+    return {"content": "这是模拟服务的回答：" + prompt.strip()[:100]}
+
+
+def _usage(body: dict, completion: str) -> dict:
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in body.get("messages", []))
+    prompt_tokens = max(1, prompt_chars // 2)
+    completion_tokens = max(1, len(completion) // 2)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def create_app(config: MockConfig = None) -> FastAPI:
+    """创建模拟服务"""
+    config = config or MockConfig()
+    rng = random.Random(config.seed)
+    app = FastAPI(title="Mock LLM")
+    app.state.config = config
+    app.state.stats = {"requests": 0, "errors": 0, "streaming": 0, "tool_calls": 0}
+
+    def sample_ttft() -> float:
+        if config.ttft <= 0:
+            return 0.0
+        if config.ttft_sigma <= 0:
+            return config.ttft
+        return config.ttft * math.exp(rng.gauss(0.0, config.ttft_sigma))
+
+    def token_interval() -> float:
+        if config.tokens_per_second <= 0:
+            return 0.0
+        # 按每个 chunk 约 chunk_chars / 2 个 token 计算
+        return max(1, config.chunk_chars // 2) / config.tokens_per_second
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats = app.state.stats
+        stats["requests"] += 1
+
+        if rng.random() < config.error_rate:
+            stats["errors"] += 1
+            await asyncio.sleep(sample_ttft())
+            return JSONResponse(
+                status_code=config.error_status,
+                content={"error": {"message": "mock error", "type": "mock_error", "code": config.error_status}}
+            )
+
+        reply = build_reply(body)
+        model = body.get("model", "mock-chat")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:16]}"
+        created = int(time.time())
+        tool_call = reply.get("tool_call")
+        content = reply.get("content", "")
+        if tool_call:
+            stats["tool_calls"] += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep(sample_ttft() + token_interval() * math.ceil(len(content) / config.chunk_chars))
+            message = {"role": "assistant", "content": content if not tool_call else None}
+            if tool_call:
+                message["tool_calls"] = [{
+                    "id": tool_call["id"],
+                    "type": "function",
+                    "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]},
+                }]
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if tool_call else "stop",
+                }],
+                "usage": _usage(body, content),
+            }
+
+        stats["streaming"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def frame(delta: dict, finish_reason: str = None, usage: dict = None) -> str:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+            }
+            if usage is not None:
+                chunk["usage"] = usage
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(sample_ttft())
+            yield frame({"role": "assistant", "content": ""})
+            if tool_call:
+                yield frame({"tool_calls": [{
+                    "index": 0,
+                    "id": tool_call["id"],
+                    "type": "function",
+                    "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]},
+                }]})
+                yield frame({}, "tool_calls")
+            else:
+                interval = token_interval()
+                for i in range(0, len(content), config.chunk_chars):
+                    if i and interval:
+                        await asyncio.sleep(interval)
+                    yield frame({"content": content[i:i + config.chunk_chars]})
+                yield frame({}, "stop")
+            if include_usage:
+                yield frame(None, usage=_usage(body, content))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def models():
+        return {"object": "list", "data": [{"id": "deepseek-chat", "object": "model", "owned_by": "mock"}]}
+
+    async def mock_stats():
+        return app.state.stats
+
+    # 兼容 base_url 带或不带 /v1
+    for prefix in ("", "/v1"):
+        app.add_api_route(f"{prefix}/chat/completions", chat_completions, methods=["POST"])
+        app.add_api_route(f"{prefix}/models", models, methods=["GET"])
+    app.add_api_route("/mock/stats", mock_stats, methods=["GET"])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的模拟 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.3, help="首 token 延迟中位数（秒）")
+    parser.add_argument("--ttft-sigma", type=float, default=0.5, help="首 token 延迟的对数正态 sigma")
+    parser.add_argument("--tps", type=float, default=60.0, help="每秒输出 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的概率")
+    parser.add_argument("--error-status", type=int, default=429, help="错误状态码")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = MockConfig(
+        ttft=args.ttft,
+        ttft_sigma=args.ttft_sigma,
+        tokens_per_second=args.tps,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
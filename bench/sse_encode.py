@@ -0,0 +1,83 @@
+"""
+SSE 帧编码微基准
+
+按一次典型流的事件构成（大量 token、少量状态 / 规划步骤、心跳）编码 N 帧，比较：
+- legacy：json.dumps(ensure_ascii=False) + f-string + UTF-8 编码（原先的路径）
+- json：SSEEncoder 标准库后端
+- orjson：SSEEncoder orjson 后端（已安装时）
+
+    python -m bench.sse_encode --frames 200000 --repeat 5
+"""
+
+import argparse
+import json
+import time
+from typing import Callable, List, Optional, Tuple
+
+from service.event_pump import HEARTBEAT, WORKFLOW_END
+from service.sse_encoder import SSEEncoder, orjson
+
+
+def _legacy(event_id: Optional[int], chunk: dict) -> bytes:
+    data = json.dumps(chunk, ensure_ascii=False)
+    if event_id is None:
+        return f"data: {data}\n\n".encode("utf-8")
+    return f"id: {event_id}\ndata: {data}\n\n".encode("utf-8")
+
+
+def make_events(frames: int) -> List[Tuple[Optional[int], dict]]:
+    """约 90% token（合并后的若干字符）、8% 状态 / 规划步骤、2% 心跳"""
+    events = []
+    next_id = 1
+    for i in range(frames):
+        if i % 50 == 49:
+            events.append((None, HEARTBEAT))
+            continue
+        if i % 25 == 0:
+            event = {"type": "status", "node": "executor", "data": {"status": f"当前正在执行任务{i % 5 + 1}：查询杭州天气"}}
+        elif i % 25 == 1:
+            event = {"type": "plan_step", "node": "planner", "data": {"index": i % 5, "step": "查询西湖周边酒店"}}
+        else:
+            event = {"type": "token", "node": "reflect", "data": {"content": "第一天上午游览西湖，"[: i % 10 + 2]}}
+        events.append((next_id, event))
+        next_id += 1
+    events.append((next_id, WORKFLOW_END))
+    return events
+
+
+def run(encode: Callable[[Optional[int], dict], bytes], events, repeat: int) -> dict:
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = sum(len(encode(event_id, event)) for event_id, event in events)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "ns_per_frame": round(best / len(events) * 1e9, 1),
+        "frames_per_second": int(len(events) / best),
+        "bytes": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 帧编码微基准")
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    events = make_events(args.frames)
+    results = {
+        "legacy": run(_legacy, events, args.repeat),
+        "json": run(SSEEncoder("json").encode, events, args.repeat),
+    }
+    if orjson is not None:
+        results["orjson"] = run(SSEEncoder("orjson").encode, events, args.repeat)
+    baseline = results["legacy"]["ns_per_frame"]
+    for result in results.values():
+        result["speedup"] = round(baseline / result["ns_per_frame"], 2)
+    print(json.dumps({"frames": len(events), **results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+ReAct Agent 缓存
+
+create_agent 每次都会重新构建并编译一张 LangGraph 图，纯 CPU 开销且阻塞事件循环。
+编译后的 agent 不持有请求级状态（无 checkpointer），可以在并发请求间安全复用，
+因此按 (模型配置, 工具集, 系统提示词, 中间件) 进程级缓存，每种组合只构建一次。
+
+工具集按 (名称, 对象 id) 取指纹：MCP 工具重新加载后即使同名也是新对象，
+旧 agent 会继续调用旧对象，所以同名工具集换了对象时会淘汰旧条目重新构建。
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Sequence, Tuple
+
+from langchain.agents import create_agent
+from langchain_core.tools import BaseTool
+
+from graph.llm_registry import model_key
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+
+
+def _tools_key(tools: Sequence[BaseTool]) -> Tuple:
+    return tuple((getattr(tool, "name", repr(tool)), id(tool)) for tool in tools)
+
+
+def _tool_names(tools_key: Tuple) -> Tuple:
+    return tuple(name for name, _ in tools_key)
+
+
+def _middleware_key(middleware: Sequence[Any]) -> Tuple:
+    return tuple(getattr(m, "name", type(m).__name__) for m in middleware)
+
+
+class AgentCache:
+    """进程级 agent 缓存"""
+
+    def __init__(self):
+        self._agents: Dict[Tuple, Any] = {}
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.build_seconds = 0.0
+
+    async def get_agent(self, llm, tools: Sequence[BaseTool], system_prompt: str, middleware: Sequence[Any] = ()):
+        """获取（必要时构建）agent"""
+        tools_key = _tools_key(tools)
+        key = (model_key(llm), tools_key, system_prompt, _middleware_key(middleware))
+
+        agent = self._agents.get(key)
+        if agent is not None:
+            self.hits += 1
+            metrics.inc("agent_cache_hits")
+            return agent
+
+        async with self._lock:
+            # 双重检查，避免并发请求重复构建
+            agent = self._agents.get(key)
+            if agent is not None:
+                self.hits += 1
+                metrics.inc("agent_cache_hits")
+                return agent
+
+            self._evict_stale_tools(tools_key)
+
+            start = time.perf_counter()
+            agent = create_agent(llm, list(tools), system_prompt=system_prompt, middleware=list(middleware))
+            elapsed = time.perf_counter() - start
+
+            self._agents[key] = agent
+            self.misses += 1
+            self.build_seconds += elapsed
+            metrics.inc("agent_cache_misses")
+            metrics.observe("agent_build_seconds", elapsed)
+            logger.info(f"构建 ReAct agent 完成，耗时 {elapsed * 1000:.1f}ms，当前缓存 {len(self._agents)} 个")
+            return agent
+
+    def _evict_stale_tools(self, tools_key: Tuple):
+        """同名工具集换了新对象（工具重新加载）时，淘汰绑定旧对象的 agent"""
+        names = _tool_names(tools_key)
+        stale = [k for k in self._agents if k[1] != tools_key and _tool_names(k[1]) == names]
+        for k in stale:
+            del self._agents[k]
+        if stale:
+            metrics.inc("agent_cache_invalidations", len(stale))
+            logger.info(f"工具对象已更新，淘汰 {len(stale)} 个旧 agent")
+
+    def stats(self) -> dict:
+        """缓存统计"""
+        return {
+            "size": len(self._agents),
+            "hits": self.hits,
+            "misses": self.misses,
+            "build_seconds": round(self.build_seconds, 6),
+        }
+
+    def clear(self):
+        """清空缓存（工具集变化时使用）"""
+        self._agents.clear()
+
+
+# 全局 agent 缓存
+agent_cache = AgentCache()
+metrics.register_collector("agent_cache", agent_cache.stats)
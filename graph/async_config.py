@@ -13,23 +13,18 @@ from typing import Any, List
 
 import httpx
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_tavily import TavilySearch
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 from pydantic.v1 import BaseModel as V1BaseModel
+from pydantic.v1 import Field as V1Field
+
+from graph.llm_registry import llm_registry
 
 load_dotenv()
 
-# 异步 LLM 配置
-async_llm = ChatOpenAI(
-    model="deepseek-chat",
-    api_key=os.getenv('DEEPSEEK_API_KEY'),
-    base_url=os.getenv('DEEPSEEK_BASE_URL'),
-    temperature=0.7,
-    streaming=True,  # 开启流式
-    max_retries=2  # 添加重试
-)
+# 异步 LLM 配置（共享连接池，开启流式）
+async_llm = llm_registry.get(streaming=True)
 
 
 # Tavily Search 的异步包装器
@@ -105,7 +100,7 @@ tavily_tool = TavilySearch(max_results=5)
 
 
 # 状态定义（与同步版本一致）
-from typing import Annotated, List, Tuple, TypedDict
+from typing import Annotated, Dict, List, Tuple, TypedDict
 import operator
 
 
@@ -113,9 +108,12 @@ class PlanExecuteState(TypedDict):
     """定义状态"""
     question: str  # 用户问题
     plan: List[str]  # 待执行的任务列表
+    plan_dependencies: List[List[int]]  # 步骤依赖（下标从 0 开始），为空时按顺序执行
+    plan_prior_results: List[Dict[str, str]]  # 与 plan 对齐：每个步骤所依赖的、已复用结果的步骤 {步骤: 结果}
     past_steps: Annotated[List[Tuple], operator.add]  # 已完成的步骤（步骤名，结果）
     response: str  # 最终回复
     route: str  # 路由意图
+    route_tier: str  # 路由判断来源：lexical / embedding / llm
     messages: Annotated[List[Tuple], operator.add]  # 对话历史
     user_id: int  # 用户id，当前固定为1
     memories: List[str]  # 长期记忆
@@ -127,6 +125,10 @@ class PlanExecuteState(TypedDict):
 class Plan(V1BaseModel):
     """(结构化输出) 规划列表"""
     steps: List[str] = Field(description="一系列具体的步骤，例如查询天气，查询景点等")  # 计划列表结构
+    dependencies: List[List[int]] = V1Field(
+        default_factory=list,
+        description="可选，dependencies[i] 为第 i 个步骤所依赖的步骤下标（从 0 开始）"
+    )
 
 
 class Response(V1BaseModel):
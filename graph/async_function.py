@@ -6,6 +6,7 @@
 
 from graph.async_config import PlanExecuteState, async_llm
 from graph.prompts import summary_prompt
+from graph.single_flight import single_flight
 from utils.parse_llm_json_util import parse_llm_json
 
 
@@ -33,7 +34,7 @@ def async_check_cancelled(state: PlanExecuteState):
 
 async def async_abstract(content: str) -> str:
     """异步将搜索结果提取为摘要"""
-    response = await async_llm.ainvoke(summary_prompt.format(search_results=content))
+    response = await single_flight.ainvoke(async_llm, summary_prompt.format(search_results=content), node="abstract")
     summary = parse_llm_json(response.content).get('summary', '')
     from utils.logger_util import logger
     logger.info(f"搜索结果摘要内容为: {summary}")
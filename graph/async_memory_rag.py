@@ -8,6 +8,7 @@
 import asyncio
 import datetime
 import platform
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
@@ -50,6 +51,9 @@ class AsyncMemoryRAG:
         )
         # 线程池用于执行同步的嵌入操作
         self.executor = ThreadPoolExecutor(max_workers=2)
+        # 查询向量缓存（文本 -> 向量）
+        self._embedding_cache: OrderedDict[str, List[float]] = OrderedDict()
+        self._embedding_cache_size = 256
 
     def _embed_query_sync(self, text: str) -> List[float]:
         """同步执行向量嵌入"""
@@ -60,6 +64,27 @@ class AsyncMemoryRAG:
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(self.executor, self._embed_query_sync, text)
 
+    async def embed_query(self, text: str) -> List[float]:
+        """带 LRU 缓存的向量嵌入
+
+        同一轮对话中记忆检索、意图路由等环节会对同一个问题做嵌入，缓存后只计算一次
+        """
+        vector = self._embedding_cache.get(text)
+        if vector is not None:
+            self._embedding_cache.move_to_end(text)
+            return vector
+
+        vector = await self._embed_query(text)
+        self._embedding_cache[text] = vector
+        if len(self._embedding_cache) > self._embedding_cache_size:
+            self._embedding_cache.popitem(last=False)
+        return vector
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步批量向量嵌入（不走缓存，用于一次性的大批量文本）"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.embeddings.embed_documents, texts)
+
     async def add_memory(self, user_id: int, text: str):
         """异步写入一条记忆：文本 -> 向量 -> DB"""
         logger.info(f"为用户 {user_id} 添加记忆: {text[:50]}...")
@@ -87,8 +112,8 @@ class AsyncMemoryRAG:
         """异步检索相关记忆：Query -> 向量 -> 相似度搜索"""
         logger.info(f"为用户 {user_id} 搜索记忆，查询: {query[:50]}..., top_k={top_k}")
 
-        # 1. 异步向量化查询
-        query_vector = await self._embed_query(query)
+        # 1. 异步向量化查询（结果会被缓存，供意图路由复用）
+        query_vector = await self.embed_query(query)
 
         results = []
         async with create_async_session() as session:
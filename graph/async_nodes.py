@@ -7,32 +7,45 @@
 import os
 
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig
 from langgraph.types import interrupt
 
+from graph.llm_governor import LLMOverloadedError, Priority, set_llm_priority
+from graph.llm_registry import llm_registry
+
 load_dotenv()
 
 # 不开启 streaming 的 LLM（用于 function calling）
-executor_llm = ChatOpenAI(
-    model="deepseek-chat",
-    api_key=os.getenv('DEEPSEEK_API_KEY'),
-    base_url=os.getenv('DEEPSEEK_BASE_URL'),
-    temperature=0.7,
-    streaming=False,
-    max_retries=2
-)
+executor_llm = llm_registry.get(streaming=False)
+
+# 执行者并发执行互不依赖步骤的上限
+EXECUTOR_MAX_CONCURRENCY = int(os.getenv("EXECUTOR_MAX_CONCURRENCY", "3"))
+
+EXECUTOR_SYSTEM_PROMPT = "你是一个专业的旅行助手，可以使用工具来完成任务。"
 
 from graph.async_config import PlanExecuteState, async_llm, Plan
-from graph.async_function import async_abstract
+from graph.agent_cache import agent_cache
 from graph.async_memory_rag import async_memory_rag
+from graph.cassette import cassette_call, get_cassette
+from graph.intent_classifier import IntentClassifier, ROUTER_LOCAL_ENABLED
+from graph.plan_cache import plan_cache, context_digest, PLAN_CACHE_ENABLED
+from graph.plan_dag import normalize_dependencies, critical_path_length, run_plan_dag
 from graph.prompts import (
     route_prompt, direct_answer_prompt, planner_prompt,
     plan_summary_prompt
 )
-from graph.stream_callback import create_streaming_llm, get_stream_queue
+from graph.middleware import log_tool_call, hedge_model_call, cassette_tool_call
+from graph.speculative import speculative_executor
+from graph.summarizer import summarize_step_result
+from graph.single_flight import single_flight
+from graph.stream_callback import emit, detach_stream
 from mcp_tools.tool_registry import get_mcp_tools
 from utils.logger_util import logger
-from utils.parse_llm_json_util import parse_llm_json
+from utils.metrics_util import metrics
+from utils.parse_llm_json_util import parse_llm_json, aparse_json_fields, StreamingJsonParser
+
+# 本地意图分类器，复用记忆检索缓存的问题向量
+intent_classifier = IntentClassifier(async_memory_rag.embed_query)
 
 
 async def async_router_node(state: PlanExecuteState):
@@ -40,46 +53,58 @@ async def async_router_node(state: PlanExecuteState):
     logger.info("🚀路由师正在判断意图")
     question = state["question"]
 
-    prompt = route_prompt.format(
-        user_request=question,
-        memories=state.get("memories", [])
-    )
-
-    router_llm = async_llm.bind(temperature=0.0)
+    # 本地快速通道：置信度足够时跳过 LLM 调用
+    decision = await intent_classifier.classify(question) if ROUTER_LOCAL_ENABLED else None
 
-    raw = await router_llm.ainvoke(prompt)
-    try:
-        data = parse_llm_json(raw.content)
-        route = str(data.get("route", "")).strip()
-    except Exception as e:
-        logger.error(f"路由解析失败：{e}")
-        route = ""
-
-    if route not in {"planner", "direct_answer"}:
-        logger.info(f"路由结果无效，默认走 direct_answer: {route}")
-        route = "direct_answer"
-
-    logger.info(f"用户意图：{route}")
+    if decision:
+        route = decision.route
+        tier = decision.tier
+    else:
+        tier = "llm"
+        prompt = route_prompt.format(
+            user_request=question,
+            memories=state.get("memories", [])
+        )
+
+        router_llm = async_llm.bind(temperature=0.0)
+
+        # 流式读取，route 字段一到就关闭上游流
+        try:
+            data = await aparse_json_fields(single_flight.astream(router_llm, prompt, node="router"), ["route"])
+            route = str(data.get("route", "")).strip()
+        except LLMOverloadedError:
+            # 被限流丢弃不是解析失败：不能悄悄降级为直接问答，交给工作流返回错误事件
+            logger.warning("路由请求被 LLM 限流丢弃")
+            metrics.inc("router_shed")
+            raise
+        except Exception as e:
+            logger.error(f"路由解析失败：{e}")
+            route = ""
+
+        if route not in {"planner", "direct_answer"}:
+            logger.info(f"路由结果无效，默认走 direct_answer: {route}")
+            route = "direct_answer"
+
+    metrics.inc("router_decisions", tier=tier, route=route)
+    logger.info(f"用户意图：{route}（判断来源：{tier}）")
 
     # 发送状态
-    queue = get_stream_queue()
     route_text = "直接问答" if route == "direct_answer" else "规划任务"
-    await queue.put({
+    emit({
         "type": "status",
         "data": {"status": f"当前用户意图为{route_text}"}
     })
 
-    return {"route": route}
+    return {"route": route, "route_tier": tier}
 
 
 async def async_direct_answer_node(state: PlanExecuteState):
     """直接回答：无需工具"""
     logger.info("🚀直接回答中")
     question = state["question"]
-    queue = get_stream_queue()
 
     # 发送状态
-    await queue.put({
+    emit({
         "type": "status",
         "node": "direct_answer",
         "data": {"status": "正在生成回答..."}
@@ -94,15 +119,11 @@ async def async_direct_answer_node(state: PlanExecuteState):
         memories=state.get("memories", [])
     )
 
-    # 使用流式 LLM
-    if queue:
-        streaming_llm = create_streaming_llm("direct_answer")
-        raw = await streaming_llm.ainvoke(prompt)
-    else:
-        raw = await async_llm.ainvoke(prompt)
+    # 相同的在途请求合并为一次上游调用，token 由 messages 流输出给每个调用方
+    raw = await single_flight.ainvoke(async_llm, prompt, node="direct_answer", stream=True)
 
     # 发送状态
-    await queue.put({
+    emit({
         "type": "status",
         "node": "direct_answer",
         "data": {"status": "回答生成完成"}
@@ -118,30 +139,67 @@ async def async_planner_node(state: PlanExecuteState):
     """接收用户问题，生成初始计划"""
     logger.info("🚀规划师正在规划任务")
     question = state["question"]
-    queue = get_stream_queue()
 
     # 格式化对话历史
     messages = "\n".join([f"{role}: {msg}" for role, msg in state["messages"]])
 
-    prompt = planner_prompt.format(
-        user_request=question,
-        messages=messages,
-        memories=state.get("memories", [])
-    )
-
-    raw = await async_llm.ainvoke(prompt)
-
-    try:
-        data = parse_llm_json(raw.content)
-        parsed = Plan.parse_obj(data)
-        steps = parsed.steps
-        logger.info(f"规划结果：{steps}")
-    except Exception as e:
-        logger.error(f"规划解析失败：{e}")
-        steps = []
+    # 语义规划缓存：相似问题 + 相同记忆与近期历史时直接复用计划
+    cached = None
+    question_vector = None
+    digest = context_digest(state.get("memories", []), state["messages"])
+    if PLAN_CACHE_ENABLED:
+        try:
+            question_vector = await async_memory_rag.embed_query(question)
+            cached = plan_cache.get(question_vector, digest)
+        except Exception as e:
+            logger.warning(f"规划缓存查询失败：{e}")
+
+    if cached:
+        steps = list(cached.steps)
+        dependencies = [list(d) for d in cached.dependencies]
+        logger.info(f"命中规划缓存（第 {cached.hits} 次，原问题：{cached.question}）：{steps}")
+        for index, step in enumerate(steps):
+            emit({
+                "type": "plan_step",
+                "node": "planner",
+                "data": {"index": index, "step": step}
+            })
+    else:
+        prompt = planner_prompt.format(
+            user_request=question,
+            messages=messages,
+            memories=state.get("memories", [])
+        )
+
+        # 流式生成：steps 数组中每个步骤一完整就推送 plan_step 事件
+        parser = StreamingJsonParser()
+        content = ""
+        async for chunk in single_flight.astream(async_llm, prompt, node="planner"):
+            content += chunk.content
+            for path, value in parser.feed(chunk.content):
+                if len(path) == 2 and path[0] == "steps" and isinstance(value, str):
+                    emit({
+                        "type": "plan_step",
+                        "node": "planner",
+                        "data": {"index": path[1], "step": value}
+                    })
+
+        try:
+            data = parser.result if parser.done and parser.result is not None else parse_llm_json(content)
+            parsed = Plan.parse_obj(data)
+            steps = parsed.steps
+            dependencies = normalize_dependencies(steps, parsed.dependencies)
+            logger.info(f"规划结果：{steps}，依赖：{dependencies}")
+        except Exception as e:
+            logger.error(f"规划解析失败：{e}")
+            steps = []
+            dependencies = []
+
+        if question_vector is not None:
+            plan_cache.put(question, question_vector, digest, steps, dependencies)
 
     # 将状态返回给前端
-    await queue.put({
+    emit({
         "type": "status",
         "node": "planner",
         "data": {"status": f"规划完成，共有 {len(steps)} 个步骤"}
@@ -150,8 +208,7 @@ async def async_planner_node(state: PlanExecuteState):
     logger.info(f"共有 {len(steps)} 个任务")
 
     # 发送规划到前端
-    queue = get_stream_queue()
-    await queue.put({
+    emit({
         "type": "approve_plan",
         "data": {
             "plan": steps,
@@ -159,10 +216,10 @@ async def async_planner_node(state: PlanExecuteState):
         }
     })
 
-    return {"plan": steps}
+    return {"plan": steps, "plan_dependencies": dependencies, "plan_prior_results": []}
 
 
-async def async_human_review_node(state: PlanExecuteState):
+async def async_human_review_node(state: PlanExecuteState, config: RunnableConfig):
     """人机交互节点 - 等待用户审核/修改/取消
 
     使用 interrupt() 实现真正的节点内部中断
@@ -181,57 +238,58 @@ async def async_human_review_node(state: PlanExecuteState):
         logger.info(f"用户已取消任务")
         return {"cancelled": True}
 
-    queue = get_stream_queue()
-    await queue.put({"type": "waiting_for_approval", "data": {"plan": plan}})
+    # 等待用户期间预执行前几个无依赖步骤（默认关闭）
+    thread_id = config.get("configurable", {}).get("thread_id")
+    if speculative_executor.enabled and thread_id is not None:
+        await _start_speculation(str(thread_id), state)
 
-    # interrupt 等待用户操作
+    # interrupt 等待用户操作（前端的 waiting_for_approval 事件由 updates 流中的中断得到）
     interrupt({"type": "human_review", "plan": plan})
     return {}
 
 
-async def async_executor_node(state: PlanExecuteState):
-    """ReAct 执行者：使用 MCP 工具执行任务（基于 LangChain create_agent）"""
-    from langchain.agents import create_agent
+async def _start_speculation(thread_id: str, state: PlanExecuteState):
+    """在后台预执行计划中的无依赖步骤"""
+    plan = list(state.get("plan", []))
+    question = state.get("question", "")
+    dependencies = normalize_dependencies(plan, state.get("plan_dependencies"))
+    agent = await _get_executor_agent()
 
-    plan = state['plan']
-    task = plan[0]
+    async def run_step(index: int) -> str:
+        # 预执行不向当前请求推送事件（请求在 interrupt 后就结束了），LLM 调用按后台任务调度
+        detach_stream()
+        set_llm_priority(Priority.BACKGROUND)
+        return await _execute_step(agent, question, plan[index], index + 1, len(plan), {})
 
-    logger.info(f"🚀 ReAct 执行者正在执行任务：{task}")
+    speculative_executor.start(thread_id, question, plan, dependencies, run_step)
 
-    # 计算当前任务序号
-    current_task_num = len(state.get('past_steps', [])) + 1
-
-    # 发送状态
-    queue = get_stream_queue()
-    await queue.put({
-        "type": "status",
-        "node": "executor",
-        "data": {"status": f"当前正在执行任务{current_task_num}：{task}"}
-    })
 
-    # 加载 MCP 工具
+async def _get_executor_agent():
+    """加载 MCP 工具，获取缓存的 agent（同一配置只构建一次，所有步骤和请求共享）"""
     tools = await get_mcp_tools()
+    return await agent_cache.get_agent(
+        executor_llm,
+        tools,
+        system_prompt=EXECUTOR_SYSTEM_PROMPT,
+        middleware=[log_tool_call, cassette_tool_call, hedge_model_call]
+    )
 
-    # 使用 create_agent
-    from graph.middleware import log_tool_call
 
-    # 构建带上下文的任务描述
-    question = state.get('question', '')
-    total_tasks = len(plan)
+async def _execute_step(agent, question: str, task: str, task_num: int, total_tasks: int,
+                        dep_results: dict) -> str:
+    """用 ReAct agent 执行单个步骤，dep_results 为 {依赖步骤文本: 结果}"""
+    # 构建带上下文的任务描述（附带依赖步骤的结果）
+    dep_context = ""
+    if dep_results:
+        dep_context = "\n前置步骤结果：\n" + "\n".join(
+            f"- {step}：{result}" for step, result in dep_results.items()
+        ) + "\n"
     context_task = f"""用户问题：{question}
-
-当前任务（第{current_task_num}/{total_tasks}步）：{task}
+{dep_context}
+当前任务（第{task_num}/{total_tasks}步）：{task}
 
 请执行这个任务，提供相关信息。"""
 
-    system_prompt = "你是一个专业的旅行助手，可以使用工具来完成任务。"
-    agent = create_agent(
-        executor_llm,
-        tools,
-        system_prompt=system_prompt,
-        middleware=[log_tool_call]
-    )
-
     # 调用 agent 执行任务（带上下文）
     result = await agent.ainvoke({"messages": [context_task]})
 
@@ -240,15 +298,74 @@ async def async_executor_node(state: PlanExecuteState):
     final_message = messages[-1] if messages else None
     result_str = final_message.content if final_message else "任务完成"
 
-    logger.info(f"ReAct 执行完成，结果长度: {len(result_str)}")
+    logger.info(f"任务{task_num} ReAct 执行完成，结果长度: {len(result_str)}")
 
-    # 摘要（如果结果太长）
-    if len(result_str) > 2000:
-        result_str = await async_abstract(result_str)
+    # 分级摘要：短结果原样保留，中等结果本地抽取，超长结果 LLM map-reduce
+    return await summarize_step_result(
+        task, result_str,
+        embed_query=async_memory_rag.embed_query,
+        embed_documents=async_memory_rag.embed_documents
+    )
+
+
+async def async_executor_node(state: PlanExecuteState, config: RunnableConfig):
+    """ReAct 执行者：使用 MCP 工具执行任务（基于 LangChain create_agent）
+
+    按 plan_dependencies 把互不依赖的步骤并发执行（并发上限 EXECUTOR_MAX_CONCURRENCY），
+    past_steps 仍按计划顺序追加。已预执行的步骤直接采用预执行结果。
+    """
+    plan = state['plan']
+    dependencies = normalize_dependencies(plan, state.get('plan_dependencies'))
+    logger.info(f"🚀 ReAct 执行者开始执行 {len(plan)} 个任务，关键路径长度 {critical_path_length(dependencies)}")
+
+    # 计算任务序号的起点
+    done_count = len(state.get('past_steps', []))
+    total_tasks = done_count + len(plan)
+
+    agent = await _get_executor_agent()
+    question = state.get('question', '')
+    thread_id = str(config.get("configurable", {}).get("thread_id"))
+    prior_results = state.get('plan_prior_results') or []
+
+    async def run_step(index: int, dep_results: dict) -> str:
+        task = plan[index]
+        current_task_num = done_count + index + 1
+
+        speculative = speculative_executor.take(thread_id, question, task)
+        if speculative is not None:
+            try:
+                result = await speculative
+                logger.info(f"任务{current_task_num} 采用预执行结果：{task}")
+                emit({
+                    "type": "status",
+                    "node": "executor",
+                    "data": {"status": f"任务{current_task_num}已提前完成：{task}"}
+                })
+                return result
+            except Exception as e:
+                logger.warning(f"任务{current_task_num} 预执行失败，重新执行：{e}")
+
+        logger.info(f"🚀 ReAct 执行者正在执行任务{current_task_num}：{task}")
+
+        # 发送状态
+        emit({
+            "type": "status",
+            "node": "executor",
+            "data": {"status": f"当前正在执行任务{current_task_num}：{task}"}
+        })
+
+        # 依赖结果：本次执行的前置步骤 + 审批时复用了结果的前置步骤
+        step_context = dict(prior_results[index]) if index < len(prior_results) else {}
+        step_context.update({plan[j]: result for j, result in sorted(dep_results.items())})
+        return await _execute_step(agent, question, task, current_task_num, total_tasks, step_context)
+
+    results = await run_plan_dag(plan, dependencies, run_step, EXECUTOR_MAX_CONCURRENCY)
 
     return {
-        "past_steps": [(task, result_str)],
-        "plan": plan[1:]
+        "past_steps": list(zip(plan, results)),
+        "plan": [],
+        "plan_dependencies": [],
+        "plan_prior_results": []
     }
 
 
@@ -262,19 +379,13 @@ async def async_plan_summary_node(state: PlanExecuteState):
     for step, result in state['past_steps']:
         past_steps_str += f"已完成步骤：{step}\n执行结果：{result}\n"
 
-    queue = get_stream_queue()
-
     prompt = plan_summary_prompt.format(
         question=state['question'],
         past_steps=past_steps_str
     )
 
-    # 使用流式 LLM
-    if queue:
-        streaming_llm = create_streaming_llm("reflect")
-        raw = await streaming_llm.ainvoke(prompt)
-    else:
-        raw = await async_llm.ainvoke(prompt)
+    # 相同的在途请求合并为一次上游调用，token 由 messages 流输出给每个调用方
+    raw = await single_flight.ainvoke(async_llm, prompt, node="plan_summary", stream=True)
 
     response = raw.content
     logger.info(f"大模型结果为：{response}")
@@ -292,8 +403,13 @@ async def async_memory_retrieve_node(state: PlanExecuteState):
     user_id = state["user_id"]
     question = state["question"]
 
-    # 异步检索相关历史记忆
-    memories = await async_memory_rag.search_memories(user_id, question, top_k=5)
+    # 异步检索相关历史记忆（录制/回放时使用 cassette 中的检索结果）
+    memories = await cassette_call(
+        "memory_search",
+        {"user_id": user_id, "question": question, "top_k": 5},
+        lambda: async_memory_rag.search_memories(user_id, question, top_k=5),
+        summary=question
+    )
     logger.info(f"检索到 {len(memories)} 条相关记忆")
     return {"memories": memories}
 
@@ -305,5 +421,10 @@ async def async_memory_save_node(state: PlanExecuteState):
     response = state.get('response', '')
 
     conversation = f"用户：{question}\nAI：{response}"
+    cassette = get_cassette()
+    if cassette is not None and cassette.replaying:
+        # 回放时不写入长期记忆，避免影响下一次回放的检索结果
+        logger.info("cassette 回放中，跳过保存记忆")
+        return
     await async_memory_rag.add_memory(user_id, conversation)
     logger.info(f"已保存对话到长期记忆")
@@ -0,0 +1,267 @@
+"""
+LLM / MCP 流量录制与回放（cassette）
+
+录制一次真实的 AssistantService 运行中所有外部交互，离线回放时原样返回，不再访问上游：
+- llm：共享 httpx 客户端上的 POST 请求（chat/completions），按规范化后的请求体匹配，流式响应保存原始 SSE 字节
+- tool：executor 的 MCP 工具调用（工具名 + 参数 -> 工具返回内容），由 cassette_tool_call 中间件处理
+- memory_search：长期记忆的检索结果（回放时不访问数据库）
+
+memory_save 不录制：它只有写库的副作用，回放时 async_memory_save_node 直接跳过保存。
+
+回放时相同 key 的多次交互按录制顺序依次返回；找不到完全一致的请求时（例如提示词中混入了
+时间等易变内容），按同类交互的录制顺序退而求其次，strict 模式下直接报错。
+
+通过环境变量开启：CASSETTE_MODE=record|replay，CASSETTE_PATH=文件路径（.gz 结尾时压缩存储）。
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+from utils.logger_util import logger
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassette.json.gz")
+CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "false").lower() == "true"
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMissError(Exception):
+    """回放时找不到对应的录制交互"""
+
+
+def make_key(payload: Any) -> str:
+    """规范化 JSON 后取摘要"""
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class Cassette:
+    """一次运行的全部外部交互"""
+
+    def __init__(self, path: str, mode: str, strict: bool = CASSETTE_STRICT, interactions: List[dict] = None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"未知的 cassette 模式：{mode}")
+        self.path = path
+        self.mode = mode
+        self.strict = strict
+        self.interactions: List[dict] = interactions or []
+        self.misses = 0
+        self.loose_matches = 0
+        self.rewind()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    @classmethod
+    def load(cls, path: str, strict: bool = CASSETTE_STRICT) -> "Cassette":
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(path, REPLAY, strict, data.get("interactions", []))
+
+    def save(self, path: str = None):
+        """写入文件（.gz 结尾时 gzip 压缩）"""
+        path = path or self.path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "wt", encoding="utf-8") as f:
+            json.dump({"version": 1, "interactions": self.interactions}, f, ensure_ascii=False,
+                      separators=(",", ":"))
+        logger.info(f"cassette 已保存：{path}，共 {len(self.interactions)} 条交互")
+
+    def rewind(self):
+        """回到开头，重新按录制顺序回放"""
+        self._by_key: Dict[tuple, Deque[int]] = defaultdict(deque)
+        self._by_shape: Dict[tuple, Deque[int]] = defaultdict(deque)
+        self._used = set()
+        for i, item in enumerate(self.interactions):
+            self._by_key[(item["kind"], item["key"])].append(i)
+            self._by_shape[(item["kind"], item.get("shape"))].append(i)
+
+    def record(self, kind: str, key: str, response: Any, shape: str = None, summary: str = None):
+        self.interactions.append({
+            "kind": kind,
+            "key": key,
+            "shape": shape,
+            "summary": summary,
+            "response": response,
+        })
+
+    def _pop(self, queue: Deque[int]) -> Optional[int]:
+        while queue:
+            index = queue.popleft()
+            if index not in self._used:
+                self._used.add(index)
+                return index
+        return None
+
+    def take(self, kind: str, key: str, shape: str = None) -> Any:
+        """取出下一条匹配的录制响应"""
+        index = self._pop(self._by_key[(kind, key)])
+        if index is None:
+            if self.strict:
+                self.misses += 1
+                raise CassetteMissError(f"cassette 中没有匹配的 {kind} 交互：{key}")
+            index = self._pop(self._by_shape[(kind, shape)])
+            if index is None:
+                self.misses += 1
+                raise CassetteMissError(f"cassette 中没有可用的 {kind} 交互：{shape}")
+            self.loose_matches += 1
+            logger.warning(f"cassette 未找到完全一致的 {kind} 请求，按录制顺序使用：{self.interactions[index].get('summary')}")
+        return self.interactions[index]["response"]
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "interactions": len(self.interactions),
+            "used": len(self._used),
+            "loose_matches": self.loose_matches,
+            "misses": self.misses,
+        }
+
+
+# 当前生效的 cassette（进程级）
+_active: Optional[Cassette] = None
+
+
+def use_cassette(cassette: Optional[Cassette]):
+    """设置当前生效的 cassette，传 None 关闭"""
+    global _active
+    _active = cassette
+
+
+def get_cassette() -> Optional[Cassette]:
+    return _active
+
+
+def load_cassette_from_env() -> Optional[Cassette]:
+    """根据 CASSETTE_MODE / CASSETTE_PATH 开启录制或回放"""
+    if CASSETTE_MODE == RECORD:
+        cassette = Cassette(CASSETTE_PATH, RECORD)
+    elif CASSETTE_MODE == REPLAY:
+        cassette = Cassette.load(CASSETTE_PATH)
+    else:
+        return None
+    use_cassette(cassette)
+    logger.info(f"cassette 已开启：mode={cassette.mode}，path={cassette.path}")
+    return cassette
+
+
+async def cassette_call(kind: str, payload: Any, fn: Callable[[], Awaitable[Any]], summary: str = None) -> Any:
+    """录制/回放任意一次外部调用（返回值需可 JSON 序列化）"""
+    cassette = get_cassette()
+    if cassette is None:
+        return await fn()
+    key = make_key(payload)
+    if cassette.replaying:
+        return cassette.take(kind, key, shape=kind)
+    result = await fn()
+    cassette.record(kind, key, result, shape=kind, summary=summary)
+    return result
+
+
+def _llm_request_info(request: httpx.Request):
+    """LLM 请求的匹配 key、形状和摘要"""
+    try:
+        body = json.loads(request.content or b"{}")
+    except ValueError:
+        body = {"raw": (request.content or b"").decode("utf-8", "replace")}
+    key = make_key({"method": request.method, "path": request.url.path, "body": body})
+    shape = f"{request.url.path}|stream={bool(body.get('stream'))}|tools={bool(body.get('tools'))}"
+    messages = body.get("messages") or [{}]
+    summary = str(messages[-1].get("content") or "")[:80]
+    return key, shape, summary
+
+
+_KEEP_HEADERS = ("content-type", "content-encoding")
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """边转发边保存响应字节，读取完成或关闭时写入 cassette
+
+    SDK 读到 [DONE] 后直接关闭响应，不会读到流结束，因此关闭时也要写入；
+    提前关闭的流按已读取的部分录制，回放时调用方同样只读取这一部分。
+    """
+
+    def __init__(self, inner: httpx.AsyncByteStream, on_complete: Callable[[bytes], None]):
+        self._inner = inner
+        self._on_complete = on_complete
+        self._chunks: List[bytes] = []
+        self._recorded = False
+
+    def _finish(self):
+        if not self._recorded:
+            self._recorded = True
+            self._on_complete(b"".join(self._chunks))
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            self._chunks.append(chunk)
+            yield chunk
+        self._finish()
+
+    async def aclose(self):
+        self._finish()
+        await self._inner.aclose()
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """包装 httpx 传输层：未开启 cassette 时直接透传"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        cassette = get_cassette()
+        if cassette is None:
+            return await self.inner.handle_async_request(request)
+
+        if request.method != "POST":
+            # 预热等非 LLM 请求：回放时不访问网络
+            if cassette.replaying:
+                return httpx.Response(200, json={}, request=request)
+            return await self.inner.handle_async_request(request)
+
+        await request.aread()
+        key, shape, summary = _llm_request_info(request)
+        if cassette.replaying:
+            recorded = cassette.take("llm", key, shape)
+            if "body" in recorded:
+                content = recorded["body"].encode("utf-8")
+            else:
+                content = base64.b64decode(recorded["body_b64"])
+            return httpx.Response(recorded["status"], headers=recorded["headers"], content=content, request=request)
+
+        response = await self.inner.handle_async_request(request)
+        headers = {k: v for k, v in response.headers.items() if k.lower() in _KEEP_HEADERS}
+
+        def on_complete(content: bytes):
+            recorded = {"status": response.status_code, "headers": headers}
+            if "content-encoding" in headers:
+                recorded["body_b64"] = base64.b64encode(content).decode("ascii")
+            else:
+                recorded["body"] = content.decode("utf-8", "replace")
+            cassette.record("llm", key, recorded, shape=shape, summary=summary)
+
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, on_complete),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    async def aclose(self):
+        await self.inner.aclose()
@@ -0,0 +1,233 @@
+"""
+LLM 对冲请求（hedged requests）
+
+DeepSeek 的 p99 延迟是中位数的数倍，max_retries 只在完整超时之后才生效。
+开启后，调用耗时超过该节点滚动延迟的分位数时，再发出一个相同的请求，取先返回的结果，取消另一个：
+- 非流式调用（executor 的模型调用）：按完整耗时对冲
+- 流式调用（router、planner、async_abstract）：按首个 chunk 到达时间对冲，胜出的流继续读取
+
+对冲有两层预算：每个节点最近调用中对冲的比例不超过该节点预算，所有节点合计不超过 LLM_HEDGE_MAX_RATE。
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+
+T = TypeVar("T")
+
+# 默认关闭
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+# 超过滚动延迟的该分位数时发出对冲请求
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# 所有节点合计的对冲比例上限
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+# 每个节点的对冲比例预算，未列出的节点不对冲
+LLM_HEDGE_BUDGETS = os.getenv("LLM_HEDGE_BUDGETS", "router=0.1,planner=0.05,executor=0.05,abstract=0.1")
+# 滚动窗口大小、开始对冲前至少需要的样本数、对冲延迟下限（秒）
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.2"))
+
+
+def parse_budgets(text: str) -> Dict[str, float]:
+    """解析 "router=0.1,planner=0.05" 形式的节点预算"""
+    budgets = {}
+    for item in text.split(","):
+        node, sep, value = item.partition("=")
+        if not sep:
+            continue
+        try:
+            budgets[node.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"无效的对冲预算配置：{item}")
+    return budgets
+
+
+def percentile(values, p: float) -> float:
+    """最近邻分位数"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p * len(ordered)) - 1))
+    return ordered[index]
+
+
+class _NodeWindow:
+    """单个节点的滚动延迟与对冲记录"""
+
+    def __init__(self, size: int):
+        self.latencies = deque(maxlen=size)
+        self.hedged = deque(maxlen=size)
+        self.hedges = 0
+        self.hedge_wins = 0
+
+
+class HedgePolicy:
+    """按节点滚动延迟分位数触发对冲"""
+
+    def __init__(self, enabled: bool = LLM_HEDGE_ENABLED, quantile: float = LLM_HEDGE_PERCENTILE,
+                 max_rate: float = LLM_HEDGE_MAX_RATE, budgets: Dict[str, float] = None,
+                 window: int = LLM_HEDGE_WINDOW, min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 min_delay: float = LLM_HEDGE_MIN_DELAY):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.max_rate = max_rate
+        self.budgets = parse_budgets(LLM_HEDGE_BUDGETS) if budgets is None else budgets
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._nodes: Dict[str, _NodeWindow] = {}
+        # 所有节点最近的调用是否对冲
+        self._hedged = deque(maxlen=window)
+
+    def _node(self, node: str) -> _NodeWindow:
+        stats = self._nodes.get(node)
+        if stats is None:
+            stats = self._nodes[node] = _NodeWindow(self.window)
+        return stats
+
+    def delay(self, node: str) -> Optional[float]:
+        """对冲触发延迟；未开启、无预算或样本不足时返回 None"""
+        if not self.enabled or self.budgets.get(node, 0) <= 0:
+            return None
+        stats = self._node(node)
+        if not stats.latencies or len(stats.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(stats.latencies, self.quantile))
+
+    def _allow(self, node: str) -> bool:
+        """检查节点预算和总对冲比例"""
+        stats = self._node(node)
+        node_rate = sum(stats.hedged) / len(stats.hedged) if stats.hedged else 0.0
+        total_rate = sum(self._hedged) / len(self._hedged) if self._hedged else 0.0
+        return node_rate < self.budgets.get(node, 0) and total_rate < self.max_rate
+
+    def _record(self, node: str, latency: float, hedged: bool, winner: str):
+        stats = self._node(node)
+        stats.latencies.append(latency)
+        stats.hedged.append(hedged)
+        self._hedged.append(hedged)
+        if hedged:
+            stats.hedges += 1
+            metrics.inc("llm_hedges", node=node, outcome="win" if winner == "hedge" else "loss")
+            if winner == "hedge":
+                stats.hedge_wins += 1
+        metrics.observe("llm_latency_seconds", latency, node=node, winner=winner)
+
+    @staticmethod
+    async def _first_success(tasks: List[asyncio.Future]) -> Tuple[int, object]:
+        """返回最先成功的任务下标和结果；全部失败时抛出最后一个异常"""
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return tasks.index(task), task.result()
+                error = task.exception()
+        raise error
+
+    @staticmethod
+    async def _cancel(tasks: List[asyncio.Future]):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _close(self, firsts: List[asyncio.Future], streams: List[AsyncIterator]):
+        """取消尚未完成的首个 chunk 读取并关闭流"""
+        await self._cancel(firsts)
+        for s in streams:
+            await s.aclose()
+
+    async def call(self, node: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """非流式调用：超过对冲延迟仍未返回时发出第二个请求"""
+        start = time.perf_counter()
+        delay = self.delay(node)
+        if delay is None:
+            # 不会触发对冲：直接等待，不额外创建任务
+            result = await factory()
+            self._record(node, time.perf_counter() - start, False, "primary")
+            return result
+
+        tasks = [asyncio.ensure_future(factory())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._allow(node):
+                logger.info(f"[{node}] 调用超过 {delay:.2f}s，发出对冲请求")
+                tasks.append(asyncio.ensure_future(factory()))
+            index, result = await self._first_success(tasks)
+        finally:
+            await self._cancel([t for t in tasks if not t.done()])
+        self._record(node, time.perf_counter() - start, len(tasks) > 1, "hedge" if index else "primary")
+        return result
+
+    async def stream(self, node: str, factory: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """流式调用：首个 chunk 超过对冲延迟仍未到达时发出第二个请求，先出 chunk 的流胜出"""
+        start = time.perf_counter()
+        delay = self.delay(node)
+        if delay is None:
+            # 不会触发对冲：直接读取首个 chunk，不额外创建任务
+            winner = factory()
+            try:
+                first = await winner.__anext__()
+            except StopAsyncIteration:
+                # 上游返回空流
+                await winner.aclose()
+                return
+            except BaseException:
+                await winner.aclose()
+                raise
+            self._record(node, time.perf_counter() - start, False, "primary")
+        else:
+            streams = [factory()]
+            firsts = [asyncio.ensure_future(streams[0].__anext__())]
+            try:
+                done, _ = await asyncio.wait(firsts, timeout=delay)
+                if not done and self._allow(node):
+                    logger.info(f"[{node}] 首个 chunk 超过 {delay:.2f}s 未到达，发出对冲请求")
+                    streams.append(factory())
+                    firsts.append(asyncio.ensure_future(streams[1].__anext__()))
+                index, first = await self._first_success(firsts)
+            except StopAsyncIteration:
+                # 上游返回空流
+                await self._close(firsts, streams)
+                return
+            except BaseException:
+                await self._close(firsts, streams)
+                raise
+
+            # 取消落后的请求
+            await self._close([f for i, f in enumerate(firsts) if i != index],
+                              [s for i, s in enumerate(streams) if i != index])
+            self._record(node, time.perf_counter() - start, len(streams) > 1, "hedge" if index else "primary")
+            winner = streams[index]
+
+        try:
+            yield first
+            async for chunk in winner:
+                yield chunk
+        finally:
+            await winner.aclose()
+
+    def stats(self) -> dict:
+        """各节点的对冲延迟与对冲次数"""
+        nodes = {}
+        for node, stats in self._nodes.items():
+            nodes[node] = {
+                "samples": len(stats.latencies),
+                "p50": round(percentile(stats.latencies, 0.5), 4) if stats.latencies else None,
+                "hedge_delay": self.delay(node),
+                "hedges": stats.hedges,
+                "hedge_wins": stats.hedge_wins,
+                "hedge_rate": round(sum(stats.hedged) / len(stats.hedged), 4) if stats.hedged else 0.0,
+            }
+        return {"enabled": self.enabled, "max_rate": self.max_rate, "nodes": nodes}
+
+
+# 全局对冲策略
+hedge_policy = HedgePolicy()
+metrics.register_collector("llm_hedging", hedge_policy.stats)
@@ -0,0 +1,131 @@
+"""
+本地意图分类器（路由快速通道）
+
+在 route_prompt 的 LLM 调用之前做两级本地判断：
+1. lexical：route_prompt 中列出的明显关键词（规划/行程/安排 vs 刚才/之前）
+2. embedding：复用记忆检索时已计算的 bge-m3 问题向量，与两类示例语句的质心做最近质心匹配
+
+任一级置信度达到阈值即直接返回，否则交给 LLM 判断。
+"""
+
+import asyncio
+import math
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from utils.logger_util import logger
+from utils.vector_util import cosine
+
+# 是否启用本地分类，以及置信度阈值
+ROUTER_LOCAL_ENABLED = os.getenv("ROUTER_LOCAL_ENABLED", "true").lower() == "true"
+ROUTER_LOCAL_THRESHOLD = float(os.getenv("ROUTER_LOCAL_THRESHOLD", "0.8"))
+# 质心相似度差值 -> 置信度的温度系数，越小越“自信”
+ROUTER_EMBEDDING_TEMPERATURE = float(os.getenv("ROUTER_EMBEDDING_TEMPERATURE", "0.05"))
+
+# 引用对话历史：route_prompt 规定一律 direct_answer
+_HISTORY_PATTERN = re.compile(r"刚才|之前|上面|前面|你提到|提到过|我们聊到|聊过|你说的|你推荐的")
+# 明确要计划/行程/步骤；“行程”需带规划类动词（“行程里的高铁多少钱”是事实问题，交给后续判断）
+_PLANNER_PATTERN = re.compile(
+    r"规划|制定计划|做个?计划|行程(?:规划|安排)|(?:安排|制定|帮我做|做一?个|定一?个|排一?个)[^，。？！,.?!]{0,8}行程"
+    r"|安排一下|帮我安排|怎么安排|路线怎么走|几天怎么玩|\d+\s*[天日]游|[一二两三四五六七八九十]+[天日]游|步骤清单"
+)
+
+# 质心示例语句
+ROUTE_EXAMPLES: Dict[str, List[str]] = {
+    "planner": [
+        "给我规划下周去成都三天的行程",
+        "帮我制定一个北京五日游的计划",
+        "五一去杭州玩两天，帮我安排一下行程",
+        "从上海到西安自驾怎么安排路线",
+        "带父母去三亚旅游，做个详细的行程安排",
+        "周末去苏州一日游怎么安排",
+        "帮我列一个去云南旅行的步骤清单",
+        "下个月去日本东京玩一周，规划一下每天去哪",
+    ],
+    "direct_answer": [
+        "刚才提到了哪些美食？",
+        "你前面推荐的餐厅有哪些？",
+        "去成都有哪些必吃美食？",
+        "北京今天天气怎么样",
+        "故宫需要提前预约吗",
+        "你好，今天心情不错",
+        "高铁和飞机哪个更划算",
+        "西湖有什么历史故事",
+    ],
+}
+
+
+@dataclass
+class RouteDecision:
+    """路由判断结果"""
+    route: str
+    confidence: float
+    tier: str  # lexical / embedding / llm
+
+
+def classify_lexical(question: str) -> Optional[RouteDecision]:
+    """关键词判断"""
+    references_history = bool(_HISTORY_PATTERN.search(question))
+    wants_plan = bool(_PLANNER_PATTERN.search(question))
+
+    if references_history:
+        # 引用历史优先于规划关键词（如“刚才的行程里有哪些景点”）
+        return RouteDecision("direct_answer", 0.95 if not wants_plan else 0.85, "lexical")
+    if wants_plan:
+        return RouteDecision("planner", 0.9, "lexical")
+    return None
+
+
+class IntentClassifier:
+    """最近质心分类器"""
+
+    def __init__(self, embed_query, examples: Dict[str, List[str]] = None):
+        """embed_query: 异步嵌入函数（文本 -> 归一化向量）"""
+        self._embed_query = embed_query
+        self._examples = examples or ROUTE_EXAMPLES
+        self._centroids: Dict[str, List[float]] = {}
+        self._lock = asyncio.Lock()
+
+    async def _ensure_centroids(self):
+        if self._centroids:
+            return
+        async with self._lock:
+            if self._centroids:
+                return
+            centroids = {}
+            for route, sentences in self._examples.items():
+                vectors = await asyncio.gather(*[self._embed_query(s) for s in sentences])
+                dim = len(vectors[0])
+                centroids[route] = [sum(v[i] for v in vectors) / len(vectors) for i in range(dim)]
+            self._centroids = centroids
+            logger.info(f"意图质心构建完成：{list(centroids)}")
+
+    async def classify_embedding(self, question: str) -> Optional[RouteDecision]:
+        """最近质心判断，置信度由两类相似度之差经 sigmoid 得到"""
+        await self._ensure_centroids()
+        vector = await self._embed_query(question)
+        sims = {route: cosine(vector, centroid) for route, centroid in self._centroids.items()}
+        margin = sims["planner"] - sims["direct_answer"]
+        p_planner = 1 / (1 + math.exp(-margin / ROUTER_EMBEDDING_TEMPERATURE))
+        if p_planner >= 0.5:
+            return RouteDecision("planner", p_planner, "embedding")
+        return RouteDecision("direct_answer", 1 - p_planner, "embedding")
+
+    async def classify(self, question: str, threshold: float = ROUTER_LOCAL_THRESHOLD) -> Optional[RouteDecision]:
+        """依次尝试本地两级分类，置信度不足时返回 None（交给 LLM）"""
+        decision = classify_lexical(question)
+        if decision and decision.confidence >= threshold:
+            return decision
+
+        try:
+            decision = await self.classify_embedding(question)
+        except Exception as e:
+            logger.warning(f"向量意图分类失败，交给 LLM 判断：{e}")
+            return None
+
+        if decision.confidence >= threshold:
+            return decision
+        logger.info(f"本地意图置信度不足（{decision.route}: {decision.confidence:.2f}），交给 LLM 判断")
+        return None
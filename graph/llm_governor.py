@@ -0,0 +1,320 @@
+"""
+LLM 调用调度器
+
+所有出站 LLM 请求共享 DeepSeek 的限流额度。调度器位于每次上游调用之前：
+- 按每分钟请求数（LLM_RPM）和每分钟 token 数（LLM_TPM）两个令牌桶准入，另有并发上限
+- 按节点划分优先级：交互式流式输出 > 路由/规划 > 执行 > 后台任务，高优先级先出队
+- 排队有截止时间，超时的请求直接丢弃（抛出 LLMOverloadedError），不再占用额度
+- 队列满或上游返回 429 时，优先丢弃低优先级的排队请求；429 后暂停放行一段时间
+
+token 在准入时按“提示词估算 + 该优先级的预期输出”预扣，完成后按实际输出修正。
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+import openai
+
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+from utils.token_util import estimate_tokens
+
+T = TypeVar("T")
+
+LLM_GOVERNOR_ENABLED = os.getenv("LLM_GOVERNOR_ENABLED", "true").lower() == "true"
+# 每分钟请求数 / token 数上限，0 表示不限制
+LLM_RPM = int(os.getenv("LLM_RPM", "600"))
+LLM_TPM = int(os.getenv("LLM_TPM", "1000000"))
+# 同时在途的上游请求上限
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# 排队请求上限，超出时丢弃优先级最低的请求
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))
+# 上游返回 429 后暂停放行的秒数
+LLM_RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", "5"))
+
+
+class Priority(IntEnum):
+    """优先级，数值越小越先调度"""
+    INTERACTIVE = 0
+    PLANNING = 1
+    EXECUTION = 2
+    BACKGROUND = 3
+
+
+NODE_PRIORITIES: Dict[str, Priority] = {
+    "direct_answer": Priority.INTERACTIVE,
+    "plan_summary": Priority.INTERACTIVE,
+    "router": Priority.PLANNING,
+    "planner": Priority.PLANNING,
+    "executor": Priority.EXECUTION,
+    "abstract": Priority.BACKGROUND,
+    "name_conversation": Priority.BACKGROUND,
+}
+
+# 各优先级最长排队时间（秒）
+PRIORITY_DEADLINES: Dict[Priority, float] = {
+    Priority.INTERACTIVE: 60.0,
+    Priority.PLANNING: 30.0,
+    Priority.EXECUTION: 60.0,
+    Priority.BACKGROUND: 10.0,
+}
+
+# 各优先级预期输出 token 数（准入时预扣）
+EXPECTED_COMPLETION_TOKENS: Dict[Priority, int] = {
+    Priority.INTERACTIVE: 800,
+    Priority.PLANNING: 300,
+    Priority.EXECUTION: 500,
+    Priority.BACKGROUND: 200,
+}
+
+# 当前上下文的优先级覆盖（例如预执行的步骤按后台任务调度）
+_priority_override: ContextVar[Optional[Priority]] = ContextVar("llm_priority_override", default=None)
+
+
+def set_llm_priority(priority: Optional[Priority]):
+    """设置当前上下文中 LLM 调用的优先级，覆盖节点默认优先级"""
+    _priority_override.set(priority)
+
+
+class LLMOverloadedError(Exception):
+    """排队超时或被丢弃"""
+
+
+class _TokenBucket:
+    """按分钟额度匀速补充的令牌桶，per_minute 为 0 时不限制"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离可以扣除 amount 还需等待的秒数"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        # 单次请求超过整桶额度时，等桶满即可放行
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        """扣除（可为负数表示归还），允许透支，由后续补充偿还"""
+        if self.capacity > 0:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    node: str = field(compare=False)
+    tokens: int = field(compare=False)
+    enqueued: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+@dataclass
+class Permit:
+    """准入凭证，完成后按实际输出修正 token 用量"""
+    node: str
+    priority: Priority
+    reserved: int
+    prompt_tokens: int
+
+
+class LLMGovernor:
+    """进程级 LLM 调度器"""
+
+    def __init__(self, enabled: bool = LLM_GOVERNOR_ENABLED, rpm: int = LLM_RPM, tpm: int = LLM_TPM,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 cooldown: float = LLM_RATE_LIMIT_COOLDOWN):
+        self.enabled = enabled
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.cooldown = cooldown
+        self._requests = _TokenBucket(rpm)
+        self._tokens = _TokenBucket(tpm)
+        self._heap = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.shed = 0
+
+    @staticmethod
+    def priority_of(node: str) -> Priority:
+        override = _priority_override.get()
+        if override is not None:
+            return override
+        return NODE_PRIORITIES.get(node, Priority.EXECUTION)
+
+    def _queued(self):
+        return [w for w in self._heap if not w.future.done()]
+
+    def _update_depth(self):
+        depth = {p: 0 for p in Priority}
+        for w in self._queued():
+            depth[Priority(w.priority)] += 1
+        for p, count in depth.items():
+            metrics.set_gauge("llm_queue_depth", count, priority=p.name.lower())
+
+    def _record_shed(self, waiter: _Waiter, reason: str):
+        self.shed += 1
+        metrics.inc("llm_shed", priority=Priority(waiter.priority).name.lower(), reason=reason)
+        logger.warning(f"LLM 请求被丢弃：node={waiter.node}，原因={reason}")
+
+    def _shed(self, waiter: _Waiter, reason: str):
+        """丢弃排队中的请求"""
+        if not waiter.future.done():
+            waiter.future.set_exception(LLMOverloadedError(f"LLM 请求被丢弃（{reason}）：{waiter.node}"))
+            self._record_shed(waiter, reason)
+
+    def _schedule(self, delay: float):
+        """delay 秒后再次尝试放行"""
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        """按优先级放行排队请求，直到额度或并发用完"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._heap:
+            waiter = self._heap[0]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            if self._active >= self.max_concurrency:
+                break
+            now = time.monotonic()
+            if now < self._paused_until:
+                self._schedule(self._paused_until - now)
+                break
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._schedule(wait)
+                break
+            heapq.heappop(self._heap)
+            self._requests.take(1)
+            self._tokens.take(waiter.tokens)
+            self._active += 1
+            waiter.future.set_result(None)
+            metrics.observe("llm_queue_wait_seconds", now - waiter.enqueued,
+                            priority=Priority(waiter.priority).name.lower())
+        self._update_depth()
+
+    async def acquire(self, node: str, prompt_tokens: int) -> Optional[Permit]:
+        """等待准入；排队超时或被丢弃时抛出 LLMOverloadedError"""
+        if not self.enabled:
+            return None
+        priority = self.priority_of(node)
+        reserved = prompt_tokens + EXPECTED_COMPLETION_TOKENS[priority]
+        waiter = _Waiter(priority, next(self._seq), node, reserved, time.monotonic(),
+                         asyncio.get_running_loop().create_future())
+
+        queued = self._queued()
+        if len(queued) >= self.max_queue:
+            # 队列已满：丢弃优先级最低、最晚到达的请求，新请求优先级不高于它时丢弃新请求
+            worst = max(queued, key=lambda w: (w.priority, w.seq))
+            if worst.priority <= priority:
+                self._record_shed(waiter, "overflow")
+                raise LLMOverloadedError(f"LLM 请求队列已满：{node}")
+            self._shed(worst, "overflow")
+
+        heapq.heappush(self._heap, waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter.future, timeout=PRIORITY_DEADLINES[priority])
+        except asyncio.TimeoutError:
+            # wait_for 超时会取消 future，排队记录在下次放行时清理
+            self._record_shed(waiter, "deadline")
+            self._update_depth()
+            raise LLMOverloadedError(f"LLM 请求排队超时：{node}")
+        except BaseException:
+            # 已放行但调用方被取消，归还并发名额
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self._finish(reserved, reserved)
+            raise
+        return Permit(node, priority, reserved, prompt_tokens)
+
+    def _finish(self, reserved: int, used: int):
+        self._tokens.take(used - reserved)
+        self._active -= 1
+        self._dispatch()
+
+    def release(self, permit: Optional[Permit], completion_tokens: Optional[int] = None):
+        """调用结束，按实际输出修正 token 用量"""
+        if permit is None:
+            return
+        used = permit.reserved if completion_tokens is None else permit.prompt_tokens + completion_tokens
+        self._finish(permit.reserved, used)
+
+    def on_rate_limited(self):
+        """上游返回 429：暂停放行，并丢弃排队中的后台任务"""
+        self._paused_until = max(self._paused_until, time.monotonic() + self.cooldown)
+        metrics.inc("llm_rate_limited")
+        for waiter in self._queued():
+            if waiter.priority == Priority.BACKGROUND:
+                self._shed(waiter, "rate_limited")
+        self._update_depth()
+
+    async def call(self, node: str, prompt_tokens: int, factory: Callable[[], Awaitable[T]]) -> T:
+        """非流式调用"""
+        permit = await self.acquire(node, prompt_tokens)
+        try:
+            return await factory()
+        except openai.RateLimitError:
+            self.on_rate_limited()
+            raise
+        finally:
+            self.release(permit)
+
+    async def stream(self, node: str, prompt: str, factory: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """流式调用：准入后才开始读取上游流，结束后按输出内容修正 token 用量"""
+        permit = await self.acquire(node, estimate_tokens(prompt))
+        completion_tokens = 0
+        stream = factory()
+        try:
+            async for chunk in stream:
+                completion_tokens += estimate_tokens(str(getattr(chunk, "content", "") or ""))
+                yield chunk
+        except openai.RateLimitError:
+            self.on_rate_limited()
+            raise
+        finally:
+            await stream.aclose()
+            self.release(permit, completion_tokens)
+
+    def stats(self) -> dict:
+        """当前排队和额度情况"""
+        now = time.monotonic()
+        queued = {p.name.lower(): 0 for p in Priority}
+        for w in self._queued():
+            queued[Priority(w.priority).name.lower()] += 1
+        self._requests._refill(now)
+        self._tokens._refill(now)
+        return {
+            "enabled": self.enabled,
+            "active": self._active,
+            "queued": queued,
+            "shed": self.shed,
+            "paused_seconds": round(max(0.0, self._paused_until - now), 3),
+            "rpm_available": round(self._requests.tokens, 1) if self._requests.capacity > 0 else None,
+            "tpm_available": round(self._tokens.tokens, 1) if self._tokens.capacity > 0 else None,
+        }
+
+
+# 全局调度器
+llm_governor = LLMGovernor()
+metrics.register_collector("llm_governor", llm_governor.stats)
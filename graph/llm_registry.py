@@ -0,0 +1,145 @@
+"""
+LLM 客户端注册表
+
+所有节点共享同一个 httpx.AsyncClient（连接池 + keep-alive，安装了 h2 时启用 HTTP/2），
+相同参数的 ChatOpenAI 只创建一次；流式回调不再挂在 LLM 实例上，而是按调用传入
+（见 single_flight.ainvoke 的 callbacks 参数）。传输层外包一层 CassetteTransport，用于录制/回放。
+"""
+
+import asyncio
+import importlib.util
+import os
+from typing import Dict, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+from graph.cassette import CassetteTransport
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-chat")
+# 连接池配置
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "120"))
+# 启动时预热的连接数（HTTP/2 下多路复用，一条即可）
+LLM_POOL_WARMUP = int(os.getenv("LLM_POOL_WARMUP", "2"))
+# HTTP/2 依赖 h2（requirements.txt 中的 httpx[http2]），缺失时告警并退回 HTTP/1.1 keep-alive
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+if LLM_HTTP2 and importlib.util.find_spec("h2") is None:
+    logger.warning("LLM_HTTP2=true 但未安装 h2，LLM 连接退回 HTTP/1.1（请安装 httpx[http2]）")
+    LLM_HTTP2 = False
+
+
+def model_key(llm) -> Tuple:
+    """模型配置指纹（绑定了参数的 Runnable 会带上绑定参数）"""
+    kwargs = getattr(llm, "kwargs", None) or {}
+    llm = getattr(llm, "bound", llm)
+    params = dict(getattr(llm, "_identifying_params", {}) or {})
+    params.update(kwargs)
+    params["base_url"] = getattr(llm, "openai_api_base", None)
+    params["max_retries"] = getattr(llm, "max_retries", None)
+    params["class"] = type(llm).__name__
+    return tuple(sorted((k, repr(v)) for k, v in params.items()))
+
+
+class LLMRegistry:
+    """共享连接池的 ChatOpenAI 注册表"""
+
+    def __init__(self, base_url: str = None, api_key: str = None):
+        self.base_url = base_url or os.getenv('DEEPSEEK_BASE_URL')
+        self.api_key = api_key or os.getenv('DEEPSEEK_API_KEY')
+        self._client: httpx.AsyncClient | None = None
+        self._transport: httpx.AsyncHTTPTransport | None = None
+        self._llms: Dict[Tuple, ChatOpenAI] = {}
+        self._requests = 0
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """共享的异步 HTTP 客户端（惰性创建，连接在首次请求时建立）"""
+        if self._client is None:
+            self._transport = httpx.AsyncHTTPTransport(
+                http2=LLM_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=LLM_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+                )
+            )
+            self._client = httpx.AsyncClient(
+                transport=CassetteTransport(self._transport),
+                timeout=httpx.Timeout(120.0, connect=10.0),
+                event_hooks={"request": [self._on_request]}
+            )
+        return self._client
+
+    async def _on_request(self, request: httpx.Request):
+        self._requests += 1
+
+    def get(self, streaming: bool = True, temperature: float = 0.7, max_retries: int = 2) -> ChatOpenAI:
+        """获取共享的 ChatOpenAI，相同参数返回同一实例"""
+        http_client = self.http_client
+        key = (LLM_MODEL, streaming, temperature, max_retries)
+        llm = self._llms.get(key)
+        if llm is None:
+            llm = ChatOpenAI(
+                model=LLM_MODEL,
+                api_key=self.api_key,
+                base_url=self.base_url,
+                temperature=temperature,
+                streaming=streaming,
+                max_retries=max_retries,
+                http_async_client=http_client
+            )
+            self._llms[key] = llm
+        return llm
+
+    async def warmup(self, connections: int = LLM_POOL_WARMUP):
+        """预热连接：提前完成 DNS、TCP 和 TLS 握手，首个请求不再承担建连耗时"""
+        if not self.base_url or connections <= 0:
+            return
+        url = self.base_url.rstrip("/") + "/models"
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        count = 1 if LLM_HTTP2 else connections
+        results = await asyncio.gather(
+            *[self.http_client.get(url, headers=headers, timeout=10.0) for _ in range(count)],
+            return_exceptions=True
+        )
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logger.warning(f"LLM 连接预热失败 {len(failed)}/{count}：{failed[0]!r}")
+        else:
+            logger.info(f"LLM 连接预热完成：{count} 条连接，HTTP/2={LLM_HTTP2}")
+
+    def stats(self) -> dict:
+        """连接池使用情况"""
+        connections = []
+        if self._client is not None and not self._client.is_closed:
+            # httpx 未公开连接池状态，从底层 httpcore 连接池读取
+            pool = getattr(self._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for c in connections if c.is_idle())
+        active = len(connections) - idle
+        return {
+            "http2": LLM_HTTP2,
+            "clients": len(self._llms),
+            "requests": self._requests,
+            "connections": len(connections),
+            "active": active,
+            "idle": idle,
+            "max_connections": LLM_POOL_MAX_CONNECTIONS,
+            "utilization": round(active / LLM_POOL_MAX_CONNECTIONS, 4) if LLM_POOL_MAX_CONNECTIONS else 0.0
+        }
+
+    async def aclose(self):
+        """关闭连接池（应用关闭时调用）"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+
+
+llm_registry = LLMRegistry()
+metrics.register_collector("llm_pool", llm_registry.stats)
@@ -1,11 +1,21 @@
 """
-工具调用日志中间件
+create_agent 中间件
 
-用于记录 create_agent 调用的工具
+- log_tool_call：记录调用的工具
+- hedge_model_call：executor 模型调用的调度准入和对冲请求
+- cassette_tool_call：录制/回放 MCP 工具调用的返回内容
 """
-from langchain.agents.middleware import wrap_tool_call
+import asyncio
 
+from langchain.agents.middleware import wrap_model_call, wrap_tool_call
+from langchain_core.messages import ToolMessage
+
+from graph.cassette import get_cassette, make_key
+from graph.hedging import hedge_policy
+from graph.llm_governor import llm_governor
 from utils.logger_util import logger
+from utils.metrics_util import metrics
+from utils.token_util import estimate_tokens
 
 
 @wrap_tool_call
@@ -22,5 +32,58 @@ async def log_tool_call(request, handler):
 
     logger.info(f"[Tool] {tool_name} | 输入: {tool_input}")
 
-    # 调用原始工具
-    return await handler(request)
+    # 调用原始工具；运行被取消时取消会传递到在途的 MCP 调用
+    try:
+        return await handler(request)
+    except asyncio.CancelledError:
+        logger.info(f"[Tool] {tool_name} | 运行取消，中止调用")
+        metrics.inc("tool_calls_cancelled", tool=tool_name)
+        raise
+
+
+def _request_tokens(request) -> int:
+    """估算模型请求的输入 token 数"""
+    messages = list(request.messages)
+    if request.system_message is not None:
+        messages.append(request.system_message)
+    return sum(estimate_tokens(str(m.content)) for m in messages)
+
+
+@wrap_model_call
+async def hedge_model_call(request, handler):
+    """模型调用经调度器准入；超过滚动延迟分位数时发出对冲请求（未开启时直接调用）"""
+    tokens = _request_tokens(request)
+    try:
+        return await hedge_policy.call(
+            "executor",
+            lambda: llm_governor.call("executor", tokens, lambda: handler(request))
+        )
+    except asyncio.CancelledError:
+        metrics.inc("llm_calls_cancelled", node="executor")
+        raise
+
+
+@wrap_tool_call
+async def cassette_tool_call(request, handler):
+    """开启 cassette 时录制工具返回内容，回放时直接返回录制结果而不调用 MCP 服务"""
+    cassette = get_cassette()
+    if cassette is None:
+        return await handler(request)
+
+    tool_call = request.tool_call
+    name = tool_call.get('name', 'unknown')
+    key = make_key({"name": name, "args": tool_call.get('args', {})})
+    if cassette.replaying:
+        recorded = cassette.take("tool", key, shape=name)
+        return ToolMessage(
+            content=recorded["content"],
+            tool_call_id=tool_call["id"],
+            name=name,
+            status=recorded.get("status", "success")
+        )
+
+    result = await handler(request)
+    if isinstance(result, ToolMessage):
+        cassette.record("tool", key, {"content": result.content, "status": result.status},
+                        shape=name, summary=str(tool_call.get('args', {}))[:80])
+    return result
@@ -0,0 +1,122 @@
+"""
+语义规划缓存
+
+很多用户会问几乎相同的规划问题（如“北京一日游怎么安排”），没必要每次都让 LLM 重新规划。
+缓存键由两部分组成：
+- 问题向量：相似度超过阈值即视为同一问题
+- 上下文摘要：检索到的记忆 + 最近对话历史的哈希，必须完全一致，避免把带个人偏好的计划给错人
+
+支持 TTL 过期、LRU 淘汰和单条命中计数。
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from utils.metrics_util import metrics
+from utils.vector_util import cosine
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_THRESHOLD = float(os.getenv("PLAN_CACHE_THRESHOLD", "0.95"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "3600"))
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "512"))
+# 参与上下文摘要的最近对话条数
+PLAN_CACHE_HISTORY_WINDOW = 6
+
+
+def context_digest(memories: List[str], messages: List[Tuple]) -> str:
+    """记忆 + 最近对话历史的摘要"""
+    recent = [list(m) for m in (messages or [])[-PLAN_CACHE_HISTORY_WINDOW:]]
+    payload = json.dumps({"memories": list(memories or []), "messages": recent}, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class PlanCacheEntry:
+    """缓存条目"""
+    question: str
+    vector: List[float]
+    digest: str
+    steps: List[str]
+    dependencies: List[List[int]]
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+class PlanCache:
+    """基于向量相似度的 LRU + TTL 规划缓存"""
+
+    def __init__(self, max_size: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL,
+                 threshold: float = PLAN_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, PlanCacheEntry]" = OrderedDict()
+        self._next_key = 0
+
+    def _expired(self, entry: PlanCacheEntry, now: float) -> bool:
+        return now - entry.created_at > self.ttl
+
+    def get(self, vector: List[float], digest: str) -> Optional[PlanCacheEntry]:
+        """查找相似度最高且超过阈值的计划"""
+        now = time.monotonic()
+        best_key, best_sim = None, self.threshold
+        for key, entry in list(self._entries.items()):
+            if self._expired(entry, now):
+                del self._entries[key]
+                continue
+            if entry.digest != digest:
+                continue
+            sim = cosine(vector, entry.vector)
+            if sim >= best_sim:
+                best_key, best_sim = key, sim
+
+        if best_key is None:
+            metrics.inc("plan_cache_misses")
+            return None
+
+        entry = self._entries[best_key]
+        entry.hits += 1
+        self._entries.move_to_end(best_key)
+        metrics.inc("plan_cache_hits")
+        return entry
+
+    def put(self, question: str, vector: List[float], digest: str,
+            steps: List[str], dependencies: List[List[int]]):
+        """写入计划，超出容量时淘汰最久未使用的条目"""
+        if not steps:
+            return
+        self._entries[self._next_key] = PlanCacheEntry(
+            question=question,
+            vector=list(vector),
+            digest=digest,
+            steps=list(steps),
+            dependencies=[list(d) for d in dependencies]
+        )
+        self._next_key += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            metrics.inc("plan_cache_evictions")
+
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """缓存统计（含每条的命中次数）"""
+        return {
+            "size": len(self._entries),
+            "entries": [
+                {"question": e.question, "steps": len(e.steps), "hits": e.hits}
+                for e in self._entries.values()
+            ],
+        }
+
+
+# 全局规划缓存
+plan_cache = PlanCache()
+metrics.register_collector("plan_cache", plan_cache.stats)
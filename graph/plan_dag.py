@@ -0,0 +1,136 @@
+"""
+计划步骤 DAG 调度
+
+规划师可以为每个步骤声明依赖（dependencies[i] 为第 i 个步骤依赖的步骤下标，从 0 开始），
+执行者据此把互不依赖的步骤并发执行，总耗时从“所有步骤之和”降为“关键路径”。
+未声明依赖（或依赖与步骤数量不匹配）时，退化为按顺序逐个执行。
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+StepRunner = Callable[[int, Dict[int, str]], Awaitable[str]]
+
+
+def normalize_dependencies(steps: List[str], dependencies: Optional[List[List[int]]]) -> List[List[int]]:
+    """校验并规范化依赖关系
+
+    - 依赖缺失或长度与步骤不一致：视为顺序执行（每步依赖上一步）
+    - 只保留指向前面步骤的依赖（j < i），天然保证无环
+    """
+    n = len(steps)
+    if not dependencies or len(dependencies) != n:
+        return [[i - 1] if i > 0 else [] for i in range(n)]
+
+    normalized = []
+    for i, deps in enumerate(dependencies):
+        valid = set()
+        for j in deps or []:
+            try:
+                j = int(j)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= j < i:
+                valid.add(j)
+        normalized.append(sorted(valid))
+    return normalized
+
+
+def remap_dependencies(old_steps: List[str], old_dependencies: Optional[List[List[int]]],
+                       new_steps: List[str]) -> List[List[int]]:
+    """用户修改计划后，把原依赖映射到新计划上
+
+    - 文本未变的步骤按文本对应到原步骤
+    - 同一位置上被改写的步骤视为原步骤的替换，沿用原步骤的依赖，依赖它的步骤也继续依赖它
+    - 其余新增步骤依赖其前面的所有步骤（保守处理）
+    """
+    old_deps = normalize_dependencies(old_steps, old_dependencies)
+    old_index = {}
+    for i, step in enumerate(old_steps):
+        old_index.setdefault(step.strip(), i)
+
+    # 新步骤下标 -> 原步骤下标
+    new_to_old = {}
+    for i, step in enumerate(new_steps):
+        old_i = old_index.get(step.strip())
+        if old_i is not None and old_i not in new_to_old.values():
+            new_to_old[i] = old_i
+    matched_old = set(new_to_old.values())
+    for i in range(min(len(old_steps), len(new_steps))):
+        if i not in new_to_old and i not in matched_old:
+            new_to_old[i] = i
+    old_to_new = {old_i: new_i for new_i, old_i in new_to_old.items()}
+
+    remapped = []
+    for i in range(len(new_steps)):
+        old_i = new_to_old.get(i)
+        if old_i is None:
+            remapped.append(list(range(i)))
+            continue
+        deps = set()
+        for old_j in old_deps[old_i]:
+            new_j = old_to_new.get(old_j)
+            if new_j is not None and new_j < i:
+                deps.add(new_j)
+        remapped.append(sorted(deps))
+    return remapped
+
+
+def drop_steps(steps: List[str], dependencies: List[List[int]], dropped: Set[int]) -> Tuple[List[str], List[List[int]], List[List[int]]]:
+    """从计划中移除已有结果的步骤
+
+    返回 (剩余步骤, 剩余步骤间的依赖, 每个剩余步骤所依赖的被移除步骤在原计划中的下标)
+    """
+    dependencies = normalize_dependencies(steps, dependencies)
+    new_index = {}
+    for i in range(len(steps)):
+        if i not in dropped:
+            new_index[i] = len(new_index)
+
+    remaining, remaining_deps, inherited = [], [], []
+    for i, step in enumerate(steps):
+        if i in dropped:
+            continue
+        remaining.append(step)
+        remaining_deps.append([new_index[j] for j in dependencies[i] if j in new_index])
+        inherited.append([j for j in dependencies[i] if j in dropped])
+    return remaining, remaining_deps, inherited
+
+
+def critical_path_length(dependencies: List[List[int]]) -> int:
+    """关键路径上的步骤数（用于日志）"""
+    depth = []
+    for deps in dependencies:
+        depth.append(1 + max((depth[j] for j in deps), default=0))
+    return max(depth, default=0)
+
+
+async def run_plan_dag(steps: List[str], dependencies: List[List[int]], run_step: StepRunner,
+                       max_concurrency: int = 3) -> List[str]:
+    """按依赖关系并发执行步骤，返回与 steps 顺序一致的结果列表
+
+    run_step(i, dep_results) 负责执行第 i 个步骤，dep_results 为其依赖步骤的结果。
+    任一步骤失败时取消其余步骤并抛出异常。
+    """
+    n = len(steps)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    results: List[Optional[str]] = [None] * n
+    finished = [asyncio.Event() for _ in range(n)]
+
+    async def _run(i: int):
+        for j in dependencies[i]:
+            await finished[j].wait()
+        async with semaphore:
+            results[i] = await run_step(i, {j: results[j] for j in dependencies[i]})
+        finished[i].set()
+
+    # create_task 会复制当前 context，子任务中依然可以拿到 stream queue
+    tasks = [asyncio.create_task(_run(i)) for i in range(n)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return results
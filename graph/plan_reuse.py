@@ -0,0 +1,36 @@
+"""
+计划步骤结果复用
+
+用户在 /approve 中修改计划后，本轮已经拿到结果的步骤（针对当前问题已完成的预执行）无需重新执行。
+只按归一化文本精确匹配：模板化的步骤（如“查询北京天气”与“查询上海天气”）向量相似度很高，
+但参数不同结果就不同，不能互相复用。
+
+线程的 past_steps 是历次执行的累加，夹带之前轮次（其他问题、其他日期）的结果，不作为复用来源。
+"""
+
+import os
+from typing import Dict, List, Tuple
+
+from graph.speculative import normalize_step
+
+PLAN_REUSE_ENABLED = os.getenv("PLAN_REUSE_ENABLED", "true").lower() == "true"
+
+
+def match_executed_steps(plan: List[str], executed: List[Tuple[str, str]]) -> Dict[int, Tuple[str, str]]:
+    """为计划中的步骤匹配可复用的已执行步骤
+
+    executed: 当前问题下的 [(已执行步骤, 结果)]，同一步骤出现多次时以最后一次为准
+    返回 {计划下标: (匹配到的已执行步骤, 结果)}
+    """
+    latest: Dict[str, Tuple[str, str]] = {}
+    for step, result in executed:
+        latest[normalize_step(step)] = (step, result)
+    if not latest:
+        return {}
+
+    matches: Dict[int, Tuple[str, str]] = {}
+    for i, step in enumerate(plan):
+        hit = latest.get(normalize_step(step))
+        if hit is not None:
+            matches[i] = hit
+    return matches
@@ -58,8 +58,10 @@ planner_prompt = """
 4. **步骤数量**：根据任务复杂度灵活调整，一般5-10个步骤为宜
 
 ## 输出格式
-仅输出 JSON，包含一个字段：
+仅输出 JSON，包含两个字段：
 - steps：字符串数组（string[]），每个元素为一个具体、可执行的步骤。
+- dependencies：二维整数数组（int[][]），长度与 steps 相同；dependencies[i] 为第 i 个步骤必须等待完成的步骤下标（从 0 开始，只能引用前面的步骤）。
+  互不相关的步骤（如“查询北京天气”和“查询上海到北京的高铁”）不要相互依赖，以便并行执行；没有依赖时填空数组 []。
 
 不要包含任何额外文本、解释、注释或 Markdown。
 
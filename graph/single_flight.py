@@ -0,0 +1,198 @@
+"""
+LLM 请求合并（single-flight）
+
+突发流量下大量请求会发出完全相同的提示词（无记忆时的 route_prompt、同一问题的
+name_conversation_prompt、同一工具结果的 summary_prompt）。相同模型参数 + 相同提示词的请求
+正在执行时，后到的请求不再调用上游，而是订阅第一个请求的结果：流式调用从头回放已生成的
+chunk 并继续跟随后续 chunk，非流式调用等待完整结果。
+
+只合并“正在执行”的请求，上游调用结束后立即移除，不做结果缓存；
+所有订阅者都提前离开（例如路由字段解析完成后关闭流）时取消上游调用。
+
+上游调用带 nostream 标签，不直接进入 LangGraph 的 messages 流（对冲落后的请求、合并后的共享流
+都不会重复输出 token）；需要向前端输出 token 的调用方使用 ainvoke(stream=True)，
+每个调用方各自上报一次聊天模型运行，messages 模式由此输出 token。
+"""
+
+import asyncio
+import os
+from contextlib import aclosing
+from functools import reduce
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import (
+    BaseMessage, BaseMessageChunk, HumanMessage, convert_to_messages, message_chunk_to_message
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, LLMResult
+from langchain_core.runnables.config import ensure_config, get_async_callback_manager_for_config
+from langgraph.constants import TAG_NOSTREAM
+
+from graph.hedging import hedge_policy
+from graph.llm_governor import llm_governor
+from graph.llm_registry import model_key
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+
+LLM_SINGLE_FLIGHT_ENABLED = os.getenv("LLM_SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# 上游调用不进入 messages 流
+_UPSTREAM_CONFIG = {"tags": [TAG_NOSTREAM]}
+
+
+class _Flight:
+    """一次正在执行的上游调用"""
+
+    def __init__(self, key: Tuple):
+        self.key = key
+        self.chunks: List[BaseMessageChunk] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.condition = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """相同的在途 LLM 请求只调用一次上游"""
+
+    def __init__(self, enabled: bool = LLM_SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[Tuple, _Flight] = {}
+        self.leaders = 0
+        self.shared = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def _key(llm, prompt) -> Tuple:
+        return model_key(llm), prompt if isinstance(prompt, str) else repr(prompt)
+
+    @staticmethod
+    def _upstream(llm, prompt, node: str) -> AsyncIterator[BaseMessageChunk]:
+        """上游调用：对冲的每个请求都先经过调度器准入"""
+        text = prompt if isinstance(prompt, str) else repr(prompt)
+        return hedge_policy.stream(node, lambda: llm_governor.stream(node, text, lambda: llm.astream(prompt, config=_UPSTREAM_CONFIG)))
+
+    async def _produce(self, flight: _Flight, llm, prompt, node: str):
+        """上游调用，chunk 追加到 flight 并通知订阅者"""
+        try:
+            async with aclosing(self._upstream(llm, prompt, node)) as stream:
+                async for chunk in stream:
+                    async with flight.condition:
+                        flight.chunks.append(chunk)
+                        flight.condition.notify_all()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            flight.done = True
+            async with flight.condition:
+                flight.condition.notify_all()
+
+    async def astream(self, llm, prompt, node: str = "default") -> AsyncIterator[BaseMessageChunk]:
+        """流式调用；相同请求在途时共享其 chunk 流
+
+        node 用于按节点统计延迟和对冲（见 hedging.HedgePolicy）
+        """
+        if not self.enabled:
+            async with aclosing(self._upstream(llm, prompt, node)) as stream:
+                async for chunk in stream:
+                    yield chunk
+            return
+
+        key = self._key(llm, prompt)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(key)
+            self._flights[key] = flight
+            # create_task 复制当前 context，上游调用沿用第一个调用方的运行配置
+            flight.task = asyncio.create_task(self._produce(flight, llm, prompt, node))
+            self.leaders += 1
+            metrics.inc("llm_single_flight", role="leader")
+        else:
+            self.shared += 1
+            metrics.inc("llm_single_flight", role="shared")
+            logger.info(f"合并相同的在途 LLM 请求，当前订阅者 {flight.subscribers + 1} 个")
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                async with flight.condition:
+                    await flight.condition.wait_for(lambda: flight.done or len(flight.chunks) > index)
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 所有订阅者都已离开，取消上游调用
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+                self.cancelled += 1
+                metrics.inc("llm_single_flight_cancelled")
+
+    @staticmethod
+    async def _start_run(prompt, node: str):
+        """以当前运行配置上报一次聊天模型运行（LangGraph 的 messages 模式据此输出 token）"""
+        manager = get_async_callback_manager_for_config(ensure_config())
+        messages = [HumanMessage(content=prompt)] if isinstance(prompt, str) else convert_to_messages(prompt)
+        run_managers = await manager.on_chat_model_start({"name": node}, [messages], name=node)
+        return run_managers[0]
+
+    async def ainvoke(self, llm, prompt, callbacks: Sequence[BaseCallbackHandler] = (),
+                      node: str = "default", stream: bool = False) -> BaseMessage:
+        """完整调用
+
+        stream=True：作为一次聊天模型运行上报给当前运行配置的回调，
+        工作流以 stream_mode="messages" 运行时逐 token 输出（合并的请求每个调用方各自输出）
+        callbacks：按 token 收到 on_llm_new_token
+        """
+        run_manager = await self._start_run(prompt, node) if stream else None
+        chunks = []
+        try:
+            async for chunk in self.astream(llm, prompt, node=node):
+                chunks.append(chunk)
+                if chunk.content:
+                    if run_manager is not None:
+                        await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+                    for callback in callbacks:
+                        callback.on_llm_new_token(chunk.content)
+            if not chunks:
+                raise ValueError("LLM 未返回任何内容")
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                # 运行被取消（例如客户端断开），astream 退出时关闭上游流，不再消耗 token
+                metrics.inc("llm_calls_cancelled", node=node)
+            if run_manager is not None:
+                await run_manager.on_llm_error(e)
+            raise
+        message = message_chunk_to_message(reduce(lambda a, b: a + b, chunks))
+        if run_manager is not None:
+            await run_manager.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+        return message
+
+    def stats(self) -> dict:
+        """合并统计"""
+        total = self.leaders + self.shared
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "cancelled": self.cancelled,
+            "dedup_ratio": round(self.shared / total, 4) if total else 0.0,
+        }
+
+
+# 全局 single-flight，所有节点共享
+single_flight = SingleFlight()
+metrics.register_collector("llm_single_flight", single_flight.stats)
@@ -0,0 +1,138 @@
+"""
+计划预执行（投机执行）
+
+human_review 在 interrupt() 中等待用户时，大多数用户会原样批准计划。
+开启后（SPECULATIVE_STEPS > 0），计划发出的同时在后台以线程 id 为键预先执行前 N 个无依赖步骤：
+- AssistantService.approve 时，保留用户未修改的步骤对应的预执行任务，其余全部取消丢弃
+- executor 执行到这些步骤时直接采用预执行结果（仍在运行则等待其完成），不再重复执行
+
+只预执行无依赖的步骤：它们的结果只取决于用户问题和步骤文本，用户修改其他步骤不会使其失效。
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+
+# 预执行的步骤数，0 表示关闭
+SPECULATIVE_STEPS = int(os.getenv("SPECULATIVE_STEPS", "0"))
+# 用户迟迟不审批时，预执行结果的保留时间（秒）
+SPECULATIVE_TTL = float(os.getenv("SPECULATIVE_TTL", "600"))
+
+
+def normalize_step(step: str) -> str:
+    """步骤文本归一化：只去掉空白，步骤参数（城市、日期等）原样保留
+
+    预执行和计划步骤复用共用，保证两处对“同一步骤”的判断一致。
+    """
+    return "".join(str(step).split())
+
+
+def _log_failure(task: asyncio.Task):
+    """预执行失败不影响正式执行，这里只记录日志（同时避免未取回异常的告警）"""
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"预执行步骤失败：{task.exception()}")
+
+
+@dataclass
+class SpeculativeRun:
+    """某个线程的一次预执行"""
+    question: str
+    tasks: Dict[str, asyncio.Task]
+    steps: Dict[str, str] = field(default_factory=dict)  # 归一化文本 -> 原步骤文本
+    created_at: float = field(default_factory=time.monotonic)
+    expiry: Optional[asyncio.TimerHandle] = None
+
+
+class SpeculativeExecutor:
+    """按线程管理预执行任务"""
+
+    def __init__(self, max_steps: int = SPECULATIVE_STEPS, ttl: float = SPECULATIVE_TTL):
+        self.max_steps = max_steps
+        self.ttl = ttl
+        self._runs: Dict[str, SpeculativeRun] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_steps > 0
+
+    def start(self, thread_id: str, question: str, plan: List[str], dependencies: List[List[int]],
+              run_step: Callable[[int], Awaitable[str]]):
+        """计划发出时启动预执行，run_step(i) 执行第 i 个步骤"""
+        self.discard(thread_id)
+        if not self.enabled or not plan:
+            return
+
+        roots = [i for i, deps in enumerate(dependencies) if not deps][:self.max_steps]
+        tasks, steps = {}, {}
+        for i in roots:
+            key = normalize_step(plan[i])
+            if key not in tasks:
+                task = asyncio.create_task(run_step(i))
+                task.add_done_callback(_log_failure)
+                tasks[key] = task
+                steps[key] = plan[i]
+
+        run = SpeculativeRun(question=question, tasks=tasks, steps=steps)
+        run.expiry = asyncio.get_running_loop().call_later(self.ttl, self.discard, thread_id)
+        self._runs[thread_id] = run
+        metrics.inc("speculative_steps_started", len(tasks))
+        logger.info(f"线程 {thread_id} 开始预执行 {len(tasks)} 个步骤")
+
+    def reconcile(self, thread_id: str, final_plan: List[str]):
+        """用户审批后：保留未修改步骤的预执行任务，丢弃其余"""
+        run = self._runs.get(thread_id)
+        if run is None:
+            return
+        kept = {normalize_step(step) for step in final_plan}
+        for key in list(run.tasks):
+            if key not in kept:
+                run.tasks.pop(key).cancel()
+                metrics.inc("speculative_steps_discarded")
+        logger.info(f"线程 {thread_id} 保留 {len(run.tasks)} 个预执行步骤")
+        if not run.tasks:
+            self.discard(thread_id)
+
+    def completed(self, thread_id: str, question: str) -> List[Tuple[str, str]]:
+        """已成功完成的预执行步骤 [(步骤, 结果)]"""
+        run = self._runs.get(thread_id)
+        if run is None or run.question != question:
+            return []
+        return [
+            (run.steps[key], task.result())
+            for key, task in run.tasks.items()
+            if task.done() and not task.cancelled() and task.exception() is None
+        ]
+
+    def take(self, thread_id: str, question: str, step: str) -> Optional[asyncio.Task]:
+        """executor 取走某个步骤的预执行任务（问题不一致时视为无效）"""
+        run = self._runs.get(thread_id)
+        if run is None or run.question != question:
+            return None
+        task = run.tasks.pop(normalize_step(step), None)
+        if task is not None:
+            metrics.inc("speculative_steps_adopted")
+        if not run.tasks:
+            self._runs.pop(thread_id, None)
+            if run.expiry:
+                run.expiry.cancel()
+        return task
+
+    def discard(self, thread_id: str):
+        """取消并丢弃线程的全部预执行任务（用户取消、新一轮规划或超时）"""
+        run = self._runs.pop(thread_id, None)
+        if run is None:
+            return
+        if run.expiry:
+            run.expiry.cancel()
+        for task in run.tasks.values():
+            task.cancel()
+            metrics.inc("speculative_steps_discarded")
+
+
+# 全局预执行管理器
+speculative_executor = SpeculativeExecutor()
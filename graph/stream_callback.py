@@ -1,56 +1,32 @@
-import asyncio
-import os
-from contextvars import ContextVar
+"""
+节点向前端推送事件
 
-from dotenv import load_dotenv
-from langchain_core.callbacks import BaseCallbackHandler
-from langchain_openai import ChatOpenAI
+工作流以 astream(stream_mode=["messages", "custom", "updates"]) 运行（见 AssistantService）：
+- 状态、规划步骤等事件由节点通过 LangGraph 的 custom stream writer 写出，原样转发
+- token 由 messages 模式输出（见 SingleFlight.ainvoke(stream=True)），不再经过回调和 contextvar 队列
+- 等待审批由 updates 模式中的 __interrupt__ 得到
+"""
 
-# 使用 contextvar 存储 queue，避免通过 state 传递（state 会被序列化）
-# ContextVar 保证数据每个请求独立，互不干扰
-_stream_queue: ContextVar[asyncio.Queue] = ContextVar('stream_queue', default=None)
+from langchain_core.runnables.config import var_child_runnable_config
+from langgraph.config import get_stream_writer
 
+from graph.llm_registry import llm_registry
 
-def set_stream_queue(queue: asyncio.Queue):
-    """设置当前请求的 queue"""
-    _stream_queue.set(queue)
 
+def emit(event: dict):
+    """写出一个事件；不在工作流中运行时（直接调用节点、后台预执行）丢弃"""
+    try:
+        writer = get_stream_writer()
+    except (RuntimeError, KeyError):
+        return
+    writer(event)
 
-def get_stream_queue() -> asyncio.Queue | None:
-    """获取当前请求的 queue"""
-    return _stream_queue.get()
-
-
-class StreamCallback(BaseCallbackHandler):
-    """自定义回调，用于捕获每个 token 并推送到队列"""
-
-    def __init__(self, node_name: str):
-        self.node_name = node_name
-
-    def on_llm_new_token(self, token: str, **kwargs):
-        """LLM 生成新 token 时调用"""
-        if token:
-            queue = get_stream_queue()
-            if queue:
-                queue.put_nowait({
-                    "type": "token",
-                    "node": self.node_name,
-                    "data": {"content": token}
-                })
-
-
-def create_streaming_llm(node_name: str):
-    """创建支持流式的 LLM"""
-    load_dotenv()
-    llm = ChatOpenAI(
-        model="deepseek-chat",
-        api_key=os.getenv('DEEPSEEK_API_KEY'),
-        base_url=os.getenv('DEEPSEEK_BASE_URL'),
-        temperature=0.7,
-        streaming=True,
-        callbacks=[StreamCallback(node_name)]
-    )
-    return llm
 
+def detach_stream():
+    """当前任务脱离所在的工作流运行：不再写出事件，LLM 调用也不再上报给它的回调（用于后台预执行）"""
+    var_child_runnable_config.set(None)
 
 
+def create_streaming_llm(node_name: str, queue=None):
+    """同步工作流（graph/nodes.py）使用的共享流式 LLM；token 同样由 stream_mode="messages" 输出"""
+    return llm_registry.get(streaming=True).with_config(run_name=node_name)
@@ -0,0 +1,126 @@
+"""
+分级摘要
+
+executor 每个步骤的结果按长度分级处理，替代“超过 2000 字就调用一次 async_abstract”：
+- 短结果：原样保留
+- 中等结果：本地抽取式摘要，按 bge-m3 与步骤文本的相似度给句子排序，取前若干句（保持原文顺序）
+- 超长结果：LLM map-reduce，按块并发摘要后合并，必要时再做一次归并摘要
+
+两条路径都受 token 预算约束，超出部分截断。
+"""
+
+import asyncio
+import os
+import re
+from typing import Awaitable, Callable, List, Optional
+
+from graph.async_function import async_abstract
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+from utils.token_util import estimate_tokens
+from utils.vector_util import dot
+
+# 不做摘要的长度上限（字符）
+SUMMARY_PASSTHROUGH_CHARS = int(os.getenv("SUMMARY_PASSTHROUGH_CHARS", "2000"))
+# 超过该长度才使用 LLM map-reduce，否则走本地抽取
+SUMMARY_LLM_CHARS = int(os.getenv("SUMMARY_LLM_CHARS", "12000"))
+# 摘要的 token 预算
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "800"))
+# map 阶段每块的字符数和最多块数（超出部分丢弃，限制成本和延迟）
+SUMMARY_CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", "6000"))
+SUMMARY_MAX_CHUNKS = int(os.getenv("SUMMARY_MAX_CHUNKS", "8"))
+# 抽取式摘要最多参与排序的句子数
+_MAX_SENTENCES = 400
+_MAX_SENTENCE_CHARS = 300
+
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;\n])")
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """按 token 预算截断"""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中英文句末标点和换行切句"""
+    sentences = []
+    for piece in _SENTENCE_END.split(text):
+        piece = piece.strip()
+        if not piece:
+            continue
+        sentences.append(piece[:_MAX_SENTENCE_CHARS])
+    return sentences[:_MAX_SENTENCES]
+
+
+async def extractive_summary(step: str, content: str,
+                             embed_query: Callable[[str], Awaitable[List[float]]],
+                             embed_documents: Callable[[List[str]], Awaitable[List[List[float]]]],
+                             budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """本地抽取式摘要：选与步骤最相关的句子，直到用完预算"""
+    sentences = split_sentences(content)
+    if not sentences:
+        return truncate_to_budget(content, budget)
+
+    query_vector, sentence_vectors = await asyncio.gather(embed_query(step), embed_documents(sentences))
+    ranked = sorted(range(len(sentences)), key=lambda i: dot(query_vector, sentence_vectors[i]), reverse=True)
+
+    chosen, used = [], 0
+    for i in ranked:
+        cost = estimate_tokens(sentences[i])
+        if used + cost > budget:
+            continue
+        chosen.append(i)
+        used += cost
+    return "\n".join(sentences[i] for i in sorted(chosen))
+
+
+async def map_reduce_summary(content: str, budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """LLM map-reduce 摘要：各块并发摘要，合并后超预算再归并一次"""
+    chunks = [content[i:i + SUMMARY_CHUNK_CHARS] for i in range(0, len(content), SUMMARY_CHUNK_CHARS)]
+    if len(chunks) > SUMMARY_MAX_CHUNKS:
+        logger.info(f"结果过长，只摘要前 {SUMMARY_MAX_CHUNKS}/{len(chunks)} 块")
+        chunks = chunks[:SUMMARY_MAX_CHUNKS]
+
+    summaries = await asyncio.gather(*[async_abstract(chunk) for chunk in chunks])
+    merged = "\n".join(s for s in summaries if s)
+    if len(chunks) > 1 and estimate_tokens(merged) > budget:
+        merged = await async_abstract(merged)
+    return truncate_to_budget(merged, budget)
+
+
+async def summarize_step_result(step: str, content: str,
+                                embed_query: Optional[Callable] = None,
+                                embed_documents: Optional[Callable] = None,
+                                budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """按结果长度选择摘要方式"""
+    length = len(content)
+    if length <= SUMMARY_PASSTHROUGH_CHARS:
+        return content
+
+    if length <= SUMMARY_LLM_CHARS and embed_query is not None and embed_documents is not None:
+        try:
+            summary = await extractive_summary(step, content, embed_query, embed_documents, budget)
+            metrics.inc("step_summaries", tier="extractive")
+            logger.info(f"抽取式摘要：{length} 字 -> {len(summary)} 字")
+            return summary
+        except Exception as e:
+            logger.warning(f"抽取式摘要失败，改用 LLM 摘要：{e}")
+
+    try:
+        summary = await map_reduce_summary(content, budget)
+        metrics.inc("step_summaries", tier="llm")
+        logger.info(f"LLM 摘要：{length} 字 -> {len(summary)} 字")
+        return summary
+    except Exception as e:
+        logger.warning(f"LLM 摘要失败，直接截断：{e}")
+        metrics.inc("step_summaries", tier="truncate")
+        return truncate_to_budget(content, budget)
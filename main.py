@@ -11,6 +11,9 @@ from pydantic import BaseModel, Field
 
 from api import assistant_api
 from api.assistant_api import assistant_service
+from graph.cassette import load_cassette_from_env, use_cassette
+from graph.llm_registry import llm_registry
+from service.job_runner import job_runner
 from utils.logger_util import logger
 
 T = TypeVar("T")
@@ -27,11 +30,20 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时初始化
     logger.info("🚀应用启动中...")
+    # 按 CASSETTE_MODE 开启 LLM / 工具调用的录制或回放
+    cassette = load_cassette_from_env()
+    # 预热 LLM 连接池
+    await llm_registry.warmup()
     logger.info("✅应用启动完成...")
     yield
     # 关闭时清理
     logger.info("应用关闭中...")
+    await job_runner.close()
     await assistant_service.close()
+    await llm_registry.aclose()
+    if cassette is not None and not cassette.replaying:
+        cassette.save()
+    use_cassette(None)
 
 
 # FastAPI setup
@@ -2,40 +2,68 @@ import asyncio
 import inspect
 import os
 import traceback
+from contextlib import aclosing
 from datetime import datetime
 
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessageChunk
 from langgraph.errors import GraphInterrupt
 
 from graph.async_workflow import async_workflow, compiled_async_workflow
-from graph.stream_callback import set_stream_queue
+from graph.llm_governor import LLMOverloadedError
+from graph.llm_registry import llm_registry
+from graph.plan_dag import remap_dependencies, drop_steps
+from graph.plan_reuse import match_executed_steps, PLAN_REUSE_ENABLED
+from graph.single_flight import single_flight
+from graph.speculative import speculative_executor
 from pojo.entity.conversation_entity import Conversation
 from pojo.request.chat_request import ChatRequest
 from pojo.request.conversation_add_request import ConversationAddRequest
 from pojo.request.conversation_delete_request import ConversationDeleteRequest
 from pojo.request.approve_request import ApproveRequest
+from service.event_pump import EventPump, WORKFLOW_END
+from service.job_runner import Job, job_runner
+from service.stream_session import Subscriber, stream_sessions
 from service.prompts import name_conversation_prompt
 from utils.db_util import create_session
 from utils.id_util import id_worker
 from utils.logger_util import logger
 from utils.parse_llm_json_util import parse_llm_json
 
-llm = ChatOpenAI(
-    model="deepseek-chat",
-    api_key=os.getenv('DEEPSEEK_API_KEY'),
-    base_url=os.getenv('DEEPSEEK_BASE_URL'),
-    temperature=0.7,
-    streaming=True,  # 开启流式
-    max_retries=2  # 添加重试
-)
+llm = llm_registry.get(streaming=True)
+
+# 工作流唯一的事件来源：messages（LLM token）、custom（节点写出的事件）、updates（中断）
+STREAM_MODES = ["messages", "custom", "updates"]
+# 向前端输出 token 的节点 -> 事件中的 node 名称
+TOKEN_NODES = {"direct_answer": "direct_answer", "plan_summary": "reflect"}
+
+
+def to_stream_event(mode: str, chunk):
+    """把 astream 的一项转换为前端事件，不需要转发时返回 None"""
+    if mode == "custom":
+        # 节点写出的事件原样转发
+        return chunk
+    if mode == "messages":
+        message, metadata = chunk
+        node = TOKEN_NODES.get(metadata.get("langgraph_node"))
+        # 只转发流式 chunk，运行结束时的完整消息不再重复输出
+        if node is None or not isinstance(message, AIMessageChunk) or not message.content:
+            return None
+        return {"type": "token", "node": node, "data": {"content": message.content}}
+    if mode == "updates" and "__interrupt__" in chunk:
+        for item in chunk["__interrupt__"]:
+            value = item.value
+            if isinstance(value, dict) and value.get("type") == "human_review":
+                return {"type": "waiting_for_approval", "data": {"plan": value.get("plan", [])}}
+    return None
 
 class AssistantService:
-    def __init__(self):
+    def __init__(self, checkpointer=None):
+        """checkpointer：指定时直接使用（例如压测、cassette 回放使用的 InMemorySaver），不再读取 POSTGRES_URI"""
         self._initialized = False
         self._init_lock = asyncio.Lock()
         self._app = None
         self._pool = None
-        self._checkpointer = None
+        self._checkpointer = checkpointer
 
     async def _ensure_initialized(self):
         """初始化工作流"""
@@ -48,7 +76,10 @@ class AssistantService:
 
             db_uri = os.getenv("POSTGRES_URI")
 
-            if db_uri:
+            if self._checkpointer is not None:
+                self._app = async_workflow.compile(checkpointer=self._checkpointer)
+                logger.info(f"AssistantService 初始化完成（使用 {type(self._checkpointer).__name__}）")
+            elif db_uri:
                 try:
                     from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
                     from psycopg_pool import AsyncConnectionPool
@@ -96,22 +127,26 @@ class AssistantService:
             logger.info("AssistantService 连接池已关闭")
 
     async def chat(self, request: ChatRequest):
-        """流式chatbox实现 - token 级别"""
+        """流式chatbox实现 - token 级别，产出 (事件 id, 事件)"""
+        job = await self.submit_chat(request)
+        async for item in self.subscribe_run(job):
+            yield item
+
+    async def submit_chat(self, request: ChatRequest) -> Job:
+        """提交聊天运行，由后台 worker 执行；排队已满时抛出 JobQueueFullError"""
         await self._ensure_initialized()
 
         question = request.question
         thread_id = request.thread_id
         user_id = request.user_id
 
-        queue = asyncio.Queue()
-        workflow_done = False
-
-        # 使用 contextvars 设置 queue（避免放入 state 导致序列化失败）
-        set_stream_queue(queue)
+        pump = EventPump(name=str(thread_id))
 
         state = {
             "question": question,
             "plan": [],
+            "plan_dependencies": [],
+            "plan_prior_results": [],
             "past_steps": [],
             "response": "",
             "route": "",
@@ -126,76 +161,80 @@ class AssistantService:
 
         # 后台运行工作流
         async def run_workflow():
-            # nonlocal关键字，可以读取外部变量workflow_done并且修改它，如果不加这个关键字，那么workflow_node就不会被修改
-            nonlocal workflow_done
             interrupted = False
             try:
-                async for event in self._app.astream(state, config=config):
-                    # 这里可以处理节点级别的事件（如果需要）
-                    pass
+                await self._stream_workflow(state, config, pump)
             except GraphInterrupt:
                 # 人机交互中断，节点内部已发送 waiting_for_approval
                 interrupted = True
             except Exception as e:
                 logger.error(f"工作流执行出错: {e}")
-                await queue.put({"type": "error", "data": {"message": str(e)}})
+                pump.queue.put_nowait({"type": "error", "data": {"message": str(e)}})
+                raise
             finally:
                 if not interrupted:
-                    await queue.put({"type": "workflow_end"})
-                    workflow_done = True
-
-        # 启动工作流任务
-        workflow_task = asyncio.create_task(run_workflow())
-
-        try:
-            while True:
-                # 检查是否结束
-                if workflow_done and queue.empty():
-                    break
-
-                # 从队列获取事件（token 或结束信号）
-                try:
-                    event = await asyncio.wait_for(queue.get(), timeout=0.5)
-                except asyncio.TimeoutError:
-                    # 发送心跳保持连接
-                    yield {
-                        "type": "heartbeat",
-                        "data": {}
-                    }
-                    continue
-
-                if event.get("type") == "token": # 处理 token 事件
-                    yield {
-                        "type": "token",
-                        "node": event.get("node"),
-                        "data": event.get("data", {})
-                    }
-                elif event.get("type") == "workflow_end": # 处理工作流结束
-                    yield {
-                        "type": "workflow_end",
-                        "data": {}
-                    }
-                elif event.get("type") == "error": # 处理错误
-                    yield {
-                        "type": "error",
-                        "data": event.get("data", {})
-                    }
-                elif event.get("type") == "status": # 处理状态
-                    yield {
-                        "type": "status",
-                        "data": event.get("data", {})
-                    }
-                elif event.get("type") == "waiting_for_approval":  # 人机交互中断
-                    yield {
-                        "type": "waiting_for_approval",
-                        "data": event.get("data", {})
-                    }
-
-        except asyncio.CancelledError:
-            workflow_task.cancel()
-        finally:
-            if not workflow_task.done():
-                workflow_task.cancel()
+                    pump.queue.put_nowait(WORKFLOW_END)
+                pump.close()
+
+        # 后台 worker 执行工作流（与 HTTP 连接无关，见 JobRunner / StreamSession）
+        return job_runner.submit("chat", thread_id, pump, run_workflow)
+
+    async def _stream_workflow(self, state, config: dict, pump: EventPump):
+        """运行工作流，把 messages / custom / updates 流转换为前端事件写入事件泵（队列满时按其策略等待）"""
+        async for mode, chunk in self._app.astream(state, config=config, stream_mode=STREAM_MODES):
+            event = to_stream_event(mode, chunk)
+            if event is not None:
+                await pump.queue.put(event)
+
+    @staticmethod
+    async def subscribe_run(job: Job, last_event_id: int = None, subscriber: Subscriber = None):
+        """订阅运行的事件，产出 (事件 id, 事件)；首次订阅先产出不编号的 run 事件告知运行 id
+
+        subscriber 由调用方通过 job.session.attach 预先创建时，可在别处结束订阅（见 client_disconnected）
+        """
+        if subscriber is None:
+            subscriber = job.session.attach(last_event_id)
+        if last_event_id is None:
+            yield None, {"type": "run", "data": {"run_id": job.run_id, "status": job.status}}
+        async with aclosing(subscriber.events()) as events:
+            async for item in events:
+                yield item
+
+    @staticmethod
+    def get_run(run_id: str):
+        """查询运行"""
+        return job_runner.get(run_id)
+
+    @staticmethod
+    def cancel_run(run_id: str):
+        """取消运行"""
+        return job_runner.cancel(run_id)
+
+    @staticmethod
+    def client_disconnected(subscriber: Subscriber):
+        """客户端断开：结束该订阅；没有其他订阅者时，SSE_CANCEL_ON_DISCONNECT 开启且会话未续传过则立即取消运行，否则等待续传宽限期"""
+        subscriber.close(disconnected=True)
+
+    @staticmethod
+    def get_stream(thread_id: str):
+        """线程保留期内的流式会话"""
+        return stream_sessions.get(thread_id)
+
+    @staticmethod
+    def can_resume(thread_id: str) -> bool:
+        """线程是否有保留期内的流"""
+        return stream_sessions.get(thread_id) is not None
+
+    async def resume(self, thread_id: str, last_event_id: int = None, subscriber: Subscriber = None):
+        """续传：补发 last_event_id 之后的事件并接上实时流，产出 (事件 id, 事件)"""
+        if subscriber is None:
+            session = stream_sessions.get(thread_id)
+            if session is None:
+                raise ValueError(f"线程 {thread_id} 没有可续传的流")
+            subscriber = session.attach(last_event_id)
+        async with aclosing(subscriber.events()) as events:
+            async for item in events:
+                yield item
 
     async def add_conversation(self, request: ConversationAddRequest):
         """新增对话"""
@@ -256,13 +295,49 @@ class AssistantService:
     async def _generate_conversation_name(self, question):
         """给对话起名字"""
         prompt = name_conversation_prompt.format(question=question)
-        raw = await llm.ainvoke(prompt)
+        try:
+            raw = await single_flight.ainvoke(llm, prompt, node="name_conversation")
+        except LLMOverloadedError as e:
+            # 起名是后台任务，限流时直接使用默认名称
+            logger.warning(f"对话起名被丢弃，使用默认名称: {e}")
+            return ''
         response = parse_llm_json(raw.content)
         logger.info(f"LLM响应: {response}")
         return response.get('res', '')
 
+    def _reuse_executed_steps(self, thread_id: str, values: dict, plan: list, dependencies: list):
+        """计划被修改时，复用当前问题下已完成的预执行步骤，把结果并入 past_steps
+
+        只认 speculative_executor 中与当前问题对应的结果；past_steps 累加了之前各轮的结果，不参与复用。
+        返回 (需要更新的状态, [(步骤, 复用的结果)])
+        """
+        question = values.get("question", "")
+        executed = speculative_executor.completed(thread_id, question)
+        matches = match_executed_steps(plan, executed)
+        if not matches:
+            return {}, []
+
+        remaining, remaining_deps, inherited = drop_steps(plan, dependencies, set(matches))
+        reused = [(plan[i], matches[i][1]) for i in sorted(matches)]
+        for i in matches:
+            speculative_executor.take(thread_id, question, matches[i][0])
+        logger.info(f"复用 {len(reused)} 个已执行步骤，剩余 {len(remaining)} 个步骤待执行")
+
+        return {
+            "plan": remaining,
+            "plan_dependencies": remaining_deps,
+            "plan_prior_results": [{plan[j]: matches[j][1] for j in deps} for deps in inherited],
+            "past_steps": reused
+        }, reused
+
     async def approve(self, request: ApproveRequest):
-        """用户审批规划"""
+        """用户审批规划，产出 (事件 id, 事件)"""
+        job = await self.submit_approve(request)
+        async for item in self.subscribe_run(job):
+            yield item
+
+    async def submit_approve(self, request: ApproveRequest) -> Job:
+        """更新审批状态并提交继续执行的运行；排队已满时抛出 JobQueueFullError"""
         await self._ensure_initialized()
 
         thread_id = request.thread_id
@@ -274,55 +349,50 @@ class AssistantService:
             "cancelled": request.cancelled
         }
 
-        # 覆盖计划（只有非空时才覆盖）
+        snapshot = await self._app.aget_state(config)
+        final_plan = snapshot.values.get("plan", [])
+
+        # 覆盖计划（只有非空时才覆盖），并把原步骤依赖映射到修改后的计划上
+        reused = []
         if request.plan:
+            final_plan = request.plan
             update_values["plan"] = request.plan
+            update_values["plan_dependencies"] = remap_dependencies(
+                snapshot.values.get("plan", []),
+                snapshot.values.get("plan_dependencies", []),
+                request.plan
+            )
+            # 已执行过的步骤直接复用结果，只有新增或改动的步骤交给 executor
+            if PLAN_REUSE_ENABLED and not request.cancelled:
+                reuse_values, reused = self._reuse_executed_steps(
+                    thread_id, snapshot.values, request.plan, update_values["plan_dependencies"]
+                )
+                update_values.update(reuse_values)
 
         await self._app.aupdate_state(config, update_values)
 
+        # 预执行：用户取消则全部丢弃，否则只保留未修改步骤的预执行结果
+        if request.cancelled:
+            speculative_executor.discard(thread_id)
+        else:
+            speculative_executor.reconcile(thread_id, final_plan)
+
         # 继续执行工作流
-        queue = asyncio.Queue()
-        set_stream_queue(queue)
+        pump = EventPump(name=str(thread_id))
+        for step, _ in reused:
+            pump.queue.put_nowait({"type": "status", "data": {"status": f"复用已有结果：{step}"}})
 
         async def run_workflow():
             try:
-                async for event in self._app.astream(None, config=config):
-                    pass
+                await self._stream_workflow(None, config, pump)
             except GraphInterrupt:
                 return
             except Exception as e:
                 logger.error(f"工作流执行出错: {e}")
-                await queue.put({"type": "error", "data": {"message": str(e)}})
+                pump.queue.put_nowait({"type": "error", "data": {"message": str(e)}})
+                raise
             finally:
-                await queue.put({"type": "workflow_end"})
-
-        workflow_task = asyncio.create_task(run_workflow())
-
-        try:
-            while True:
-                if workflow_task.done() and queue.empty():
-                    break
-
-                try:
-                    event = await asyncio.wait_for(queue.get(), timeout=0.5)
-                except asyncio.TimeoutError:
-                    yield {"type": "heartbeat", "data": {}}
-                    continue
-
-                if event.get("type") == "token":
-                    yield {"type": "token", "node": event.get("node"), "data": event.get("data", {})}
-                elif event.get("type") == "workflow_end":
-                    yield {"type": "workflow_end", "data": {}}
-                elif event.get("type") == "error":
-                    yield {"type": "error", "data": event.get("data", {})}
-                elif event.get("type") == "status":
-                    yield {"type": "status", "data": event.get("data", {})}
-                elif event.get("type") == "waiting_for_approval":
-                    yield {"type": "waiting_for_approval", "data": event.get("data", {})}
-
-        except asyncio.CancelledError:
-            workflow_task.cancel()
-        finally:
-            if not workflow_task.done():
-                workflow_task.cancel()
+                pump.queue.put_nowait(WORKFLOW_END)
+                pump.close()
 
+        return job_runner.submit("approve", thread_id, pump, run_workflow)
@@ -0,0 +1,252 @@
+"""
+SSE 事件泵
+
+工作流的事件（LangGraph astream 的 messages / custom / updates 流，见 AssistantService）写入事件泵的队列，EventPump 直接 await 队列并原样转发事件对象：
+- 不再按 0.5 秒超时轮询，空闲连接不产生任何唤醒
+- 心跳由进程内共享的 HeartbeatTimer 统一发送，只发给超过心跳间隔没有事件的流
+- 工作流结束时放入哨兵 END，泵随即结束，不再轮询 workflow_done
+- 同一节点连续的 token 事件合并为一帧：每 SSE_COALESCE_MS 毫秒或累计 SSE_COALESCE_CHARS 个字符输出一次，
+  遇到其它事件（状态、结束等）立即输出；合并后的帧格式不变（{"type": "token", "node", "data": {"content"}}）
+- 队列（StreamQueue）在客户端读取过慢时按 SSE_QUEUE_POLICY 处理积压（drop_heartbeat 不限制 token），并记录每个流的队列高水位
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Optional, Set
+
+from utils.metrics_util import metrics
+
+# 空闲流的心跳间隔（秒）
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# token 合并窗口（毫秒）与单帧字符上限；窗口为 0 时只合并已在队列中的 token，不额外等待
+SSE_COALESCE_ENABLED = os.getenv("SSE_COALESCE_ENABLED", "true").lower() == "true"
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "40"))
+SSE_COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "256"))
+
+# 每个流的队列上限（0 表示不限制）和队列满时的策略：
+# - coalesce：新 token 合并进队尾同一节点的 token 事件
+# - pause：生产方（LLM token 回调、节点状态推送）等待队列腾出空间，工作流随之暂停
+# - drop_heartbeat：只丢弃心跳，其它事件（包括 token）照常入队，队列实际不设上限
+# 无论哪种策略，队列中已有事件时都不再放入心跳
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+SSE_QUEUE_POLICY = os.getenv("SSE_QUEUE_POLICY", "coalesce").lower()
+QUEUE_POLICIES = ("coalesce", "pause", "drop_heartbeat")
+
+# 转发给前端的事件类型，其余内部事件（如 approve_plan）丢弃
+FORWARDED_EVENTS = frozenset({
+    "token", "status", "plan_step", "waiting_for_approval", "workflow_end", "error", "heartbeat"
+})
+
+# 队列高水位直方图分桶（事件数）
+HIGH_WATER_BUCKETS = (1, 4, 16, 64, 128, 256, 512, 1024)
+
+HEARTBEAT = {"type": "heartbeat", "data": {}}
+WORKFLOW_END = {"type": "workflow_end", "data": {}}
+
+# 结束哨兵
+END = object()
+
+
+class StreamQueue(asyncio.Queue):
+    """流式事件队列
+
+    coalesce / pause 策略下有界：结束哨兵和状态等控制事件总是入队（数量有限），token 受上限约束。
+    drop_heartbeat 策略只在队列非空时丢弃心跳，token 不受上限约束，适用于消费方总能及时读取的场景。
+    """
+
+    def __init__(self, limit: int = SSE_QUEUE_SIZE, policy: str = SSE_QUEUE_POLICY):
+        super().__init__()
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"未知的队列策略：{policy}")
+        self.limit = limit
+        self.policy = policy
+        self.high_water = 0
+        self.merged = 0
+        self.dropped = 0
+        self.paused = 0
+        self._drained = asyncio.Event()
+
+    def over_limit(self) -> bool:
+        return 0 < self.limit <= self.qsize()
+
+    def _merge(self, item) -> bool:
+        """把 token 合并进队尾同一节点的 token 事件"""
+        if not self._queue or item is END or item.get("type") != "token":
+            return False
+        tail = self._queue[-1]
+        if tail is END or tail.get("type") != "token" or tail.get("node") != item.get("node"):
+            return False
+        self._queue[-1] = {**tail, "data": {"content": tail["data"]["content"] + item["data"]["content"]}}
+        self.merged += 1
+        return True
+
+    def put_nowait(self, item):
+        if item is not END and item.get("type") == "heartbeat" and not self.empty():
+            # 队列中已有待发送事件，心跳没有意义
+            self.dropped += 1
+            return
+        if self.over_limit() and self.policy == "coalesce" and self._merge(item):
+            return
+        super().put_nowait(item)
+        if self.qsize() > self.high_water:
+            self.high_water = self.qsize()
+
+    async def put(self, item):
+        """pause 策略下，队列满时等待消费方读取"""
+        if self.policy == "pause" and item is not END and self.over_limit():
+            self.paused += 1
+            metrics.inc("sse_queue_paused")
+            while self.over_limit():
+                self._drained.clear()
+                await self._drained.wait()
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        item = super().get_nowait()
+        if not self.over_limit():
+            self._drained.set()
+        return item
+
+    def note_backlog(self, depth: int):
+        """记录下游（如 StreamSession 的订阅者）的积压，计入本流的高水位"""
+        if depth > self.high_water:
+            self.high_water = depth
+
+
+class HeartbeatTimer:
+    """所有流共享一个定时任务；没有打开的流时定时任务退出"""
+
+    def __init__(self, interval: float = SSE_HEARTBEAT_INTERVAL):
+        self.interval = interval
+        self._pumps: Set["EventPump"] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.heartbeats = 0
+
+    def register(self, pump: "EventPump"):
+        self._pumps.add(pump)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    def unregister(self, pump: "EventPump"):
+        self._pumps.discard(pump)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        # 每半个间隔检查一次，空闲流的心跳间隔在 interval ~ 1.5 * interval 之间
+        while self._pumps:
+            await asyncio.sleep(self.interval / 2)
+            now = loop.time()
+            for pump in list(self._pumps):
+                if now - pump.last_event >= self.interval:
+                    pump.queue.put_nowait(HEARTBEAT)
+                    pump.last_event = now
+                    self.heartbeats += 1
+
+    def stats(self) -> dict:
+        # 队列高水位最高的流，用于定位读取过慢的客户端
+        slowest = sorted(self._pumps, key=lambda p: p.queue.high_water, reverse=True)[:10]
+        return {
+            "open_streams": len(self._pumps),
+            "heartbeat_interval": self.interval,
+            "heartbeats": self.heartbeats,
+            "queue_limit": SSE_QUEUE_SIZE,
+            "queue_policy": SSE_QUEUE_POLICY,
+            "slowest_streams": [
+                {
+                    "name": p.name,
+                    "depth": p.queue.qsize(),
+                    "high_water": p.queue.high_water,
+                    "merged": p.queue.merged,
+                    "dropped": p.queue.dropped,
+                    "paused": p.queue.paused,
+                }
+                for p in slowest
+            ],
+        }
+
+
+# 全局心跳定时器
+heartbeat_timer = HeartbeatTimer()
+metrics.register_collector("sse", heartbeat_timer.stats)
+
+
+class EventPump:
+    """单个 SSE 流的事件泵"""
+
+    def __init__(self, name: str = "", timer: HeartbeatTimer = heartbeat_timer, coalesce: bool = SSE_COALESCE_ENABLED,
+                 coalesce_ms: float = SSE_COALESCE_MS, coalesce_chars: int = SSE_COALESCE_CHARS,
+                 queue: StreamQueue = None):
+        self.name = name
+        self.queue = queue if queue is not None else StreamQueue()
+        self.timer = timer
+        self.coalesce = coalesce
+        self.coalesce_window = coalesce_ms / 1000
+        self.coalesce_chars = coalesce_chars
+        self.last_event = asyncio.get_running_loop().time()
+        # 合并 token 时读到的下一个非 token 事件
+        self._pending = None
+
+    def close(self):
+        """放入结束哨兵，已入队的事件转发完后结束"""
+        self.queue.put_nowait(END)
+
+    async def _next(self):
+        if self._pending is not None:
+            event, self._pending = self._pending, None
+            return event
+        return await self.queue.get()
+
+    async def _coalesce(self, first: dict) -> dict:
+        """从 first 开始合并同一节点的连续 token，直到窗口结束、字符数达到上限或遇到其它事件"""
+        node = first.get("node")
+        parts = [first["data"]["content"]]
+        size = len(parts[0])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.coalesce_window
+        while size < self.coalesce_chars:
+            try:
+                event = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if event is not END and event.get("type") == "token" and event.get("node") == node:
+                parts.append(event["data"]["content"])
+                size += len(parts[-1])
+            else:
+                self._pending = event
+                break
+
+        metrics.inc("sse_tokens", len(parts))
+        metrics.inc("sse_token_frames")
+        if len(parts) == 1:
+            return first
+        return {"type": "token", "node": node, "data": {"content": "".join(parts)}}
+
+    async def events(self) -> AsyncIterator[dict]:
+        """按入队顺序转发事件，直到收到哨兵"""
+        loop = asyncio.get_running_loop()
+        self.timer.register(self)
+        try:
+            while True:
+                event = await self._next()
+                if event is END:
+                    return
+                self.last_event = loop.time()
+                kind = event.get("type")
+                if kind == "token" and self.coalesce:
+                    yield await self._coalesce(event)
+                elif kind in FORWARDED_EVENTS:
+                    yield event
+        finally:
+            self.timer.unregister(self)
+            metrics.observe("sse_queue_high_water", self.queue.high_water, buckets=HIGH_WATER_BUCKETS)
+            if self.queue.merged or self.queue.dropped:
+                metrics.inc("sse_queue_merged", self.queue.merged)
+                metrics.inc("sse_queue_dropped", self.queue.dropped)
@@ -0,0 +1,207 @@
+"""
+工作流后台任务
+
+/chat 和 /approve 不再在 SSE 生成器里直接运行工作流，而是提交一个运行（Job）：
+- 运行进入有界队列，由固定数量的 worker 依次执行，显式限制同时运行的工作流数量；队列满时拒绝提交
+- 每个运行对应一个 StreamSession，客户端按运行 id 订阅、断开、续传，运行本身与 HTTP 连接无关
+- 运行提交时复制当前 contextvars（LLM 优先级等请求级设置），worker 在该上下文中执行
+- 可以查询运行状态、取消排队中或执行中的运行
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from service.event_pump import EventPump
+from service.stream_session import StreamSession, stream_sessions
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+
+# 同时执行的工作流数量
+WORKFLOW_WORKERS = int(os.getenv("WORKFLOW_WORKERS", "16"))
+# 排队中的运行上限
+WORKFLOW_QUEUE_SIZE = int(os.getenv("WORKFLOW_QUEUE_SIZE", "200"))
+# 保留的已结束运行数量（用于查询状态）
+WORKFLOW_JOB_HISTORY = int(os.getenv("WORKFLOW_JOB_HISTORY", "1000"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFullError(Exception):
+    """排队中的运行已达上限"""
+
+
+class Job:
+    """一次工作流运行"""
+
+    def __init__(self, kind: str, thread_id: str, session: StreamSession,
+                 run: Callable[[], Awaitable[None]]):
+        self.run_id = uuid.uuid4().hex
+        self.kind = kind
+        self.thread_id = str(thread_id)
+        self.session = session
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._run = run
+        self._context = contextvars.copy_context()
+        self._task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "kind": self.kind,
+            "thread_id": self.thread_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "last_event_id": self.session.last_id,
+            "subscribers": self.session.subscribers,
+        }
+
+
+class JobRunner:
+    """有界 worker 池"""
+
+    def __init__(self, workers: int = WORKFLOW_WORKERS, max_queue: int = WORKFLOW_QUEUE_SIZE,
+                 history: int = WORKFLOW_JOB_HISTORY):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.history = history
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._running = 0
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._workers and self._workers[0].get_loop() is loop and not self._workers[0].done():
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+
+    def submit(self, kind: str, thread_id: str, pump: EventPump, run: Callable[[], Awaitable[None]]) -> Job:
+        """提交运行；run 在提交时的 contextvars 上下文中执行，结束时需关闭 pump"""
+        self._ensure_workers()
+        if self._queue.full():
+            metrics.inc("workflow_jobs_rejected")
+            raise JobQueueFullError(f"工作流排队已满（{self.max_queue}），请稍后重试")
+
+        session = stream_sessions.create(thread_id, pump)
+        job = Job(kind, thread_id, session, run)
+        session.start(lambda reason: self.cancel(job.run_id, reason), on_finish=stream_sessions.remove)
+        self._remember(job)
+        self._queue.put_nowait(job)
+        metrics.inc("workflow_jobs_submitted", kind=kind)
+        self._update_gauges()
+        return job
+
+    def _remember(self, job: Job):
+        self._jobs[job.run_id] = job
+        # 只淘汰已结束的运行
+        while len(self._jobs) > self.history:
+            oldest = next((k for k, j in self._jobs.items() if j.status in FINISHED), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest]
+
+    def get(self, run_id: str) -> Optional[Job]:
+        return self._jobs.get(run_id)
+
+    def cancel(self, run_id: str, reason: str = "api") -> Optional[Job]:
+        """取消运行；排队中的运行直接结束，执行中的运行取消其任务（取消会传递到在途的 LLM 和 MCP 工具调用）
+
+        reason：api（取消接口）、disconnect（客户端断开）、expired（宽限期内没有续传）
+        """
+        job = self._jobs.get(run_id)
+        if job is None or job.status in FINISHED:
+            return job
+        logger.info(f"取消运行 {run_id}（{job.status}，原因 {reason}）")
+        metrics.inc("workflow_jobs_cancelled", reason=reason)
+        job.session.pump.queue.put_nowait({"type": "error", "data": {"message": "运行已取消"}})
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED)
+            job.session.pump.close()
+        elif job._task is not None:
+            job._task.cancel()
+        return job
+
+    def _finish(self, job: Job, status: str, error: str = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        metrics.inc("workflow_jobs_finished", status=status)
+        if job.started_at is not None:
+            metrics.observe("workflow_job_seconds", job.finished_at - job.started_at, kind=job.kind)
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != QUEUED:
+                    # 排队期间已取消
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                metrics.observe("workflow_job_queue_seconds", job.started_at - job.created_at)
+                self._running += 1
+                self._update_gauges()
+                job._task = asyncio.create_task(job._run(), context=job._context)
+                try:
+                    await job._task
+                    self._finish(job, SUCCEEDED)
+                except asyncio.CancelledError:
+                    self._finish(job, CANCELLED)
+                    if asyncio.current_task().cancelling():
+                        # worker 自身被取消（应用关闭），取消会传递给运行任务
+                        job._task.cancel()
+                        raise
+                except Exception as e:
+                    logger.error(f"运行 {job.run_id} 失败: {e}")
+                    self._finish(job, FAILED, str(e))
+                finally:
+                    self._running -= 1
+            finally:
+                self._queue.task_done()
+                self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge("workflow_jobs_queued", self._queue.qsize() if self._queue else 0)
+        metrics.set_gauge("workflow_jobs_running", self._running)
+
+    async def close(self):
+        """应用关闭时取消所有 worker 和执行中的运行"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": self._running,
+            "jobs": statuses,
+        }
+
+
+# 全局 worker 池
+job_runner = JobRunner()
+metrics.register_collector("workflow_jobs", job_runner.stats)
@@ -0,0 +1,86 @@
+"""
+SSE 帧编码
+
+每个事件原先经过 json.dumps → f-string → StreamingResponse 隐式 UTF-8 编码，心跳每次都重新序列化。
+SSEEncoder 直接输出 bytes：
+- 心跳帧、workflow_end 的 data 部分只编码一次
+- 安装了 orjson 时使用 orjson（SSE_JSON_BACKEND=auto），否则使用标准库 json；两者都输出紧凑的 UTF-8 JSON
+- 带 id 的帧可用于 Last-Event-ID 续传，心跳不带 id
+
+基准：python -m bench.sse_encode
+"""
+
+import json
+import os
+from typing import Callable, Optional
+
+from service.event_pump import HEARTBEAT, WORKFLOW_END
+from utils.logger_util import logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON 后端：auto（有 orjson 用 orjson）、orjson、json
+SSE_JSON_BACKEND = os.getenv("SSE_JSON_BACKEND", "auto").lower()
+
+
+# 复用同一个编码器（json.dumps 带非默认参数时每次都会新建 JSONEncoder）
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _json_dumps(obj) -> bytes:
+    return _json_encoder.encode(obj).encode("utf-8")
+
+
+def _orjson_dumps(obj) -> bytes:
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # orjson 不支持的类型（例如非字符串的键）交给标准库处理
+        return _json_dumps(obj)
+
+
+class SSEEncoder:
+    """事件 -> SSE 帧（bytes）"""
+
+    def __init__(self, backend: str = SSE_JSON_BACKEND):
+        if backend == "auto":
+            backend = "orjson" if orjson is not None else "json"
+        if backend == "orjson" and orjson is None:
+            logger.warning("SSE_JSON_BACKEND=orjson 但未安装 orjson，使用标准库 json")
+            backend = "json"
+        if backend not in ("orjson", "json"):
+            raise ValueError(f"未知的 SSE_JSON_BACKEND：{backend}")
+        self.backend = backend
+        self.dumps: Callable[[object], bytes] = _orjson_dumps if backend == "orjson" else _json_dumps
+        # 常量帧只编码一次
+        self._heartbeat = b"data: " + self.dumps(HEARTBEAT) + b"\n\n"
+        self._workflow_end = self.dumps(WORKFLOW_END)
+
+    def payload(self, event: dict) -> bytes:
+        """事件的 JSON（常量事件使用预编码结果）"""
+        return self._workflow_end if event is WORKFLOW_END else self.dumps(event)
+
+    def encode(self, event_id: Optional[int], event: dict) -> bytes:
+        """编码一帧；event_id 为 None 时不写 id 行"""
+        if event is HEARTBEAT:
+            return self._heartbeat
+        data = self.payload(event)
+        if event_id is None:
+            return b"data: " + data + b"\n\n"
+        return b"id: %d\ndata: %s\n\n" % (event_id, data)
+
+    def encode_ws(self, run_id: str, event_id: Optional[int], event: dict) -> str:
+        """WebSocket 文本帧：{"run": 运行 id, "id": 事件 id, "event": 事件}，事件结构与 SSE 相同"""
+        head = b'{"run":"%s","id":%s,"event":' % (run_id.encode("ascii"), b"null" if event_id is None else b"%d" % event_id)
+        return (head + self.payload(event) + b"}").decode("utf-8")
+
+    def error(self, message: str) -> bytes:
+        """不编号的错误帧"""
+        return self.encode(None, {"type": "error", "data": {"message": message}})
+
+
+# 全局编码器
+sse_encoder = SSEEncoder()
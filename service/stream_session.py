@@ -0,0 +1,321 @@
+"""
+可续传、可多端订阅的流式会话
+
+每个线程的一次运行（chat 或 approve）对应一个 StreamSession，工作流只运行一次，事件广播给任意数量的订阅者
+（同一用户的多个标签页、运维看板等）：
+- 事件按线程编号（单调递增，保留期内同一线程的多次运行连续编号），最近 SSE_REPLAY_BUFFER 条保存在环形缓冲区
+- 读取任务把事件泵写入缓冲区；每个订阅者只持有自己的读取位置（事件对象共享，不复制）
+- 订阅者落后超过 SSE_SUBSCRIBER_BUFFER 条时，按事件泵队列的策略（SSE_QUEUE_POLICY）处理：
+  - coalesce：该订阅者读取时把同一节点的连续 token 合并为一帧；合并后仍超过上限则发送 lagged 错误并断开
+  - drop_heartbeat：直接发送 lagged 错误并断开（可用 Last-Event-ID 续传）
+  以上两种策略下慢订阅者不会阻塞工作流和其他订阅者
+  - pause：读取任务停止读取事件泵，积压留在事件泵的有界队列中，生产方随之暂停，直到最慢的订阅者跟上
+- 订阅者的积压计入事件泵队列的高水位（/metrics 的 slowest_streams）
+- 最后一个订阅者离开时：客户端断开且开启 SSE_CANCEL_ON_DISCONNECT 则立即取消运行；
+  但只要有订阅者带 Last-Event-ID 续传过（客户端支持续传），或离开的不是断开（正常结束订阅），
+  工作流继续运行，SSE_RESUME_GRACE 秒内没有订阅者才取消
+- 续传时先补发 Last-Event-ID 之后的事件，再接上实时流
+
+心跳不编号、不进入缓冲区。
+"""
+
+import asyncio
+import os
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from service.event_pump import EventPump, HEARTBEAT
+from utils.logger_util import logger
+from utils.metrics_util import metrics
+
+# 每个线程保留的事件数
+SSE_REPLAY_BUFFER = int(os.getenv("SSE_REPLAY_BUFFER", "512"))
+# 每个订阅者最多落后的事件数
+SSE_SUBSCRIBER_BUFFER = int(os.getenv("SSE_SUBSCRIBER_BUFFER", "256"))
+# 没有订阅者后工作流继续运行的秒数；运行结束后缓冲区同样保留这么久
+SSE_RESUME_GRACE = float(os.getenv("SSE_RESUME_GRACE", "60"))
+# 客户端断开时立即取消运行（停止消耗没人读取的 token 和工具额度）。
+# 与续传的取舍：会话中有订阅者带 Last-Event-ID 续传过之后，断开改为等待 SSE_RESUME_GRACE；
+# 从未续传过的客户端在首个连接上短暂断网时，运行会被取消，无法续传
+SSE_CANCEL_ON_DISCONNECT = os.getenv("SSE_CANCEL_ON_DISCONNECT", "true").lower() == "true"
+
+# 订阅者落后过多被断开时收到的最后一个事件
+LAGGED = {"type": "error", "data": {"message": "读取过慢，订阅已断开，请使用 Last-Event-ID 续传", "code": "lagged"}}
+
+
+class Subscriber:
+    """一个订阅者的读取位置"""
+
+    def __init__(self, session: "StreamSession", cursor: int, limit: int):
+        self.session = session
+        self.cursor = cursor
+        self.limit = limit
+        self.coalesce = session.policy == "coalesce"
+        self.closed = False
+        self.lagged = False
+        self.heartbeat = False
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def close(self, disconnected: bool = False):
+        """结束订阅；disconnected 表示客户端已断开（最后一个订阅者断开时按 SSE_CANCEL_ON_DISCONNECT 处理运行）"""
+        if self.closed:
+            return
+        self.closed = True
+        self.wake()
+        self.session._detach(self, disconnected)
+
+    async def events(self) -> AsyncIterator[Tuple[Optional[int], dict]]:
+        """产出 (事件 id, 事件)，先补发缓冲的事件，再跟随实时事件；心跳的 id 为 None"""
+        session = self.session
+        try:
+            while True:
+                if self.lagged:
+                    yield None, LAGGED
+                    return
+                if self.closed:
+                    return
+                batch = session._events_after(self.cursor)
+                if self.coalesce and len(batch) > self.limit:
+                    batch = session._coalesce(batch)
+                heartbeat, self.heartbeat = self.heartbeat, False
+                if not batch:
+                    if session.done:
+                        return
+                    if heartbeat:
+                        yield None, HEARTBEAT
+                        continue
+                    self._wake.clear()
+                    await self._wake.wait()
+                    continue
+                for event_id, event in batch:
+                    yield event_id, event
+                    self.cursor = event_id
+                    session._progress.set()
+                    if self.closed:
+                        break
+        finally:
+            self.close()
+
+
+class StreamSession:
+    """一次运行的事件缓冲与广播"""
+
+    def __init__(self, thread_id: str, pump: EventPump, first_id: int = 1,
+                 buffer_size: int = SSE_REPLAY_BUFFER, grace: float = SSE_RESUME_GRACE,
+                 subscriber_buffer: int = SSE_SUBSCRIBER_BUFFER,
+                 cancel_on_disconnect: bool = SSE_CANCEL_ON_DISCONNECT):
+        self.thread_id = thread_id
+        self.pump = pump
+        self.policy = pump.queue.policy
+        self.grace = grace
+        self.cancel_on_disconnect = cancel_on_disconnect
+        # 有订阅者带 Last-Event-ID 续传过：客户端会重连，断开时等待宽限期而不是立即取消
+        self.resumable = False
+        self.subscriber_buffer = subscriber_buffer
+        self.buffer: Deque[Tuple[int, dict]] = deque(maxlen=buffer_size)
+        self.first_id = first_id
+        self.next_id = first_id
+        self.done = False
+        self._subscribers: List[Subscriber] = []
+        self._on_cancel: Optional[Callable[[str], None]] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._expire_handle: Optional[asyncio.TimerHandle] = None
+        self._expired = False
+        self._on_finish = None
+        # 订阅者读取推进或离开时置位（pause 策略下唤醒读取任务）
+        self._progress = asyncio.Event()
+
+    @property
+    def last_id(self) -> int:
+        return self.next_id - 1
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def start(self, on_cancel: Callable[[str], None], on_finish: Callable[["StreamSession"], None] = None):
+        """开始读取事件泵
+
+        on_cancel(reason)：取消运行（排队中或执行中），reason 为 expired（宽限期内没有续传）或 disconnect
+        on_finish(session)：会话过期后调用（用于从注册表移除）
+        """
+        self._on_cancel = on_cancel
+        self._on_finish = on_finish
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        """读取事件泵写入缓冲区并唤醒订阅者；只有 pause 策略会等待订阅者"""
+        try:
+            async for event in self.pump.events():
+                if event is HEARTBEAT:
+                    for subscriber in self._subscribers:
+                        subscriber.heartbeat = True
+                        subscriber.wake()
+                    continue
+                self.buffer.append((self.next_id, event))
+                self.next_id += 1
+                backlog = 0
+                for subscriber in list(self._subscribers):
+                    lag = self.last_id - subscriber.cursor
+                    backlog = max(backlog, lag)
+                    if lag > subscriber.limit and self._lagged(subscriber):
+                        logger.warning(f"线程 {self.thread_id} 的订阅者落后 {lag} 条，断开")
+                        metrics.inc("sse_subscribers_lagged")
+                        subscriber.lagged = True
+                        subscriber.close()
+                    else:
+                        subscriber.wake()
+                self.pump.queue.note_backlog(backlog)
+                if self.policy == "pause":
+                    await self._wait_for_subscribers()
+        finally:
+            self.done = True
+            for subscriber in self._subscribers:
+                subscriber.wake()
+            if not self._subscribers:
+                self._schedule_expire()
+
+    def _lagged(self, subscriber: Subscriber) -> bool:
+        """订阅者超过上限后是否断开：pause 等待订阅者，coalesce 按合并后的帧数判断"""
+        if self.policy == "pause":
+            return False
+        if self.policy == "coalesce":
+            return len(self._token_runs(self._events_after(subscriber.cursor))) > subscriber.limit
+        return True
+
+    async def _wait_for_subscribers(self):
+        """pause 策略：有订阅者落后达到上限时暂停读取事件泵，积压留在事件泵队列中，生产方随之暂停"""
+        while any(self.last_id - s.cursor >= s.limit for s in self._subscribers):
+            self._progress.clear()
+            await self._progress.wait()
+
+    @staticmethod
+    def _token_runs(batch: List[Tuple[int, dict]]) -> List[List[Tuple[int, dict]]]:
+        """按“同一节点的连续 token”分组，其余事件各自成组"""
+        runs: List[List[Tuple[int, dict]]] = []
+        for item in batch:
+            event = item[1]
+            if runs and event.get("type") == "token":
+                tail = runs[-1][-1][1]
+                if tail.get("type") == "token" and tail.get("node") == event.get("node"):
+                    runs[-1].append(item)
+                    continue
+            runs.append([item])
+        return runs
+
+    def _coalesce(self, batch: List[Tuple[int, dict]]) -> List[Tuple[int, dict]]:
+        """把同一节点的连续 token 合并为一帧，帧 id 取最后一个被合并的事件（续传从其后开始）"""
+        merged: List[Tuple[int, dict]] = []
+        for run in self._token_runs(batch):
+            if len(run) == 1:
+                merged.append(run[0])
+                continue
+            first = run[0][1]
+            content = "".join(event["data"]["content"] for _, event in run)
+            merged.append((run[-1][0], {**first, "data": {"content": content}}))
+        self.pump.queue.merged += len(batch) - len(merged)
+        return merged
+
+    def _events_after(self, cursor: int) -> List[Tuple[int, dict]]:
+        """缓冲区中 id 大于 cursor 的事件（id 连续，按下标截取）"""
+        if not self.buffer or self.last_id <= cursor:
+            return []
+        start = max(0, cursor + 1 - self.buffer[0][0])
+        return list(islice(self.buffer, start, None))
+
+    def cancel(self, reason: str) -> bool:
+        """取消仍在运行的工作流，返回是否发出了取消"""
+        if self.done or self._on_cancel is None:
+            return False
+        self._on_cancel(reason)
+        return True
+
+    def _schedule_expire(self):
+        if self._expired:
+            return
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+        self._expire_handle = asyncio.get_running_loop().call_later(self.grace, self._expire)
+
+    def _expire(self):
+        """宽限期内没有订阅者"""
+        self._expire_handle = None
+        self._expired = True
+        if self.cancel("expired"):
+            logger.info(f"线程 {self.thread_id} 的客户端 {self.grace}s 内未续传，取消工作流")
+            metrics.inc("sse_sessions_expired")
+        if self._on_finish is not None:
+            self._on_finish(self)
+
+    def attach(self, last_event_id: int = None) -> Subscriber:
+        """新增订阅者，从 last_event_id 之后开始读取（首次订阅从本次运行的第一个事件开始）"""
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+            self._expire_handle = None
+
+        if last_event_id is not None:
+            self.resumable = True
+        cursor = self.first_id - 1 if last_event_id is None else last_event_id
+        if self.buffer and cursor < self.buffer[0][0] - 1:
+            logger.warning(f"线程 {self.thread_id} 续传位置 {cursor} 已被缓冲区淘汰，从 {self.buffer[0][0]} 开始补发")
+            metrics.inc("sse_resume_gaps")
+        subscriber = Subscriber(self, cursor, self.subscriber_buffer)
+        self._subscribers.append(subscriber)
+        metrics.inc("sse_subscribers")
+        return subscriber
+
+    def _detach(self, subscriber: Subscriber, disconnected: bool):
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.remove(subscriber)
+        self._progress.set()
+        if self._subscribers:
+            return
+        # 最后一个订阅者离开
+        if disconnected and self.cancel_on_disconnect and not self.resumable and self.cancel("disconnect"):
+            return
+        self._schedule_expire()
+
+    async def subscribe(self, last_event_id: int = None) -> AsyncIterator[Tuple[Optional[int], dict]]:
+        """订阅并产出 (事件 id, 事件)，见 Subscriber.events"""
+        async for item in self.attach(last_event_id).events():
+            yield item
+
+
+class StreamSessionRegistry:
+    """线程 id -> 最近一次运行的会话"""
+
+    def __init__(self):
+        self._sessions: Dict[str, StreamSession] = {}
+
+    def create(self, thread_id: str, pump: EventPump) -> StreamSession:
+        """新建会话；上一次运行的会话仍在保留期内时接着它的编号"""
+        thread_id = str(thread_id)
+        previous = self._sessions.get(thread_id)
+        first_id = previous.last_id + 1 if previous else 1
+        session = StreamSession(thread_id, pump, first_id=first_id)
+        self._sessions[thread_id] = session
+        return session
+
+    def get(self, thread_id: str) -> Optional[StreamSession]:
+        return self._sessions.get(str(thread_id))
+
+    def remove(self, session: StreamSession):
+        if self._sessions.get(session.thread_id) is session:
+            del self._sessions[session.thread_id]
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "subscribers": sum(s.subscribers for s in self._sessions.values()),
+            "running": sum(1 for s in self._sessions.values() if not s.done),
+        }
+
+
+# 全局会话注册表
+stream_sessions = StreamSessionRegistry()
+metrics.register_collector("sse_sessions", stream_sessions.stats)
@@ -0,0 +1,74 @@
+"""
+ReAct Agent 缓存测试
+"""
+
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from graph.agent_cache import AgentCache
+
+
+class FakeLLM:
+    @property
+    def _identifying_params(self):
+        return {"model_name": "fake"}
+
+
+class FakeTool:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeMiddleware:
+    def __init__(self, name):
+        self.name = name
+
+
+class TestAgentCache(unittest.TestCase):
+    """测试 agent 缓存命中、失效"""
+
+    def setUp(self):
+        self.cache = AgentCache()
+        self.llm = FakeLLM()
+        self.tools = [FakeTool("bing_search"), FakeTool("maps_weather")]
+        patcher = patch("graph.agent_cache.create_agent", side_effect=lambda *args, **kwargs: object())
+        self.create_agent = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, tools=None, prompt="prompt", middleware=()):
+        return asyncio.run(self.cache.get_agent(self.llm, tools or self.tools, prompt, middleware))
+
+    def test_same_config_hits(self):
+        first = self.get()
+        second = self.get()
+        self.assertIs(first, second)
+        self.assertEqual(self.create_agent.call_count, 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_prompt_or_middleware_change_misses(self):
+        base = self.get()
+        other_prompt = self.get(prompt="other")
+        other_middleware = self.get(middleware=[FakeMiddleware("summary")])
+        self.assertIsNot(base, other_prompt)
+        self.assertIsNot(base, other_middleware)
+        self.assertEqual(self.create_agent.call_count, 3)
+        self.assertEqual(self.cache.stats()["size"], 3)
+
+    def test_reloaded_tools_invalidate(self):
+        old = self.get()
+        reloaded = [FakeTool("bing_search"), FakeTool("maps_weather")]
+        new = self.get(tools=reloaded)
+        self.assertIsNot(old, new)
+        # 绑定旧工具对象的 agent 被淘汰
+        self.assertEqual(self.cache.stats()["size"], 1)
+        self.assertIs(self.get(tools=reloaded), new)
+
+    def test_clear(self):
+        first = self.get()
+        self.cache.clear()
+        self.assertIsNot(self.get(), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+cassette 录制与回放测试
+"""
+
+import os
+import tempfile
+import unittest
+
+import httpx
+from langchain_core.messages import ToolMessage
+from langchain_openai import ChatOpenAI
+
+from bench.mock_llm_server import MockConfig, create_app
+from graph.cassette import (
+    Cassette, CassetteMissError, CassetteTransport, RECORD, cassette_call, get_cassette, use_cassette
+)
+from graph.middleware import cassette_tool_call
+
+
+class _OfflineTransport(httpx.AsyncBaseTransport):
+    """回放时不允许访问上游"""
+
+    async def handle_async_request(self, request):
+        raise AssertionError(f"回放时访问了上游：{request.url}")
+
+
+def _llm(transport: httpx.AsyncBaseTransport, streaming: bool) -> ChatOpenAI:
+    client = httpx.AsyncClient(transport=CassetteTransport(transport))
+    return ChatOpenAI(model="deepseek-chat", api_key="mock", base_url="http://mock/v1",
+                      streaming=streaming, max_retries=0, http_async_client=client)
+
+
+class TestCassette(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "run.json.gz")
+
+    def tearDown(self):
+        use_cassette(None)
+
+    async def _record(self, prompts, streaming: bool):
+        use_cassette(Cassette(self.path, RECORD))
+        llm = _llm(httpx.ASGITransport(app=create_app(MockConfig(ttft=0, tokens_per_second=0))), streaming)
+        results = [[c.content async for c in llm.astream(p)] for p in prompts]
+        get_cassette().save()
+        return results
+
+    async def test_streaming_replay_offline(self):
+        prompts = ["你好", "介绍一下杭州", "你好"]
+        recorded = await self._record(prompts, streaming=True)
+
+        cassette = Cassette.load(self.path)
+        use_cassette(cassette)
+        llm = _llm(_OfflineTransport(), streaming=True)
+        replayed = [[c.content async for c in llm.astream(p)] for p in prompts]
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(cassette.stats()["used"], 3)
+        self.assertEqual(cassette.stats()["loose_matches"], 0)
+
+        # 重新回放
+        cassette.rewind()
+        self.assertEqual([c.content async for c in llm.astream("你好")], recorded[0])
+
+    async def test_non_streaming_replay(self):
+        await self._record(["你好"], streaming=False)
+        use_cassette(Cassette.load(self.path))
+        raw = await _llm(_OfflineTransport(), streaming=False).ainvoke("你好")
+        self.assertIn("你好", raw.content)
+
+    async def test_loose_and_strict_match(self):
+        await self._record(["你好"], streaming=True)
+        cassette = Cassette.load(self.path)
+        use_cassette(cassette)
+        llm = _llm(_OfflineTransport(), streaming=True)
+        chunks = [c.content async for c in llm.astream("现在几点")]
+        self.assertTrue(chunks)
+        self.assertEqual(cassette.loose_matches, 1)
+
+        use_cassette(Cassette.load(self.path, strict=True))
+        with self.assertRaises(CassetteMissError):
+            [c async for c in llm.astream("现在几点")]
+
+    async def test_cassette_call(self):
+        calls = []
+
+        async def search():
+            calls.append(1)
+            return ["记忆一", "记忆二"]
+
+        cassette = Cassette(self.path, RECORD)
+        use_cassette(cassette)
+        self.assertEqual(await cassette_call("memory_search", {"q": "杭州"}, search), ["记忆一", "记忆二"])
+        cassette.save()
+
+        use_cassette(Cassette.load(self.path))
+        self.assertEqual(await cassette_call("memory_search", {"q": "杭州"}, search), ["记忆一", "记忆二"])
+        self.assertEqual(len(calls), 1)
+
+    async def test_tool_call_replay(self):
+        class Request:
+            tool_call = {"name": "weather", "args": {"city": "杭州"}, "id": "call_1"}
+
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            return ToolMessage(content="杭州：晴", tool_call_id=request.tool_call["id"], name="weather")
+
+        cassette = Cassette(self.path, RECORD)
+        use_cassette(cassette)
+        await cassette_tool_call.awrap_tool_call(Request(), handler)
+        cassette.save()
+
+        use_cassette(Cassette.load(self.path))
+        result = await cassette_tool_call.awrap_tool_call(Request(), handler)
+        self.assertEqual(result.content, "杭州：晴")
+        self.assertEqual(result.tool_call_id, "call_1")
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
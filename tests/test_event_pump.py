@@ -0,0 +1,160 @@
+"""
+SSE 事件泵测试
+"""
+
+import asyncio
+import unittest
+
+from service.event_pump import EventPump, HeartbeatTimer, StreamQueue, END, HEARTBEAT, WORKFLOW_END
+
+
+class TestEventPump(unittest.IsolatedAsyncioTestCase):
+
+    async def _collect(self, pump: EventPump) -> list:
+        return [event async for event in pump.events()]
+
+    async def test_forward_without_copy_until_sentinel(self):
+        pump = EventPump(timer=HeartbeatTimer(interval=60))
+        token = {"type": "token", "node": "direct_answer", "data": {"content": "你好"}}
+        pump.queue.put_nowait(token)
+        pump.queue.put_nowait({"type": "approve_plan", "data": {}})
+        pump.queue.put_nowait(WORKFLOW_END)
+        pump.close()
+        # 哨兵之后的事件不再转发
+        pump.queue.put_nowait({"type": "status", "data": {}})
+
+        events = await self._collect(pump)
+        self.assertEqual(len(events), 2)
+        self.assertIs(events[0], token)
+        self.assertIs(events[1], WORKFLOW_END)
+
+    async def test_coalesce_tokens(self):
+        pump = EventPump(timer=HeartbeatTimer(interval=60), coalesce_ms=20, coalesce_chars=6)
+        for token in ["你", "好", "，", "杭"]:
+            pump.queue.put_nowait({"type": "token", "node": "plan_summary", "data": {"content": token}})
+        pump.queue.put_nowait({"type": "status", "data": {"status": "完成"}})
+        for token in ["第一天", "第二天", "第三天"]:
+            pump.queue.put_nowait({"type": "token", "node": "plan_summary", "data": {"content": token}})
+        pump.queue.put_nowait({"type": "token", "node": "direct_answer", "data": {"content": "好"}})
+        pump.close()
+
+        events = await self._collect(pump)
+        self.assertEqual(
+            [(e["type"], e.get("node"), e["data"].get("content")) for e in events],
+            [
+                # 遇到状态事件立即输出
+                ("token", "plan_summary", "你好，杭"),
+                ("status", None, None),
+                # 达到字符上限后输出
+                ("token", "plan_summary", "第一天第二天"),
+                ("token", "plan_summary", "第三天"),
+                # 不同节点不合并
+                ("token", "direct_answer", "好"),
+            ]
+        )
+
+    async def test_coalesce_window(self):
+        pump = EventPump(timer=HeartbeatTimer(interval=60), coalesce_ms=30, coalesce_chars=1000)
+
+        async def produce():
+            for i in range(6):
+                pump.queue.put_nowait({"type": "token", "node": "direct_answer", "data": {"content": str(i)}})
+                await asyncio.sleep(0.02)
+            pump.close()
+
+        producer = asyncio.create_task(produce())
+        events = await self._collect(pump)
+        await producer
+        self.assertEqual("".join(e["data"]["content"] for e in events), "012345")
+        self.assertLess(len(events), 6)
+
+    async def test_heartbeat_only_on_idle_streams(self):
+        timer = HeartbeatTimer(interval=0.1)
+        idle, busy = EventPump(timer=timer), EventPump(timer=timer)
+
+        async def produce():
+            for _ in range(12):
+                busy.queue.put_nowait({"type": "token", "data": {"content": "x"}})
+                await asyncio.sleep(0.03)
+            busy.close()
+            idle.close()
+
+        producer = asyncio.create_task(produce())
+        idle_events, busy_events = await asyncio.gather(self._collect(idle), self._collect(busy))
+        await producer
+
+        self.assertGreaterEqual(idle_events.count(HEARTBEAT), 2)
+        self.assertNotIn(HEARTBEAT, busy_events)
+        self.assertEqual(timer.stats()["open_streams"], 0)
+
+    async def test_timer_stops_without_streams(self):
+        timer = HeartbeatTimer(interval=0.02)
+        pump = EventPump(timer=timer)
+        pump.close()
+        await self._collect(pump)
+        await asyncio.sleep(0.05)
+        self.assertTrue(timer._task.done())
+
+
+
+def _token(content: str, node: str = "plan_summary") -> dict:
+    return {"type": "token", "node": node, "data": {"content": content}}
+
+
+class TestStreamQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def test_coalesce_when_full(self):
+        queue = StreamQueue(limit=2, policy="coalesce")
+        for token in ["第", "一", "天"]:
+            queue.put_nowait(_token(token))
+        queue.put_nowait({"type": "status", "data": {}})
+        queue.put_nowait(_token("好"))
+        queue.put_nowait(END)
+
+        self.assertEqual(queue.get_nowait()["data"]["content"], "第")
+        self.assertEqual(queue.get_nowait()["data"]["content"], "一天")
+        self.assertEqual(queue.get_nowait()["type"], "status")
+        self.assertEqual(queue.get_nowait()["data"]["content"], "好")
+        self.assertIs(queue.get_nowait(), END)
+        self.assertEqual(queue.merged, 1)
+        self.assertEqual(queue.high_water, 5)
+
+    async def test_heartbeat_dropped_when_backlogged(self):
+        queue = StreamQueue(limit=10, policy="drop_heartbeat")
+        queue.put_nowait(HEARTBEAT)
+        queue.put_nowait(HEARTBEAT)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.dropped, 1)
+
+    async def test_drop_heartbeat_does_not_limit_tokens(self):
+        queue = StreamQueue(limit=2, policy="drop_heartbeat")
+        for char in "abcd":
+            queue.put_nowait(_token(char))
+        self.assertEqual(queue.qsize(), 4)
+        self.assertEqual(queue.merged, 0)
+
+    async def test_pause_until_drained(self):
+        queue = StreamQueue(limit=2, policy="pause")
+        await queue.put(_token("a"))
+        await queue.put(_token("b"))
+        producer = asyncio.create_task(queue.put(_token("c")))
+        await asyncio.sleep(0.01)
+        self.assertFalse(producer.done())
+        self.assertEqual(queue.paused, 1)
+
+        queue.get_nowait()
+        await asyncio.wait_for(producer, 1)
+        self.assertEqual([queue.get_nowait()["data"]["content"] for _ in range(2)], ["b", "c"])
+        # 结束哨兵不受上限约束
+        await queue.put(_token("d"))
+        await queue.put(_token("e"))
+        queue.put_nowait(END)
+        self.assertEqual(queue.qsize(), 3)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            StreamQueue(policy="block")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,16 +5,13 @@ import asyncio
 import sys
 sys.path.insert(0, '/Users/penn/work/TravelAgent')
 
+from langchain_core.runnables import RunnableConfig
+
 from graph.async_config import PlanExecuteState
 from graph.async_nodes import async_executor_node
-from graph.stream_callback import set_stream_queue
 
 
 async def main():
-    # 创建队列并设置
-    queue = asyncio.Queue()
-    set_stream_queue(queue)
-
     # 构造输入状态
     state: PlanExecuteState = {
         "question": "北京今天天气怎么样？",
@@ -30,8 +27,11 @@ async def main():
         "cancelled": False,
     }
 
+    # 与工作流调用节点时传入的配置一致
+    config: RunnableConfig = {"configurable": {"thread_id": "test_executor_node"}}
+
     print("开始调用 async_executor_node...")
-    result = await async_executor_node(state)
+    result = await async_executor_node(state, config)
     print("执行结果:", result)
 
 
@@ -0,0 +1,100 @@
+"""
+LLM 对冲请求测试
+"""
+
+import asyncio
+import unittest
+
+from graph.hedging import HedgePolicy, parse_budgets, percentile
+
+
+class TestHedgeHelpers(unittest.TestCase):
+
+    def test_parse_budgets(self):
+        self.assertEqual(parse_budgets("router=0.1, planner=0.05,bad"), {"router": 0.1, "planner": 0.05})
+
+    def test_percentile(self):
+        self.assertEqual(percentile(range(1, 101), 0.95), 95)
+        self.assertEqual(percentile([3.0], 0.5), 3.0)
+
+
+class TestHedgePolicy(unittest.IsolatedAsyncioTestCase):
+    """测试对冲触发、胜出与预算"""
+
+    async def asyncSetUp(self):
+        self.policy = HedgePolicy(enabled=True, quantile=0.9, max_rate=1.0, budgets={"router": 1.0},
+                                  window=50, min_samples=3, min_delay=0.01)
+        self.cancelled = 0
+
+        async def fast():
+            await asyncio.sleep(0.005)
+            return "ok"
+
+        for _ in range(3):
+            await self.policy.call("router", fast)
+
+    def _factory(self, delays):
+        delays = list(delays)
+
+        async def call():
+            delay = delays.pop(0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            return f"slept {delay}"
+        return call
+
+    async def test_slow_call_hedged_and_loser_cancelled(self):
+        result = await self.policy.call("router", self._factory([1.0, 0.005]))
+        self.assertEqual(result, "slept 0.005")
+        self.assertEqual(self.cancelled, 1)
+        self.assertEqual(self.policy.stats()["nodes"]["router"]["hedge_wins"], 1)
+
+    async def test_no_hedge_without_budget(self):
+        self.policy.budgets = {"router": 0.0}
+        result = await self.policy.call("router", self._factory([0.05, 0.005]))
+        self.assertEqual(result, "slept 0.05")
+        self.assertEqual(self.policy.stats()["nodes"]["router"]["hedges"], 0)
+
+    async def test_total_rate_cap(self):
+        self.policy.max_rate = 0.2
+        await self.policy.call("router", self._factory([1.0, 0.005]))
+        # 最近 4 次中已有 1 次对冲（25%），超过 20% 上限，不再对冲
+        result = await self.policy.call("router", self._factory([0.05, 0.005]))
+        self.assertEqual(result, "slept 0.05")
+
+    async def test_stream_hedge_uses_first_chunk(self):
+        def factory_for(delays):
+            delays = list(delays)
+
+            def factory():
+                delay = delays.pop(0)
+
+                async def gen():
+                    await asyncio.sleep(delay)
+                    for token in (f"{delay}:", "a", "b"):
+                        yield token
+                return gen()
+            return factory
+
+        chunks = [c async for c in self.policy.stream("router", factory_for([1.0, 0.005]))]
+        self.assertEqual(chunks, ["0.005:", "a", "b"])
+
+    async def test_stream_without_hedge_reads_in_caller_task(self):
+        self.policy.enabled = False
+        tasks = []
+
+        async def gen():
+            tasks.append(asyncio.current_task())
+            yield "a"
+            yield "b"
+
+        chunks = [c async for c in self.policy.stream("router", gen)]
+        self.assertEqual(chunks, ["a", "b"])
+        self.assertEqual(tasks, [asyncio.current_task()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+本地意图分类器测试
+"""
+
+import unittest
+
+from graph.intent_classifier import IntentClassifier, classify_lexical
+
+
+class TestLexical(unittest.TestCase):
+    """测试关键词判断"""
+
+    def test_planner_cue(self):
+        decision = classify_lexical("给我规划下周去成都三天的行程")
+        self.assertEqual(decision.route, "planner")
+        self.assertEqual(decision.tier, "lexical")
+
+    def test_history_cue_wins(self):
+        """引用对话历史时即使出现“行程”也走 direct_answer"""
+        self.assertEqual(classify_lexical("刚才的行程里有哪些景点？").route, "direct_answer")
+
+    def test_no_cue(self):
+        self.assertIsNone(classify_lexical("去成都有哪些必吃美食？"))
+
+    def test_itinerary_needs_planning_verb(self):
+        """“行程”本身不足以判定规划，事实性追问交给后续判断"""
+        self.assertIsNone(classify_lexical("行程里的高铁多少钱"))
+        self.assertIsNone(classify_lexical("我做的行程里高铁多少钱"))
+        self.assertEqual(classify_lexical("帮我做一个三亚的行程").route, "planner")
+        self.assertEqual(classify_lexical("制定一下去西安的行程").route, "planner")
+        self.assertEqual(classify_lexical("带父母去三亚，做个详细的行程安排").route, "planner")
+
+
+class TestEmbedding(unittest.IsolatedAsyncioTestCase):
+    """测试最近质心判断"""
+
+    async def test_nearest_centroid(self):
+        vectors = {"计划": [1.0, 0.0], "闲聊": [0.0, 1.0], "q": [0.9, 0.1]}
+
+        async def embed(text):
+            return vectors[text]
+
+        classifier = IntentClassifier(embed, {"planner": ["计划"], "direct_answer": ["闲聊"]})
+        decision = await classifier.classify("q", threshold=0.8)
+        self.assertEqual(decision.route, "planner")
+        self.assertEqual(decision.tier, "embedding")
+
+    async def test_low_confidence_falls_back(self):
+        async def embed(text):
+            return [1.0, 1.0] if text == "q" else ([1.0, 0.0] if text == "计划" else [0.0, 1.0])
+
+        classifier = IntentClassifier(embed, {"planner": ["计划"], "direct_answer": ["闲聊"]})
+        self.assertIsNone(await classifier.classify("q", threshold=0.8))
+
+
+if __name__ == "__main__":
+    unittest.main()
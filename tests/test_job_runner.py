@@ -0,0 +1,148 @@
+"""
+工作流后台任务测试
+"""
+
+import asyncio
+import contextvars
+import unittest
+
+from langchain_core.messages import AIMessageChunk
+
+from graph.single_flight import SingleFlight
+from service.event_pump import EventPump, HeartbeatTimer, WORKFLOW_END
+from service.job_runner import JobRunner, JobQueueFullError, CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED
+
+marker = contextvars.ContextVar("marker", default=None)
+
+
+class SlowLLM:
+    """慢速流式返回，记录上游是否被取消"""
+
+    def __init__(self):
+        self.cancelled = 0
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": "slow"}
+
+    async def astream(self, prompt, config=None):
+        try:
+            for char in prompt:
+                await asyncio.sleep(0.01)
+                yield AIMessageChunk(content=char)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+class TestJobRunner(unittest.IsolatedAsyncioTestCase):
+
+    def _pump(self) -> EventPump:
+        return EventPump(timer=HeartbeatTimer(interval=60), coalesce=False)
+
+    def _submit(self, runner: JobRunner, thread_id: str, steps: int = 1, delay: float = 0.0, error: str = None):
+        pump = self._pump()
+
+        async def run_workflow():
+            try:
+                for i in range(steps):
+                    await asyncio.sleep(delay)
+                    await pump.queue.put({"type": "status", "data": {"status": marker.get()}})
+                if error:
+                    raise RuntimeError(error)
+                pump.queue.put_nowait(WORKFLOW_END)
+            finally:
+                pump.close()
+
+        return runner.submit("chat", thread_id, pump, run_workflow)
+
+    async def _wait(self, job, status: str):
+        for _ in range(100):
+            if job.status == status:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"运行状态 {job.status}，期望 {status}")
+
+    async def test_run_in_submit_context(self):
+        runner = JobRunner(workers=2)
+        marker.set("请求上下文")
+        job = self._submit(runner, "t1", steps=2)
+        marker.set(None)
+
+        events = [event async for _, event in job.session.subscribe()]
+        self.assertEqual([e["data"].get("status") for e in events[:2]], ["请求上下文"] * 2)
+        self.assertIs(events[-1], WORKFLOW_END)
+        await self._wait(job, SUCCEEDED)
+        self.assertIs(runner.get(job.run_id), job)
+        await runner.close()
+
+    async def test_bounded_concurrency(self):
+        runner = JobRunner(workers=1)
+        first = self._submit(runner, "t1", steps=5, delay=0.01)
+        second = self._submit(runner, "t2")
+        await self._wait(first, RUNNING)
+        # 只有一个 worker，第二个运行排队
+        self.assertEqual(second.status, QUEUED)
+        self.assertEqual(runner.stats()["running"], 1)
+        await self._wait(second, SUCCEEDED)
+        self.assertEqual(first.status, SUCCEEDED)
+        await runner.close()
+
+    async def test_queue_full(self):
+        runner = JobRunner(workers=1, max_queue=1)
+        self._submit(runner, "t1", steps=5, delay=0.01)
+        await asyncio.sleep(0)
+        self._submit(runner, "t2")
+        with self.assertRaises(JobQueueFullError):
+            self._submit(runner, "t3")
+        await runner.close()
+
+    async def test_cancel_queued_and_running(self):
+        runner = JobRunner(workers=1)
+        running = self._submit(runner, "t1", steps=100, delay=0.01)
+        queued = self._submit(runner, "t2")
+        await self._wait(running, RUNNING)
+
+        runner.cancel(queued.run_id)
+        self.assertEqual(queued.status, CANCELLED)
+        events = [event async for _, event in queued.session.subscribe()]
+        self.assertEqual([e["type"] for e in events], ["error"])
+
+        runner.cancel(running.run_id)
+        await self._wait(running, CANCELLED)
+        await runner.close()
+
+    async def test_disconnect_cancels_in_flight_llm_call(self):
+        runner = JobRunner(workers=1)
+        llm = SlowLLM()
+        pump = self._pump()
+
+        async def run_workflow():
+            try:
+                await SingleFlight(enabled=True).ainvoke(llm, "x" * 100, node="planner")
+                pump.queue.put_nowait(WORKFLOW_END)
+            finally:
+                pump.close()
+
+        job = runner.submit("chat", "t1", pump, run_workflow)
+        await self._wait(job, RUNNING)
+        await asyncio.sleep(0.03)
+
+        # 客户端断开时会话立即取消运行，取消传递到在途的上游流
+        self.assertTrue(job.session.cancel("disconnect"))
+        await self._wait(job, CANCELLED)
+        await asyncio.sleep(0)
+        self.assertEqual(llm.cancelled, 1)
+        self.assertFalse(job.session.cancel("disconnect"))
+        await runner.close()
+
+    async def test_failed(self):
+        runner = JobRunner(workers=1)
+        job = self._submit(runner, "t1", error="模型不可用")
+        await self._wait(job, FAILED)
+        self.assertEqual(job.error, "模型不可用")
+        await runner.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+LLM 调度器测试
+"""
+
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from graph.llm_governor import LLMGovernor, LLMOverloadedError, Priority, PRIORITY_DEADLINES, set_llm_priority
+
+
+class TestLLMGovernor(unittest.IsolatedAsyncioTestCase):
+    """测试优先级调度、截止时间与丢弃"""
+
+    async def asyncSetUp(self):
+        self.governor = LLMGovernor(enabled=True, rpm=0, tpm=0, max_concurrency=1, max_queue=10)
+        # 占住唯一的并发名额
+        self.holder = await self.governor.acquire("executor", 10)
+
+    async def test_high_priority_dispatched_first(self):
+        order = []
+
+        async def worker(node):
+            permit = await self.governor.acquire(node, 10)
+            order.append(node)
+            self.governor.release(permit)
+
+        tasks = [asyncio.create_task(worker("abstract")), asyncio.create_task(worker("direct_answer"))]
+        await asyncio.sleep(0)
+        self.governor.release(self.holder)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, ["direct_answer", "abstract"])
+
+    async def test_deadline_sheds_waiter(self):
+        with patch.dict(PRIORITY_DEADLINES, {Priority.BACKGROUND: 0.02}):
+            with self.assertRaises(LLMOverloadedError):
+                await self.governor.acquire("abstract", 10)
+        self.assertEqual(self.governor.stats()["queued"]["background"], 0)
+        self.assertEqual(self.governor.shed, 1)
+
+    async def test_overflow_sheds_lowest_priority(self):
+        self.governor.max_queue = 1
+        background = asyncio.create_task(self.governor.acquire("abstract", 10))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(self.governor.acquire("direct_answer", 10))
+        await asyncio.sleep(0)
+        with self.assertRaises(LLMOverloadedError):
+            await background
+        self.governor.release(self.holder)
+        self.assertEqual((await interactive).priority, Priority.INTERACTIVE)
+
+    async def test_rate_limited_sheds_background_and_pauses(self):
+        self.governor.cooldown = 0.05
+        background = asyncio.create_task(self.governor.acquire("abstract", 10))
+        planner = asyncio.create_task(self.governor.acquire("planner", 10))
+        await asyncio.sleep(0)
+        self.governor.on_rate_limited()
+        self.governor.release(self.holder)
+        with self.assertRaises(LLMOverloadedError):
+            await background
+        await asyncio.sleep(0.01)
+        self.assertFalse(planner.done())
+        permit = await asyncio.wait_for(planner, 1)
+        self.assertEqual(permit.node, "planner")
+
+    async def test_priority_override(self):
+        self.governor.release(self.holder)
+
+        async def speculative():
+            set_llm_priority(Priority.BACKGROUND)
+            return await self.governor.acquire("executor", 10)
+
+        permit = await asyncio.create_task(speculative())
+        self.assertEqual(permit.priority, Priority.BACKGROUND)
+
+    async def test_request_budget_delays_dispatch(self):
+        governor = LLMGovernor(enabled=True, rpm=6000, tpm=0, max_concurrency=10)
+        governor._requests.tokens = 0
+        start = asyncio.get_running_loop().time()
+        await governor.acquire("router", 10)
+        # 6000 RPM = 100/s，需等待约 10ms
+        self.assertGreaterEqual(asyncio.get_running_loop().time() - start, 0.005)
+
+
+if __name__ == "__main__":
+    unittest.main()
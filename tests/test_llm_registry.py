@@ -0,0 +1,37 @@
+"""
+LLM 客户端注册表测试
+"""
+
+import unittest
+
+from graph.llm_registry import LLMRegistry
+
+
+class TestLLMRegistry(unittest.IsolatedAsyncioTestCase):
+    """测试共享客户端"""
+
+    async def asyncSetUp(self):
+        self.registry = LLMRegistry(base_url="http://127.0.0.1:9/v1", api_key="test")
+
+    async def asyncTearDown(self):
+        await self.registry.aclose()
+
+    def test_same_params_share_instance(self):
+        self.assertIs(self.registry.get(streaming=True), self.registry.get(streaming=True))
+        self.assertIsNot(self.registry.get(streaming=True), self.registry.get(streaming=False))
+
+    def test_instances_share_http_client(self):
+        streaming = self.registry.get(streaming=True)
+        plain = self.registry.get(streaming=False, temperature=0.0)
+        self.assertIs(streaming.http_async_client, self.registry.http_client)
+        self.assertIs(plain.http_async_client, self.registry.http_client)
+
+    async def test_warmup_failure_does_not_raise(self):
+        await self.registry.warmup()
+        stats = self.registry.stats()
+        self.assertEqual(stats["active"], 0)
+        self.assertGreaterEqual(stats["requests"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
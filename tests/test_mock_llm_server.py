@@ -0,0 +1,59 @@
+"""
+模拟 LLM 服务测试
+"""
+
+import unittest
+
+import httpx
+import openai
+from langchain_core.tools import tool
+from langchain_openai import ChatOpenAI
+
+from bench.mock_llm_server import MockConfig, create_app
+from graph.prompts import route_prompt, planner_prompt
+from utils.parse_llm_json_util import parse_llm_json
+
+
+@tool
+def weather(city: str) -> str:
+    """查询天气"""
+    return f"{city}：晴"
+
+
+class TestMockLLMServer(unittest.IsolatedAsyncioTestCase):
+    """通过 ChatOpenAI 调用模拟服务"""
+
+    def _llm(self, config: MockConfig, streaming: bool = False) -> ChatOpenAI:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(config)))
+        return ChatOpenAI(model="deepseek-chat", api_key="mock", base_url="http://mock/v1",
+                          streaming=streaming, max_retries=0, http_async_client=client)
+
+    async def test_route_template(self):
+        llm = self._llm(MockConfig(ttft=0, tokens_per_second=0))
+        raw = await llm.ainvoke(route_prompt.format(memories=[], user_request="帮我规划北京三日游"))
+        self.assertEqual(parse_llm_json(raw.content), {"route": "planner"})
+        raw = await llm.ainvoke(route_prompt.format(memories=[], user_request="你好"))
+        self.assertEqual(parse_llm_json(raw.content), {"route": "direct_answer"})
+
+    async def test_streaming_planner(self):
+        llm = self._llm(MockConfig(ttft=0, tokens_per_second=0), streaming=True)
+        prompt = planner_prompt.format(memories=[], user_request="北京三日游", messages="")
+        chunks = [chunk.content async for chunk in llm.astream(prompt)]
+        self.assertGreater(len(chunks), 10)
+        plan = parse_llm_json("".join(chunks))
+        self.assertEqual(len(plan["steps"]), len(plan["dependencies"]))
+
+    async def test_tool_call_round_trip(self):
+        llm = self._llm(MockConfig(ttft=0, tokens_per_second=0)).bind_tools([weather])
+        first = await llm.ainvoke("查询北京天气")
+        self.assertEqual(first.tool_calls[0]["name"], "weather")
+        self.assertIn("city", first.tool_calls[0]["args"])
+
+    async def test_error_rate(self):
+        llm = self._llm(MockConfig(ttft=0, error_rate=1.0, error_status=429))
+        with self.assertRaises(openai.RateLimitError):
+            await llm.ainvoke("你好")
+
+
+if __name__ == "__main__":
+    unittest.main()
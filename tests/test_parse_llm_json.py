@@ -0,0 +1,88 @@
+"""
+LLM JSON 解析测试
+"""
+
+import unittest
+
+from utils.parse_llm_json_util import parse_llm_json, aparse_json_fields, StreamingJsonParser
+
+
+class TestParseLlmJson(unittest.TestCase):
+    """测试完整文本解析"""
+
+    def test_code_fence(self):
+        self.assertEqual(parse_llm_json('```json\n{"route": "planner"}\n```'), {"route": "planner"})
+
+    def test_surrounding_text(self):
+        self.assertEqual(parse_llm_json('结果如下：{"res": "北京旅行"} 以上'), {"res": "北京旅行"})
+
+
+class TestStreamingJsonParser(unittest.TestCase):
+    """测试增量解析"""
+
+    def _feed_chars(self, parser, text):
+        events = []
+        for ch in text:
+            events.extend(parser.feed(ch))
+        return events
+
+    def test_array_elements_emitted_when_complete(self):
+        parser = StreamingJsonParser()
+        events = parser.feed('```json\n{"steps": ["查询北京天气", "查询')
+        self.assertEqual(events, [(("steps", 0), "查询北京天气")])
+        events = parser.feed('高铁\\"G1\\""]}\n```')
+        self.assertIn((("steps", 1), '查询高铁"G1"'), events)
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.result, {"steps": ["查询北京天气", '查询高铁"G1"']})
+
+    def test_char_by_char(self):
+        text = '{"steps": ["a, {b}", "c"], "dependencies": [[], [0]], "n": 1.5, "ok": true}'
+        parser = StreamingJsonParser()
+        events = self._feed_chars(parser, text)
+        self.assertIn((("steps", 0), "a, {b}"), events)
+        self.assertIn((("dependencies", 1), [0]), events)
+        self.assertIn((("n",), 1.5), events)
+        self.assertIn((("ok",), True), events)
+        self.assertEqual(parser.result["dependencies"], [[], [0]])
+
+    def test_partial_result(self):
+        parser = StreamingJsonParser()
+        parser.feed('{"route": "planner", "steps": ["a", "b')
+        self.assertEqual(parser.partial, {"route": "planner", "steps": ["a"]})
+        self.assertFalse(parser.done)
+
+    def test_chunk_boundaries_do_not_matter(self):
+        text = '说明：\n```json\n{"steps": ["a\\"b", "c"], "dependencies": [[], [0]]}\n```'
+        whole = StreamingJsonParser().feed(text)
+        for size in (1, 2, 3, 5, 8):
+            parser = StreamingJsonParser()
+            events = []
+            for i in range(0, len(text), size):
+                events.extend(parser.feed(text[i:i + size]))
+            self.assertEqual(events, whole)
+            self.assertEqual(parser.result, {"steps": ['a"b', "c"], "dependencies": [[], [0]]})
+
+    def test_fence_with_leading_text(self):
+        parser = StreamingJsonParser()
+        self._feed_chars(parser, '好的[如下]：\n```json\n{"route": "direct_answer"}\n```')
+        self.assertEqual(parser.result, {"route": "direct_answer"})
+
+
+class TestParseJsonFields(unittest.IsolatedAsyncioTestCase):
+    """测试读到字段即停止"""
+
+    async def test_stream_closed_after_field(self):
+        produced = []
+
+        async def chunks():
+            for piece in ['{"rou', 'te": "planner"', ', "reason": "', '很长的解释"}']:
+                produced.append(piece)
+                yield piece
+
+        data = await aparse_json_fields(chunks(), ["route"])
+        self.assertEqual(data, {"route": "planner"})
+        self.assertEqual(len(produced), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+语义规划缓存测试
+"""
+
+import time
+import unittest
+
+from graph.plan_cache import PlanCache, context_digest
+
+
+class TestPlanCache(unittest.TestCase):
+    """测试规划缓存"""
+
+    def setUp(self):
+        self.cache = PlanCache(max_size=2, ttl=60, threshold=0.95)
+        self.digest = context_digest([], [])
+
+    def test_similar_question_hits(self):
+        self.cache.put("北京一日游怎么安排", [1.0, 0.0], self.digest, ["查天气", "查景点"], [[], []])
+        entry = self.cache.get([0.99, 0.05], self.digest)
+        self.assertEqual(entry.steps, ["查天气", "查景点"])
+        self.assertEqual(entry.hits, 1)
+
+    def test_dissimilar_or_other_context_misses(self):
+        self.cache.put("北京一日游怎么安排", [1.0, 0.0], self.digest, ["查天气"], [[]])
+        self.assertIsNone(self.cache.get([0.0, 1.0], self.digest))
+        other_digest = context_digest(["我喜欢吃辣"], [])
+        self.assertIsNone(self.cache.get([1.0, 0.0], other_digest))
+
+    def test_lru_eviction(self):
+        self.cache.put("a", [1.0, 0.0, 0.0], self.digest, ["a"], [[]])
+        self.cache.put("b", [0.0, 1.0, 0.0], self.digest, ["b"], [[]])
+        self.cache.get([1.0, 0.0, 0.0], self.digest)  # a 变为最近使用
+        self.cache.put("c", [0.0, 0.0, 1.0], self.digest, ["c"], [[]])
+        self.assertIsNotNone(self.cache.get([1.0, 0.0, 0.0], self.digest))
+        self.assertIsNone(self.cache.get([0.0, 1.0, 0.0], self.digest))
+
+    def test_ttl_expiry(self):
+        self.cache.ttl = 0.01
+        self.cache.put("a", [1.0, 0.0], self.digest, ["a"], [[]])
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get([1.0, 0.0], self.digest))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
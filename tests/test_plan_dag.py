@@ -0,0 +1,80 @@
+"""
+计划步骤 DAG 调度测试
+"""
+
+import asyncio
+import unittest
+
+from graph.plan_dag import normalize_dependencies, remap_dependencies, drop_steps, critical_path_length, run_plan_dag
+
+
+class TestPlanDependencies(unittest.TestCase):
+    """测试依赖规范化"""
+
+    def test_missing_dependencies_fallback_to_sequential(self):
+        """未提供依赖时按顺序执行"""
+        self.assertEqual(normalize_dependencies(["a", "b", "c"], []), [[], [0], [1]])
+
+    def test_invalid_dependencies_dropped(self):
+        """自依赖、向后依赖、越界依赖被丢弃"""
+        deps = normalize_dependencies(["a", "b", "c"], [[0, 1], [5, "x"], [0, 1, 2]])
+        self.assertEqual(deps, [[], [], [0, 1]])
+
+    def test_remap_after_edit(self):
+        """修改计划后按文本映射依赖"""
+        old_steps = ["查北京天气", "查高铁", "订酒店"]
+        old_deps = [[], [], [1]]
+        new_steps = ["查高铁", "订酒店", "查北京天气", "新增步骤"]
+        self.assertEqual(remap_dependencies(old_steps, old_deps, new_steps), [[], [0], [], [0, 1, 2]])
+
+    def test_remap_step_edited_in_place(self):
+        """原位改写的步骤沿用原依赖，依赖它的步骤也继续依赖它"""
+        old_steps = ["查北京天气", "查上海高铁", "安排行程"]
+        new_steps = ["查北京天气", "查杭州高铁", "安排行程"]
+        self.assertEqual(remap_dependencies(old_steps, [[], [], [0, 1]], new_steps), [[], [], [0, 1]])
+
+    def test_drop_steps(self):
+        """移除已有结果的步骤，剩余步骤记录被移除的依赖"""
+        remaining, deps, inherited = drop_steps(["a", "b", "c", "d"], [[], [], [0, 1], [2]], {0})
+        self.assertEqual(remaining, ["b", "c", "d"])
+        self.assertEqual(deps, [[], [0], [1]])
+        self.assertEqual(inherited, [[], [0], []])
+
+    def test_critical_path_length(self):
+        self.assertEqual(critical_path_length([[], [], [0, 1], []]), 2)
+
+
+class TestRunPlanDag(unittest.IsolatedAsyncioTestCase):
+    """测试并发执行"""
+
+    async def test_independent_steps_run_concurrently(self):
+        """互不依赖的步骤并发执行，结果按计划顺序返回"""
+        running = 0
+        peak = 0
+
+        async def run_step(index, dep_results):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return f"r{index}:{sorted(dep_results)}"
+
+        results = await run_plan_dag(["a", "b", "c", "d"], [[], [], [], [0, 1, 2]], run_step, max_concurrency=2)
+        self.assertEqual(results, ["r0:[]", "r1:[]", "r2:[]", "r3:[0, 1, 2]"])
+        self.assertEqual(peak, 2)
+
+    async def test_failure_cancels_others(self):
+        """任一步骤失败时抛出异常"""
+        async def run_step(index, dep_results):
+            if index == 0:
+                raise RuntimeError("boom")
+            await asyncio.sleep(1)
+            return ""
+
+        with self.assertRaises(RuntimeError):
+            await run_plan_dag(["a", "b"], [[], []], run_step)
+
+
+if __name__ == "__main__":
+    unittest.main()
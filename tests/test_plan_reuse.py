@@ -0,0 +1,33 @@
+"""
+计划步骤结果复用测试
+"""
+
+import unittest
+
+from graph.plan_reuse import match_executed_steps
+
+
+class TestMatchExecutedSteps(unittest.TestCase):
+    """测试已执行步骤匹配"""
+
+    def test_normalized_text_match(self):
+        matches = match_executed_steps(
+            ["查询北京天气", "查询高铁"],
+            [("查询 北京天气", "晴")]
+        )
+        self.assertEqual(matches, {0: ("查询 北京天气", "晴")})
+
+    def test_different_arguments_not_reused(self):
+        matches = match_executed_steps(
+            ["查询上海天气", "查询北京明天天气"],
+            [("查询北京天气", "晴"), ("查询北京今天天气", "多云")]
+        )
+        self.assertEqual(matches, {})
+
+    def test_latest_result_wins(self):
+        matches = match_executed_steps(["查询北京天气"], [("查询北京天气", "晴"), ("查询北京天气", "雨")])
+        self.assertEqual(matches, {0: ("查询北京天气", "雨")})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+LLM 请求合并测试
+"""
+
+import asyncio
+import unittest
+
+from langchain_core.messages import AIMessageChunk
+from langgraph.graph import StateGraph, START, END
+from typing_extensions import TypedDict
+
+from graph.single_flight import SingleFlight
+
+
+class FakeLLM:
+    """按字符流式返回提示词，记录上游调用次数"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": "fake"}
+
+    async def astream(self, prompt, config=None):
+        self.calls += 1
+        try:
+            for char in prompt:
+                await asyncio.sleep(0.005)
+                yield AIMessageChunk(content=char)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+class Collector:
+    def __init__(self):
+        self.tokens = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.append(token)
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    """测试在途请求合并"""
+
+    async def asyncSetUp(self):
+        self.flight = SingleFlight(enabled=True)
+        self.llm = FakeLLM()
+
+    async def test_identical_requests_share_one_call(self):
+        late = Collector()
+
+        async def late_caller():
+            await asyncio.sleep(0.012)
+            return await self.flight.ainvoke(self.llm, "abcdef", callbacks=[late])
+
+        results = await asyncio.gather(
+            self.flight.ainvoke(self.llm, "abcdef"),
+            self.flight.ainvoke(self.llm, "abcdef"),
+            late_caller()
+        )
+        self.assertEqual([r.content for r in results], ["abcdef"] * 3)
+        self.assertEqual(self.llm.calls, 1)
+        # 中途加入的调用方也能收到完整的 token 流
+        self.assertEqual("".join(late.tokens), "abcdef")
+        self.assertEqual(self.flight.stats()["shared"], 2)
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+
+    async def test_different_prompts_not_merged(self):
+        await asyncio.gather(self.flight.ainvoke(self.llm, "ab"), self.flight.ainvoke(self.llm, "cd"))
+        self.assertEqual(self.llm.calls, 2)
+
+    async def test_finished_request_not_cached(self):
+        await self.flight.ainvoke(self.llm, "ab")
+        await self.flight.ainvoke(self.llm, "ab")
+        self.assertEqual(self.llm.calls, 2)
+
+    async def test_upstream_cancelled_when_all_subscribers_leave(self):
+        stream = self.flight.astream(self.llm, "abcdef")
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.llm.cancelled, 1)
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+
+    async def test_early_leaver_does_not_cancel_others(self):
+        async def early():
+            stream = self.flight.astream(self.llm, "abcdef")
+            await stream.__anext__()
+            await stream.aclose()
+
+        result, _ = await asyncio.gather(self.flight.ainvoke(self.llm, "abcdef"), early())
+        self.assertEqual(result.content, "abcdef")
+        self.assertEqual(self.llm.cancelled, 0)
+
+    async def test_stream_run_in_messages_mode(self):
+        class State(TypedDict):
+            answer: str
+
+        async def answer(state: State):
+            # 两个相同的请求合并为一次上游调用，各自在 messages 流中输出 token
+            first, second = await asyncio.gather(
+                self.flight.ainvoke(self.llm, "abcdef", node="answer", stream=True),
+                self.flight.ainvoke(self.llm, "abcdef", node="answer", stream=True)
+            )
+            return {"answer": first.content + second.content}
+
+        graph = StateGraph(State)
+        graph.add_node("answer", answer)
+        graph.add_edge(START, "answer")
+        graph.add_edge("answer", END)
+
+        tokens = []
+        async for message, metadata in graph.compile().astream({"answer": ""}, stream_mode="messages"):
+            if isinstance(message, AIMessageChunk):
+                self.assertEqual(metadata["langgraph_node"], "answer")
+                tokens.append(message.content)
+        self.assertEqual(self.llm.calls, 1)
+        # 两个调用方的 token 交替到达，每个 token 各输出一次
+        self.assertEqual(sorted(tokens), sorted("abcdef" * 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+计划预执行测试
+"""
+
+import asyncio
+import unittest
+
+from graph.speculative import SpeculativeExecutor
+
+
+class TestSpeculativeExecutor(unittest.IsolatedAsyncioTestCase):
+    """测试预执行的采用与丢弃"""
+
+    async def asyncSetUp(self):
+        self.executor = SpeculativeExecutor(max_steps=2, ttl=60)
+        self.plan = ["查询北京天气", "查询高铁", "汇总行程"]
+        self.started = []
+
+        async def run_step(index):
+            self.started.append(index)
+            await asyncio.sleep(0.01)
+            return f"结果{index}"
+
+        self.executor.start("t1", "问题", self.plan, [[], [], [0, 1]], run_step)
+
+    async def test_only_root_steps_speculated(self):
+        await asyncio.sleep(0.02)
+        self.assertEqual(sorted(self.started), [0, 1])
+
+    async def test_unchanged_steps_adopted(self):
+        self.executor.reconcile("t1", ["查询 北京天气", "查询动车", "汇总行程"])
+        self.assertIsNone(self.executor.take("t1", "问题", "查询高铁"))
+        task = self.executor.take("t1", "问题", "查询北京天气")
+        self.assertEqual(await task, "结果0")
+
+    async def test_other_question_not_adopted(self):
+        self.assertIsNone(self.executor.take("t1", "另一个问题", "查询北京天气"))
+
+    async def test_discard_cancels(self):
+        run_tasks = list(self.executor._runs["t1"].tasks.values())
+        self.executor.discard("t1")
+        await asyncio.sleep(0)
+        self.assertTrue(all(t.cancelled() for t in run_tasks))
+
+
+if __name__ == "__main__":
+    unittest.main()
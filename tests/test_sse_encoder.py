@@ -0,0 +1,67 @@
+"""
+SSE 帧编码测试
+"""
+
+import json
+import unittest
+
+from service.event_pump import HEARTBEAT, WORKFLOW_END
+from service.sse_encoder import SSEEncoder, orjson
+
+
+def _parse(frame: bytes) -> tuple:
+    """解析一帧，返回 (id, 事件)"""
+    event_id = None
+    data = None
+    for line in frame.decode("utf-8").rstrip("\n").split("\n"):
+        field, _, value = line.partition(": ")
+        if field == "id":
+            event_id = int(value)
+        elif field == "data":
+            data = json.loads(value)
+    return event_id, data
+
+
+class TestSSEEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.encoders = [SSEEncoder("json")] + ([SSEEncoder("orjson")] if orjson is not None else [])
+
+    def test_frames(self):
+        token = {"type": "token", "node": "reflect", "data": {"content": "杭州「三日游」\n第一天"}}
+        for encoder in self.encoders:
+            frame = encoder.encode(12, token)
+            self.assertIsInstance(frame, bytes)
+            self.assertTrue(frame.startswith(b"id: 12\ndata: "))
+            self.assertTrue(frame.endswith(b"\n\n"))
+            # 中文原样输出，不转义为 \uXXXX
+            self.assertIn("杭州".encode("utf-8"), frame)
+            self.assertEqual(_parse(frame), (12, token))
+            self.assertEqual(_parse(encoder.encode(None, token)), (None, token))
+
+    def test_constant_frames_encoded_once(self):
+        for encoder in self.encoders:
+            self.assertIs(encoder.encode(None, HEARTBEAT), encoder.encode(None, HEARTBEAT))
+            self.assertEqual(_parse(encoder.encode(None, HEARTBEAT)), (None, HEARTBEAT))
+            self.assertEqual(_parse(encoder.encode(7, WORKFLOW_END)), (7, WORKFLOW_END))
+
+    def test_backends_agree(self):
+        events = [
+            {"type": "plan_step", "node": "planner", "data": {"index": 0, "step": "查询杭州天气"}},
+            {"type": "waiting_for_approval", "data": {"plan": ["a", "b"]}},
+            # orjson 不支持非字符串的键，回退到标准库
+            {"type": "status", "data": {1: "x"}},
+        ]
+        for event in events:
+            self.assertEqual(len({e.encode(3, event) for e in self.encoders}), 1)
+
+    def test_error_frame(self):
+        self.assertEqual(_parse(self.encoders[0].error("失败")), (None, {"type": "error", "data": {"message": "失败"}}))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            SSEEncoder("msgpack")
+
+
+if __name__ == "__main__":
+    unittest.main()
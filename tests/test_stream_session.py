@@ -0,0 +1,189 @@
+"""
+可续传流式会话测试
+"""
+
+import asyncio
+import unittest
+from contextlib import aclosing
+
+from service.event_pump import EventPump, HeartbeatTimer, StreamQueue, WORKFLOW_END
+from service.stream_session import LAGGED, StreamSession, StreamSessionRegistry
+
+
+def _status(text: str) -> dict:
+    return {"type": "status", "data": {"status": text}}
+
+
+def _token(text: str) -> dict:
+    return {"type": "token", "node": "executor", "data": {"content": text}}
+
+
+class TestStreamSession(unittest.IsolatedAsyncioTestCase):
+
+    def _pump(self, policy: str = "drop_heartbeat", limit: int = 256) -> EventPump:
+        return EventPump(timer=HeartbeatTimer(interval=60), coalesce=False,
+                         queue=StreamQueue(limit=limit, policy=policy))
+
+    def _start(self, session: StreamSession, steps: int, delay: float = 0.0, on_finish=None, make=_status):
+        async def run_workflow():
+            try:
+                for i in range(steps):
+                    await asyncio.sleep(delay)
+                    await session.pump.queue.put(make(str(i)))
+                session.pump.queue.put_nowait(WORKFLOW_END)
+            finally:
+                session.pump.close()
+
+        task = asyncio.create_task(run_workflow())
+        session.start(task.cancel, on_finish=on_finish)
+        return task
+
+    async def test_ids_and_completion(self):
+        session = StreamSession("t1", self._pump(), grace=1)
+        self._start(session, 3)
+        items = [item async for item in session.subscribe()]
+        self.assertEqual([i for i, _ in items], [1, 2, 3, 4])
+        self.assertIs(items[-1][1], WORKFLOW_END)
+
+    async def test_resume_after_disconnect(self):
+        session = StreamSession("t1", self._pump(), grace=5)
+        task = self._start(session, 5, delay=0.01)
+
+        received = []
+        async with aclosing(session.subscribe()) as events:
+            async for event_id, event in events:
+                received.append(event_id)
+                if len(received) == 2:
+                    break
+
+        # 断开期间工作流继续运行
+        await asyncio.wait_for(task, 1)
+        self.assertFalse(task.cancelled())
+
+        resumed = [event_id async for event_id, _ in session.subscribe(last_event_id=received[-1])]
+        self.assertEqual(received + resumed, [1, 2, 3, 4, 5, 6])
+
+    async def test_cancel_after_grace(self):
+        removed = []
+        session = StreamSession("t1", self._pump(), grace=0.05)
+        task = self._start(session, 100, delay=0.01, on_finish=removed.append)
+
+        async with aclosing(session.subscribe()) as events:
+            async for _ in events:
+                break
+
+        await asyncio.sleep(0.2)
+        self.assertTrue(task.cancelled())
+        self.assertEqual(removed, [session])
+
+    async def test_multiple_subscribers(self):
+        session = StreamSession("t1", self._pump(), grace=1)
+        self._start(session, 5, delay=0.01)
+
+        async def watch(last_event_id=None):
+            return [item async for item in session.subscribe(last_event_id)]
+
+        results = await asyncio.gather(watch(), watch(), watch(last_event_id=3))
+        # 工作流只运行一次，每个订阅者各自收到完整的流（共享同一批事件对象）
+        self.assertEqual(session.last_id, 6)
+        self.assertEqual([i for i, _ in results[0]], list(range(1, 7)))
+        self.assertEqual([e for _, e in results[0]], [e for _, e in results[1]])
+        self.assertIs(results[0][-1][1], results[1][-1][1])
+        self.assertEqual(results[2], results[0][3:])
+
+    async def test_slow_subscriber_does_not_block(self):
+        session = StreamSession("t1", self._pump(), grace=1, subscriber_buffer=5)
+        task = self._start(session, 20)
+        slow = session.subscribe()
+        self.assertEqual((await slow.__anext__())[0], 1)
+
+        # 慢订阅者不读取时，工作流和其他订阅者照常进行
+        fast = [event_id async for event_id, _ in session.subscribe()]
+        self.assertEqual(fast, list(range(1, 22)))
+        await asyncio.wait_for(task, 1)
+
+        # 落后超过自己的缓冲上限后收到 lagged 并结束
+        self.assertEqual([item async for item in slow], [(None, LAGGED)])
+        self.assertEqual(session.subscribers, 0)
+
+    async def test_slow_subscriber_coalesced(self):
+        session = StreamSession("t1", self._pump(policy="coalesce"), grace=1, subscriber_buffer=3)
+        task = self._start(session, 20, make=_token)
+        slow = session.subscribe()
+        self.assertEqual((await slow.__anext__())[0], 1)
+        await asyncio.wait_for(task, 1)
+
+        # 落后超过上限的 token 合并为一帧，合并后未超过上限，不断开
+        rest = [item async for item in slow]
+        self.assertEqual(rest[0], (20, _token("".join(str(i) for i in range(1, 20)))))
+        self.assertEqual(rest[1], (21, WORKFLOW_END))
+        self.assertEqual(session.pump.queue.merged, 18)
+        self.assertGreaterEqual(session.pump.queue.high_water, 19)
+
+    async def test_slow_subscriber_pauses_workflow(self):
+        session = StreamSession("t1", self._pump(policy="pause", limit=3), grace=1, subscriber_buffer=5)
+        task = self._start(session, 20, make=_token)
+        slow = session.subscribe()
+        self.assertEqual((await slow.__anext__())[0], 1)
+
+        # 订阅者停止读取：读取任务等待，事件泵队列积满，工作流暂停
+        await asyncio.sleep(0.05)
+        self.assertFalse(task.done())
+        self.assertEqual(session.last_id, 5)
+        self.assertEqual(session.pump.queue.qsize(), 3)
+        self.assertGreaterEqual(session.pump.queue.paused, 1)
+        self.assertGreaterEqual(session.pump.queue.high_water, 5)
+
+        # 订阅者跟上后工作流继续，事件不丢失
+        rest = [event_id async for event_id, _ in slow]
+        self.assertEqual(rest, list(range(2, 22)))
+        await asyncio.wait_for(task, 1)
+
+    async def test_disconnect_waits_for_grace_after_resume(self):
+        cancelled = []
+        session = StreamSession("t1", self._pump(), grace=0.05, cancel_on_disconnect=True)
+        session.start(cancelled.append)
+
+        # 带 Last-Event-ID 续传过的客户端断开：等待宽限期
+        subscriber = session.attach(last_event_id=0)
+        subscriber.close(disconnected=True)
+        self.assertEqual(cancelled, [])
+
+        # 宽限期内重连不取消
+        subscriber = session.attach(last_event_id=0)
+        await asyncio.sleep(0.1)
+        self.assertEqual(cancelled, [])
+
+        subscriber.close(disconnected=True)
+        await asyncio.sleep(0.1)
+        self.assertEqual(cancelled, ["expired"])
+        session.pump.close()
+
+    async def test_disconnect_cancels_after_last_subscriber(self):
+        cancelled = []
+        session = StreamSession("t1", self._pump(), grace=5, cancel_on_disconnect=True)
+        session.start(cancelled.append)
+        first = session.attach()
+        second = session.attach()
+
+        first.close(disconnected=True)
+        self.assertEqual(cancelled, [])
+        second.close(disconnected=True)
+        self.assertEqual(cancelled, ["disconnect"])
+        session.pump.close()
+
+    async def test_registry_continues_ids(self):
+        registry = StreamSessionRegistry()
+        session = registry.create("t1", self._pump())
+        self._start(session, 2)
+        self.assertEqual([i async for i, _ in session.subscribe()], [1, 2, 3])
+
+        # 保留期内同一线程的下一次运行接着编号
+        follow_up = registry.create("t1", self._pump())
+        self.assertEqual(follow_up.first_id, 4)
+        registry.remove(session)
+        self.assertIs(registry.get("t1"), follow_up)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+"""
+分级摘要测试
+"""
+
+import unittest
+
+from graph.summarizer import estimate_tokens, truncate_to_budget, extractive_summary, summarize_step_result
+
+
+class TestSummarizer(unittest.IsolatedAsyncioTestCase):
+    """测试分级摘要"""
+
+    async def _embed_query(self, text):
+        return [1.0, 0.0] if "天气" in text else [0.0, 1.0]
+
+    async def _embed_documents(self, texts):
+        return [await self._embed_query(t) for t in texts]
+
+    def test_token_budget(self):
+        self.assertEqual(estimate_tokens("北京天气"), 4)
+        self.assertLessEqual(estimate_tokens(truncate_to_budget("北京天气晴朗 sunny all day", 5)), 5)
+
+    async def test_short_result_passthrough(self):
+        self.assertEqual(await summarize_step_result("查询北京天气", "晴"), "晴")
+
+    async def test_extractive_keeps_relevant_sentences_in_order(self):
+        content = "景点很多。北京明天天气晴。门票价格不一。后天天气多云。"
+        summary = await extractive_summary("查询北京天气", content, self._embed_query, self._embed_documents, budget=16)
+        self.assertEqual(summary, "北京明天天气晴。\n后天天气多云。")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+"""
+WebSocket 多路复用接口测试
+"""
+
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import assistant_api
+from api.assistant_api import WebSocketConnection
+from service.assistant_service import AssistantService
+from service.event_pump import EventPump, HeartbeatTimer, WORKFLOW_END
+from service.job_runner import job_runner
+
+
+def _status(text: str) -> dict:
+    return {"type": "status", "data": {"status": text}}
+
+
+class FakeAssistantService(AssistantService):
+    """不初始化工作流，按问题内容产出固定的事件"""
+
+    def __init__(self):
+        super().__init__()
+        self.jobs = []
+
+    def _submit(self, kind: str, thread_id: str, steps: int, delay: float):
+        pump = EventPump(name=thread_id, timer=HeartbeatTimer(interval=60), coalesce=False)
+
+        async def run_workflow():
+            try:
+                for i in range(steps):
+                    await asyncio.sleep(delay)
+                    await pump.queue.put(_status(f"{kind} {i}"))
+                pump.queue.put_nowait(WORKFLOW_END)
+            finally:
+                pump.close()
+
+        job = job_runner.submit(kind, thread_id, pump, run_workflow)
+        self.jobs.append(job)
+        return job
+
+    async def submit_chat(self, request):
+        if request.question == "slow":
+            return self._submit("chat", request.thread_id, 200, 0.02)
+        if request.question == "long":
+            return self._submit("chat", request.thread_id, 50, 0.0)
+        return self._submit("chat", request.thread_id, 2, 0.0)
+
+    async def submit_approve(self, request):
+        return self._submit("approve", request.thread_id, 1, 0.0)
+
+
+def _chat(ref: int, question: str = "北京一日游", thread_id: str = "ws1") -> dict:
+    return {"op": "chat", "ref": ref, "data": {"question": question, "thread_id": thread_id, "user_id": 1}}
+
+
+class TestWebSocketApi(unittest.TestCase):
+    """测试 chat / approve / subscribe / cancel 及异常帧"""
+
+    def setUp(self):
+        self.service = FakeAssistantService()
+        patcher = patch.object(assistant_api, "assistant_service", self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app = FastAPI()
+        app.include_router(assistant_api.router)
+        self.client = TestClient(app)
+        self.client.__enter__()
+        self.addCleanup(self.client.__exit__, None, None, None)
+
+    @staticmethod
+    def _events_until_end(websocket, run_id: str) -> list:
+        events = []
+        while True:
+            frame = websocket.receive_json()
+            if frame.get("run") != run_id or "event" not in frame:
+                continue
+            events.append((frame["id"], frame["event"]))
+            if frame["event"]["type"] == "workflow_end":
+                return events
+
+    def test_chat_and_approve(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json(_chat(1))
+            reply = websocket.receive_json()
+            self.assertEqual(reply["ref"], 1)
+            events = self._events_until_end(websocket, reply["run"])
+            self.assertEqual(events[0][0], None)
+            self.assertEqual((events[0][1]["type"], events[0][1]["data"]["run_id"]), ("run", reply["run"]))
+            self.assertEqual([e["data"]["status"] for _, e in events[1:-1]], ["chat 0", "chat 1"])
+            self.assertEqual([i for i, _ in events[1:]], [1, 2, 3])
+
+            websocket.send_json({"op": "approve", "ref": 2, "data": {
+                "thread_id": "ws2", "approved": True, "plan": ["查天气"], "cancelled": False}})
+            reply = websocket.receive_json()
+            self.assertEqual(reply["ref"], 2)
+            events = self._events_until_end(websocket, reply["run"])
+            self.assertEqual(events[1][1], _status("approve 0"))
+
+    def test_subscribe_resumes_after_last_event_id(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json(_chat(1, thread_id="ws3"))
+            run_id = websocket.receive_json()["run"]
+            self._events_until_end(websocket, run_id)
+
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"op": "subscribe", "ref": 2, "run_id": run_id, "last_event_id": 1})
+            self.assertEqual(websocket.receive_json(), {"ref": 2, "run": run_id})
+            events = self._events_until_end(websocket, run_id)
+            self.assertEqual([i for i, _ in events], [2, 3])
+
+            websocket.send_json({"op": "subscribe", "ref": 3, "run_id": "missing"})
+            self.assertEqual(websocket.receive_json()["code"], 404)
+
+    def test_cancel(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json(_chat(1, question="slow", thread_id="ws4"))
+            run_id = websocket.receive_json()["run"]
+            websocket.send_json({"op": "cancel", "ref": 2, "run_id": run_id})
+
+            reply, errors = None, []
+            while reply is None or not errors:
+                frame = websocket.receive_json()
+                if frame.get("ref") == 2:
+                    reply = frame
+                elif frame.get("event", {}).get("type") == "error":
+                    errors.append(frame["event"])
+            self.assertEqual(reply["run"], run_id)
+            self.assertEqual(errors[0]["data"]["message"], "运行已取消")
+
+    def test_invalid_frames_get_error_replies(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_bytes(b"\x00\x01")
+            self.assertEqual(websocket.receive_json(), {"ref": None, "error": "只支持 JSON 文本帧", "code": 400})
+            websocket.send_text("not json")
+            self.assertEqual(websocket.receive_json()["code"], 400)
+            websocket.send_json({"op": "unknown", "ref": 1})
+            self.assertEqual(websocket.receive_json()["code"], 400)
+            websocket.send_json({"op": "chat", "ref": 2, "data": {"question": "缺少字段"}})
+            reply = websocket.receive_json()
+            self.assertEqual((reply["ref"], reply["code"]), (2, 400))
+            for ref, data in ((4, "x"), (5, None), (6, [1])):
+                websocket.send_json({"op": "chat", "ref": ref, "data": data})
+                self.assertEqual(websocket.receive_json(), {"ref": ref, "error": "data 必须是对象", "code": 400})
+            websocket.send_json({"op": "approve", "ref": 7, "data": "x"})
+            self.assertEqual(websocket.receive_json()["code"], 400)
+            # 连接仍然可用
+            websocket.send_json(_chat(3, thread_id="ws5"))
+            frame = websocket.receive_json()
+            while frame.get("ref") != 3:
+                frame = websocket.receive_json()
+            self.assertIn("run", frame)
+
+    def test_disconnect_detaches_subscribers(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json(_chat(1, question="slow", thread_id="ws6"))
+            run_id = websocket.receive_json()["run"]
+            websocket.receive_json()
+        job = self.service.get_run(run_id)
+
+        deadline = time.monotonic() + 2
+        while job.status != "cancelled" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(job.session.subscribers, 0)
+        # 未续传过的客户端断开后立即取消运行
+        self.assertEqual(job.status, "cancelled")
+
+
+class FakeWebSocket:
+    """客户端不读取：send_text 一直阻塞"""
+
+    def __init__(self):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, text: str):
+        await self.release.wait()
+        self.sent.append(text)
+
+
+class TestWebSocketOutbox(unittest.IsolatedAsyncioTestCase):
+    """测试发送队列有界，慢客户端不阻塞运行"""
+
+    async def test_outbox_bounded_and_cleanup(self):
+        service = FakeAssistantService()
+        with patch.object(assistant_api, "assistant_service", service), \
+                patch.object(assistant_api, "WS_SEND_QUEUE", 4):
+            websocket = FakeWebSocket()
+            connection = WebSocketConnection(websocket)
+            serving = asyncio.create_task(connection.serve())
+
+            await websocket.incoming.put({"type": "websocket.receive", "text": '{"op": "chat", "ref": 1, "data": '
+                                          '{"question": "long", "thread_id": "ws7", "user_id": 1}}'})
+            await asyncio.sleep(0.1)
+            self.assertEqual(connection.outbox.maxsize, 4)
+            self.assertEqual(connection.outbox.qsize(), 4)
+            job = service.jobs[0]
+            # 客户端不读取，运行照常结束
+            self.assertEqual(job.status, "succeeded")
+
+            await websocket.incoming.put({"type": "websocket.disconnect", "code": 1000})
+            await asyncio.wait_for(serving, 1)
+            self.assertEqual(job.session.subscribers, 0)
+            self.assertEqual(connection.runs, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+进程内指标统计工具
+
+提供计数器、仪表盘和直方图，统一通过 /api/v1/metrics 暴露
+"""
+
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Tuple
+
+# 直方图默认分桶（秒）
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_key(name: str, labels: dict) -> str:
+    """指标名 + 标签 -> name{k=v,...}"""
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class _Histogram:
+    """累积直方图：count/sum/max + 分桶计数"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def to_dict(self) -> dict:
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "buckets": dict(zip(bounds, self.bucket_counts)),
+        }
+
+
+class MetricsRegistry:
+    """线程安全的指标注册中心"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, _Histogram] = {}
+        self._collectors: Dict[str, Callable[[], dict]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器累加"""
+        key = _format_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """设置仪表盘当前值"""
+        key = _format_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels):
+        """记录一次直方图观测值"""
+        key = _format_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, name: str, collector: Callable[[], dict]):
+        """注册在 snapshot 时实时采集的指标（如连接池状态）"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> dict:
+        """导出所有指标"""
+        with self._lock:
+            result = {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {k: h.to_dict() for k, h in self._histograms.items()},
+            }
+            collectors = dict(self._collectors)
+        for name, collector in collectors.items():
+            try:
+                result[name] = collector()
+            except Exception as e:
+                result[name] = {"error": str(e)}
+        return result
+
+
+# 全局指标实例
+metrics = MetricsRegistry()
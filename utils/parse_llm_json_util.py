@@ -1,11 +1,32 @@
 import json
+from bisect import bisect_left, bisect_right
+from typing import Any, AsyncIterator, Dict, Iterable, List
+
 
 def parse_llm_json(content):
     if isinstance(content, (dict, list)):
         return content
     if content is None:
         raise ValueError("empty content")
-    text = str(content).strip()
+    text = _strip_code_fence(str(content).strip())
+
+    # 快速路径：大多数回复去掉代码块标记后就是合法 JSON，直接 json.loads
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    # 前后夹带说明文字时，用增量解析器找出第一个完整的根对象
+    parser = StreamingJsonParser(max_depth=0)
+    parser.feed(text)
+    if parser.done and parser.result is not None:
+        return parser.result
+
+    # 兜底：首尾括号截取
+    return _parse_llm_json_fallback(text)
+
+
+def _strip_code_fence(text: str) -> str:
     if text.startswith("```"):
         parts = text.split("```")
         if len(parts) >= 3:
@@ -14,6 +35,10 @@ def parse_llm_json(content):
         lines = text.splitlines()
         if lines and lines[0].strip().lower() == "json":
             text = "\n".join(lines[1:]).strip()
+    return text
+
+
+def _parse_llm_json_fallback(text: str):
     try:
         return json.loads(text)
     except Exception:
@@ -27,4 +52,236 @@ def parse_llm_json(content):
         if end == -1 or end <= start:
             raise
         snippet = text[start:end + 1].strip()
-        return json.loads(snippet)
\ No newline at end of file
+        return json.loads(snippet)
+
+
+async def aparse_json_fields(chunks: AsyncIterator, fields: Iterable[str]) -> Dict[str, Any]:
+    """从 LLM 流式输出中读取指定的顶层字段
+
+    所需字段全部到齐后立即关闭上游流，剩余的 token 不再生成（节省输出 token 和等待时间）。
+    流结束仍缺字段时，退回到对完整文本的解析。
+    """
+    wanted = set(fields)
+    found: Dict[str, Any] = {}
+    parser = StreamingJsonParser(max_depth=1)
+    pieces: List[str] = []
+    try:
+        async for chunk in chunks:
+            piece = getattr(chunk, "content", chunk) or ""
+            pieces.append(piece)
+            for path, value in parser.feed(piece):
+                if path[0] in wanted:
+                    found[path[0]] = value
+            if wanted <= found.keys():
+                break
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    if not wanted <= found.keys():
+        data = parser.result if parser.done and parser.result is not None else parse_llm_json("".join(pieces))
+        if isinstance(data, dict):
+            for key in wanted - found.keys():
+                if key in data:
+                    found[key] = data[key]
+    return found
+
+
+class StreamingJsonParser:
+    """增量 JSON 解析器
+
+    逐块 feed LLM 输出，每当某个值（对象字段、数组元素）完整出现时立即返回，
+    不必等整段输出结束。例如规划输出 {"steps": ["a", "b", ...]}，
+    "a" 的右引号一到就能得到 (("steps", 0), "a")。
+
+    - 根对象 { 或 [ 之前的文本（如 ```json 代码块标记、说明文字）会被跳过，
+      根对象结束后的文本（如结尾的 ```）被忽略
+    - 只解析深度不超过 max_depth 的值，更深的值随其所在容器一起返回
+    - partial 为目前已完整到达的字段/元素拼出的部分结果
+    """
+
+    _WHITESPACE = " \t\r\n"
+
+    def __init__(self, max_depth: int = 2):
+        self.max_depth = max_depth
+        self.done = False
+        self.result = None
+        self.partial = None
+        # 已输入的文本按块保存，_offsets[k] 为第 k 块在全文中的起始位置；
+        # 值完成时只拼接它跨越的几块，不在每次 feed 时复制全文
+        self._chunks: List[str] = []
+        self._offsets: List[int] = []
+        self._length = 0
+        # 尚未扫描的文本及其在全文中的起始位置（等待代码块标记完整到达时跨块保留）
+        self._pending = ""
+        self._pos = 0
+        # 栈帧：[类型 obj/arr, 当前路径, 当前键或下标, 期望 key/colon/value/comma, 起始位置]
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._scalar_start = -1
+
+    def feed(self, chunk: str):
+        """输入一段文本，返回本次新完成的 (path, value) 列表"""
+        events = []
+        if self.done or not chunk:
+            return events
+        self._chunks.append(chunk)
+        self._offsets.append(self._length)
+        self._length += len(chunk)
+        text = self._pending + chunk if self._pending else chunk
+        base = self._pos
+        i = 0
+        while i < len(text) and not self.done:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._on_string_end(base + i, events)
+                i += 1
+                continue
+
+            if self._scalar_start >= 0:
+                if c not in ",]}" and c not in self._WHITESPACE:
+                    i += 1
+                    continue
+                self._complete_value(self._scalar_start, base + i, events)
+                self._scalar_start = -1
+
+            if not self._stack:
+                # 根对象开始之前的文本（说明、代码块标记）直接跳过
+                if c == "`":
+                    # 代码块起始行（```json）整行跳过，标记或换行符未完整到达时等待后续输入
+                    if text.startswith("```", i):
+                        newline = text.find("\n", i)
+                        if newline == -1:
+                            break
+                        i = newline + 1
+                        continue
+                    if "```".startswith(text[i:]):
+                        break
+                if c in "{[":
+                    self._push(c, (), base + i)
+                i += 1
+                continue
+
+            frame = self._stack[-1]
+            if c == "`":
+                # JSON 中不会出现反引号：之前的“根对象”只是说明文字，从代码块标记处重新开始
+                self._reset()
+                continue
+            if c in self._WHITESPACE:
+                pass
+            elif c == '"':
+                self._in_string = True
+                self._string_start = base + i
+            elif c in "{[":
+                self._push(c, self._child_path(frame), base + i)
+            elif c in "}]":
+                self._stack.pop()
+                self._complete_value(frame[4], base + i + 1, events, path=frame[1])
+            elif c == ":":
+                frame[3] = "value"
+            elif c == ",":
+                if frame[0] == "arr":
+                    frame[2] += 1
+                    frame[3] = "value"
+                else:
+                    frame[3] = "key"
+            else:
+                self._scalar_start = base + i
+            i += 1
+        self._pending = text[i:]
+        self._pos = base + i
+        return events
+
+    def _slice(self, start: int, end: int) -> str:
+        """取全文 [start, end) 区间，只拼接覆盖该区间的块"""
+        first = bisect_right(self._offsets, start) - 1
+        last = bisect_left(self._offsets, end)
+        piece = "".join(self._chunks[first:last])
+        offset = self._offsets[first]
+        return piece[start - offset:end - offset]
+
+    def _reset(self):
+        """丢弃当前未完成的根对象"""
+        self._stack = []
+        self._scalar_start = -1
+        self.partial = None
+
+    def _push(self, c: str, path: tuple, start: int):
+        if c == "{":
+            self._stack.append(["obj", path, None, "key", start])
+        else:
+            self._stack.append(["arr", path, 0, "value", start])
+
+    @staticmethod
+    def _child_path(frame) -> tuple:
+        return frame[1] + (frame[2],)
+
+    def _on_string_end(self, end: int, events: list):
+        frame = self._stack[-1]
+        if frame[0] == "obj" and frame[3] == "key":
+            try:
+                frame[2] = json.loads(self._slice(self._string_start, end + 1))
+            except ValueError:
+                frame[2] = self._slice(self._string_start + 1, end)
+            frame[3] = "colon"
+            return
+        self._complete_value(self._string_start, end + 1, events)
+
+    def _complete_value(self, start: int, end: int, events: list, path: tuple = None):
+        """一个值完整出现：解析并记录事件"""
+        if path is None:
+            frame = self._stack[-1]
+            path = self._child_path(frame)
+            frame[3] = "comma"
+        elif self._stack:
+            self._stack[-1][3] = "comma"
+
+        if not path:
+            # 根对象结束；解析失败说明是说明文字里的括号，丢弃后继续寻找真正的 JSON
+            try:
+                self.result = json.loads(self._slice(start, end))
+            except ValueError:
+                self._reset()
+                return
+            self.done = True
+            return
+        if len(path) > self.max_depth:
+            return
+        try:
+            value = json.loads(self._slice(start, end))
+        except ValueError:
+            return
+        events.append((path, value))
+        self._assign_partial(path, value)
+
+    def _assign_partial(self, path: tuple, value):
+        """把新完成的值写入 partial"""
+        if self.partial is None:
+            self.partial = {} if isinstance(path[0], str) else []
+        node = self.partial
+        for depth, key in enumerate(path[:-1]):
+            child = [] if isinstance(path[depth + 1], int) else {}
+            if isinstance(node, dict):
+                node = node.setdefault(key, child)
+            else:
+                while len(node) <= key:
+                    node.append(None)
+                if node[key] is None:
+                    node[key] = child
+                node = node[key]
+        last = path[-1]
+        if isinstance(node, dict):
+            node[last] = value
+        else:
+            while len(node) <= last:
+                node.append(None)
+            node[last] = value
@@ -0,0 +1,16 @@
+"""
+token 估算工具
+
+不依赖 tokenizer 的粗略估算，用于摘要预算和 LLM 限流预扣
+"""
+
+import math
+import re
+
+_CJK = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文字符约 1 token，其余约 4 个字符 1 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
@@ -0,0 +1,20 @@
+"""
+向量计算工具
+
+意图路由、规划缓存、步骤复用、抽取式摘要共用的向量相似度函数，
+输入为 embed_query / embed_documents 返回的 List[float]。
+"""
+
+import math
+from typing import List
+
+
+def dot(a: List[float], b: List[float]) -> float:
+    """内积（向量已归一化时等价于余弦相似度）"""
+    return sum(x * y for x, y in zip(a, b))
+
+
+def cosine(a: List[float], b: List[float]) -> float:
+    """余弦相似度，任一向量为零向量时返回 0"""
+    norm = math.sqrt(dot(a, a)) * math.sqrt(dot(b, b))
+    return dot(a, b) / norm if norm else 0.0